@@ -0,0 +1,61 @@
+"""Small repeated calls on a large result, with the results pickled into a
+multiprocessing.Pool for every command and with results kept in the
+worker processes that computed them.
+
+    python benchmarks/affinity.py [-n CALLS] [--rows ROWS]
+"""
+from optparse import OptionParser
+import threading
+import time
+import uuid
+
+from orangecontrib.remote.command_processor import CommandProcessor
+from orangecontrib.remote.commands import Create, Call, Promise
+from orangecontrib.remote.results_manager import ResultsManager
+
+
+def execute(command):
+    result_id = str(uuid.uuid4())
+    ResultsManager.register_result(result_id)
+    CommandProcessor.queue((result_id, command))
+    return result_id
+
+
+def measure(affinity, n, rows):
+    worker = CommandProcessor(affinity=affinity)
+    worker_thread = threading.Thread(target=worker.run,
+                                     kwargs={'poll_interval': 0.01})
+    worker_thread.start()
+    try:
+        data = execute(Create(module="numpy.random", class_="random",
+                              args=[[rows, 50]]))
+        ResultsManager.get_result(data, fetch=False)
+
+        start = time.perf_counter()
+        for i in range(n):
+            row = execute(Call(object=Promise(data), method="__getitem__",
+                               args=[i]))
+            ResultsManager.get_result(row)
+        return n / (time.perf_counter() - start)
+    finally:
+        worker.shutdown()
+        worker_thread.join()
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", dest="n", type="int", default=200,
+                      help="Number of calls")
+    parser.add_option("--rows", dest="rows", type="int", default=200000,
+                      help="Rows of the 50 column array the calls index")
+    options, args = parser.parse_args()
+
+    print("Array of %d MB" % (options.rows * 50 * 8 // 2 ** 20))
+    for affinity in (False, True):
+        print("%-18s %8.1f calls/s" % (
+            "worker affinity" if affinity else "pickled to pool",
+            measure(affinity, options.n, options.rows)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Throughput of a local Orange server as the number of clients grows.
+
+One extra client keeps requesting an unfinished result for the whole run
+and a number of idle keep-alive connections stay open; the others poll
+status as fast as they can. Client counts go past the number of handler
+threads.
+
+    python benchmarks/load_test.py [-d SECONDS] [-c 1,2,4,...,128] [-i IDLE]
+"""
+from http.client import HTTPConnection
+from optparse import OptionParser
+import threading
+import time
+
+from orangecontrib.remote.http_server import OrangeHTTPServer, OrangeServer
+from orangecontrib.remote.proxy import ConnectionPool, fetch_from_server
+from orangecontrib.remote.results_manager import ResultsManager
+
+
+def poll_status(server, deadline, counts, index):
+    pool = ConnectionPool()
+    requests = 0
+    while time.perf_counter() < deadline:
+        pool.request(server, "GET", 'status/load_test')
+        requests += 1
+    counts[index] = requests
+    pool.close()
+
+
+def measure(server, clients, duration):
+    counts = [0] * clients
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=poll_status,
+                                args=(server, deadline, counts, i))
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / duration
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-d", dest="duration", type="float", default=2,
+                      help="Seconds per measurement")
+    parser.add_option("-c", dest="clients", default="1,2,4,8,16,32,64,128",
+                      help="Comma separated client counts")
+    parser.add_option("-t", dest="threads", type="int", default=32,
+                      help="Number of server handler threads")
+    parser.add_option("-i", dest="idle", type="int", default=64,
+                      help="Number of idle keep-alive connections")
+    options, args = parser.parse_args()
+
+    OrangeServer.log_message = lambda *args: None
+    httpd = OrangeHTTPServer(('localhost', 0), OrangeServer,
+                             max_threads=options.threads)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    server = httpd.server_address
+
+    ResultsManager.set_result('load_test', 'result')
+    ResultsManager.register_result('never_ready')
+    blocked = threading.Thread(
+        target=fetch_from_server, args=(server, 'object/never_ready'),
+        daemon=True)
+    blocked.start()
+    idle = [HTTPConnection(*server) for _ in range(options.idle)]
+    for connection in idle:
+        connection.request("GET", '/status/load_test')
+        connection.getresponse().read()
+
+    for clients in map(int, options.clients.split(',')):
+        print("{:3d} clients {:8.0f} requests/s".format(
+            clients, measure(server, clients, options.duration)))
+
+    ResultsManager.set_result('never_ready', None)
+    blocked.join()
+    for connection in idle:
+        connection.close()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
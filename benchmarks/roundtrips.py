@@ -0,0 +1,58 @@
+"""Round trips per second to a local Orange server, with and without
+keep-alive connections.
+
+    python benchmarks/roundtrips.py [-n REQUESTS]
+"""
+from http.client import HTTPConnection
+from optparse import OptionParser
+import threading
+import time
+
+from orangecontrib.remote.http_server import OrangeHTTPServer, OrangeServer
+from orangecontrib.remote.proxy import connection_pool, decode_response
+from orangecontrib.remote.results_manager import ResultsManager
+
+
+def new_connection_per_request(server, url):
+    connection = HTTPConnection(*server)
+    connection.request("GET", url)
+    response = connection.getresponse()
+    result = decode_response(response, response.read())
+    connection.close()
+    return result
+
+
+def pooled_connection(server, url):
+    return decode_response(*connection_pool.request(server, "GET", url))
+
+
+def measure(request, server, n):
+    start = time.perf_counter()
+    for i in range(n):
+        request(server, 'status/benchmark')
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", dest="n", type="int", default=2000,
+                      help="Number of requests")
+    options, args = parser.parse_args()
+
+    OrangeServer.log_message = lambda *args: None
+    httpd = OrangeHTTPServer(('localhost', 0), OrangeServer)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    ResultsManager.set_result('benchmark', 'result')
+
+    for name, request in (("new connection", new_connection_per_request),
+                          ("keep-alive pool", pooled_connection)):
+        print("{:<16} {:8.0f} round trips/s".format(
+            name, measure(request, httpd.server_address, options.n)))
+
+    connection_pool.close()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Size and time of serializing Orange tables in the formats the server
+can send: plain pickles and streams, uncompressed and compressed.
+
+    python benchmarks/serialization.py [-r REPEAT] [DATASET ...]
+"""
+from optparse import OptionParser
+import io
+import pickle
+import time
+
+import Orange
+
+from orangecontrib.remote.serialization import CODECS, dump_stream, load_stream
+
+DATASETS = ["iris", "housing", "brown-selected", "heart_disease"]
+
+
+def measure(dump, load, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        data = dump()
+    dumped = time.perf_counter()
+    for i in range(repeat):
+        load(data)
+    loaded = time.perf_counter()
+    return len(data), (dumped - start) / repeat, (loaded - dumped) / repeat
+
+
+def stream(table, codec=None):
+    f = io.BytesIO()
+    dump_stream(table, f.write, codec)
+    return f.getvalue()
+
+
+def formats(table):
+    yield "pickle (protocol %d)" % pickle.DEFAULT_PROTOCOL, \
+        lambda: pickle.dumps(table), pickle.loads
+    yield "stream", lambda: stream(table), lambda data: load_stream(io.BytesIO(data))
+    for codec in CODECS:
+        yield "stream + " + codec, lambda codec=codec: stream(table, codec), \
+            lambda data: load_stream(io.BytesIO(data))
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-r", dest="repeat", type="int", default=5,
+                      help="Number of repetitions")
+    parser.add_option("-t", dest="tile", type="int", default=20,
+                      help="Also measure tables tiled this many times")
+    options, datasets = parser.parse_args()
+
+    for name in datasets or DATASETS:
+        table = Orange.data.Table(name)
+        tables = [(name, table)]
+        if options.tile > 1:
+            tables.append(("%s x%d" % (name, options.tile), Orange.data.Table.concatenate(
+                [table] * options.tile)))
+        for label, table in tables:
+            print("%s (%d x %d)" % (label, len(table), len(table.domain.variables)))
+            for format, dump, load in formats(table):
+                size, dump_time, load_time = measure(dump, load, options.repeat)
+                print("  {:<22} {:10.2f} MB {:9.2f} ms dump {:9.2f} ms load".format(
+                    format, size / 2 ** 20, dump_time * 1000, load_time * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
 from contextlib import contextmanager
 import builtins
-import os
 
+from orangecontrib.remote.abort import AbortFlags
 from orangecontrib.remote.command_processor import CommandProcessor
 from orangecontrib.remote.proxy import Proxy, \
-    wrapped_function, wrapped_member, AnonymousProxy
+    wrapped_function, wrapped_member, AnonymousProxy, Batch, Pipeline, Priority, \
+    wait_any, wait_all, get_many
 from orangecontrib.remote.remote_module import ModuleDescription, RemoteModule
 from orangecontrib.remote.state_manager import StateManager
 
@@ -28,9 +29,21 @@ def server(address):
         builtins.__import__ = old_import
 
 
+def batch():
+    return Batch()
+
+
+def priority(level):
+    return Priority(level)
+
+
 def save_state(state):
     return StateManager.save_state(state)
 
 
+def report_progress(**values):
+    return StateManager.report_progress(**values)
+
+
 def aborted():
-    return os.path.exists(os.path.join(CommandProcessor.aborted_commands_path, StateManager.__id__))
+    return AbortFlags.is_set()
@@ -1,5 +1,6 @@
 import logging
-import socketserver
+import os
+import socket
 import threading
 import signal
 
@@ -7,9 +8,13 @@ import Orange
 
 from orangecontrib.remote.remote_module import RemoteModule
 
+from orangecontrib.remote.agents import register_with
 from orangecontrib.remote.command_processor import CommandProcessor
-from orangecontrib.remote.http_server import OrangeServer
+from orangecontrib.remote.http_server import OrangeHTTPServer, OrangeServer
+from orangecontrib.remote.memo import Memo
+from orangecontrib.remote.object_store import ObjectStore
 from orangecontrib.remote.results_manager import ResultsManager
+from orangecontrib.remote.state_manager import StateManager
 
 
 logger = logging.getLogger("orange_server")
@@ -21,6 +26,44 @@ def run_server():
     parser.add_option("-p", "--port", dest="port", default="9465", help="Port number")
     parser.add_option("--host", dest="hostname", default="", help="Host name")
     parser.add_option("-l", "--log-level", dest="log_level", default="ERROR", help="Log level")
+    parser.add_option("-t", "--threads", dest="threads", default="32", help="Number of request handler threads")
+    parser.add_option("--max-memory", dest="max_memory", default=None,
+                      help="Memory available for results in MB")
+    parser.add_option("--result-ttl", dest="result_ttl", default=None,
+                      help="Drop results that were not used for this many seconds")
+    parser.add_option("--spill", dest="spill", action="store_true", default=False,
+                      help="Move results evicted by --max-memory to disk")
+    parser.add_option("--max-disk", dest="max_disk", default=None,
+                      help="Disk space available for spilled results in MB")
+    parser.add_option("--max-blobs", dest="max_blobs", default=None,
+                      help="Memory for uploaded data that clients can refer to by hash in MB")
+    parser.add_option("--blob-ttl", dest="blob_ttl", default=None,
+                      help="Drop uploaded data that was not used for this many seconds")
+    parser.add_option("--affinity", dest="affinity", action="store_true", default=False,
+                      help="Keep results in the worker processes that computed them")
+    parser.add_option("-w", "--workers", dest="workers", default=None,
+                      help="Number of worker processes")
+    parser.add_option("--max-queued", dest="max_queued", default=None,
+                      help="Commands a client can have waiting for execution")
+    parser.add_option("--max-in-flight", dest="max_in_flight", default=None,
+                      help="Commands of a client that can execute at the same time")
+    parser.add_option("--max-queue", dest="max_queue", default=None,
+                      help="Commands of all clients that can wait for execution")
+    parser.add_option("--abort-timeout", dest="abort_timeout", default=None,
+                      help="Seconds an aborted command has to stop before its worker is killed")
+    parser.add_option("--memoize", dest="memoize", default=None,
+                      help="Comma separated patterns of classes and methods whose results are reused "
+                           "for identical commands, e.g. Orange.data.Table,Orange.classification.*")
+    parser.add_option("--memo-size", dest="memo_size", default=None,
+                      help="Memory for memoized results in MB")
+    parser.add_option("--persist-states", dest="persist_states", default=None,
+                      help="Also save states of commands to disk, at most every given seconds")
+    parser.add_option("--coordinator", dest="coordinator", action="store_true", default=False,
+                      help="Execute commands on worker agents that register with this server")
+    parser.add_option("--agent-of", dest="agent_of", default=None,
+                      help="Register as a worker agent of the coordinator at HOST:PORT")
+    parser.add_option("--advertise", dest="advertise", default=None,
+                      help="Host name under which the coordinator reaches this agent")
     options, args = parser.parse_args()
 
     logging.basicConfig(
@@ -31,8 +74,12 @@ def run_server():
     port = int(options.port)
     hostname = options.hostname
 
-    httpd = socketserver.TCPServer((hostname, port), OrangeServer)
-    worker = CommandProcessor()
+    httpd = OrangeHTTPServer((hostname, port), OrangeServer,
+                             max_threads=int(options.threads))
+    worker = CommandProcessor(
+        affinity=options.affinity,
+        processes=int(options.workers) if options.workers else None,
+        coordinator=options.coordinator)
     worker_thread = threading.Thread(
         name='Processing queue',
         target=worker.run,
@@ -50,11 +97,43 @@ def run_server():
         logging.info("Received a shutdown request")
         worker.shutdown()
         httpd.shutdown()
+        httpd.server_close()
         server_thread.join()
         worker_thread.join()
     signal.signal(signal.SIGTERM, shutdown)
     signal.signal(signal.SIGINT, shutdown)
 
+    if options.max_memory is not None:
+        ResultsManager.max_size = int(float(options.max_memory) * 2 ** 20)
+    if options.result_ttl is not None:
+        ResultsManager.ttl = float(options.result_ttl)
+    if options.max_blobs is not None:
+        ResultsManager.max_blob_size = int(float(options.max_blobs) * 2 ** 20)
+    if options.blob_ttl is not None:
+        ResultsManager.blob_ttl = float(options.blob_ttl)
+    if options.spill:
+        ObjectStore.clear()
+        ObjectStore.enabled = True
+    if options.max_disk is not None:
+        ObjectStore.max_size = int(float(options.max_disk) * 2 ** 20)
+
+    if options.abort_timeout is not None:
+        CommandProcessor.abort_timeout = float(options.abort_timeout)
+    if options.memoize:
+        Memo.allowed = [pattern.strip() for pattern in options.memoize.split(",")]
+    if options.memo_size is not None:
+        Memo.max_size = int(float(options.memo_size) * 2 ** 20)
+    if options.persist_states is not None:
+        StateManager.persist_interval = float(options.persist_states)
+    scheduler = CommandProcessor.scheduler
+    if options.max_queued is not None:
+        scheduler.max_queued = int(options.max_queued)
+    if options.max_in_flight is not None:
+        scheduler.max_in_flight = int(options.max_in_flight)
+    if options.max_queue is not None:
+        scheduler.max_total = int(options.max_queue)
+
+    ResultsManager.pin(['contract'])
     ResultsManager.set_result('contract', RemoteModule(
         Orange, exclude=["Orange.test", "Orange.canvas", "Orange.widgets"]))
 
@@ -64,6 +143,14 @@ def run_server():
     print("Starting Orange Server")
     print("Listening on port", port)
 
+    if options.agent_of is not None:
+        host, _, coordinator_port = options.agent_of.rpartition(":")
+        address = (options.advertise or hostname or socket.gethostname(),
+                   httpd.server_address[1])
+        register_with((host, int(coordinator_port)), address,
+                      int(options.workers) if options.workers else os.cpu_count())
+        print("Registered with coordinator", options.agent_of)
+
 
 if __name__ == "__main__":
     run_server()
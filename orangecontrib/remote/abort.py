@@ -0,0 +1,78 @@
+""" Abort flags shared between the server and worker processes.
+
+Each dispatched command gets a slot in a shared memory array. The server
+sets the flag in the slot to abort the command and the command checks it
+with orangecontrib.remote.aborted(), which only reads a byte. Workers also
+record their pid in the slot, so the server can kill a worker that does
+not stop in time.
+"""
+import collections
+import multiprocessing
+import os
+import threading
+
+
+class AbortFlags:
+    size = 2 ** 16
+
+    flags = None
+    pids = None
+    # slot of the command executing in this process
+    slot = None
+
+    free = collections.deque()
+    lock = threading.Lock()
+
+    @classmethod
+    def create(cls):
+        """Allocate shared memory. Must be called before starting workers."""
+        if cls.flags is None:
+            cls.flags = multiprocessing.RawArray('b', cls.size)
+            cls.pids = multiprocessing.RawArray('i', cls.size)
+            cls.free.extend(range(cls.size))
+        return cls.flags, cls.pids
+
+    @classmethod
+    def attach(cls, flags, pids):
+        """Use shared memory in a worker process."""
+        cls.flags, cls.pids = flags, pids
+
+    @classmethod
+    def acquire(cls):
+        """Return a free slot, or None if there are none."""
+        with cls.lock:
+            return cls.free.popleft() if cls.free else None
+
+    @classmethod
+    def release(cls, slot):
+        if slot is None:
+            return
+        cls.flags[slot] = 0
+        cls.pids[slot] = 0
+        with cls.lock:
+            cls.free.append(slot)
+
+    @classmethod
+    def set(cls, slot):
+        cls.flags[slot] = 1
+
+    @classmethod
+    def pid(cls, slot):
+        return cls.pids[slot]
+
+    @classmethod
+    def enter(cls, slot):
+        """Mark the start of a command in a worker process."""
+        cls.slot = slot
+        if slot is not None:
+            cls.pids[slot] = os.getpid()
+
+    @classmethod
+    def exit(cls):
+        if cls.slot is not None:
+            cls.pids[cls.slot] = 0
+        cls.slot = None
+
+    @classmethod
+    def is_set(cls):
+        return cls.slot is not None and cls.flags[cls.slot] == 1
@@ -0,0 +1,337 @@
+""" Execution of commands on worker agents on other machines.
+
+A worker agent is an Orange server started with --agent-of, which
+registers with a coordinator server. The coordinator places each command
+on an agent: on the agent that holds the results the command uses, or on
+the least loaded one. Results stay on the agent that computed them and the
+coordinator keeps a placeholder. They are fetched only when a client
+downloads them or when a command on another agent needs them.
+"""
+import json
+import logging
+import threading
+from http.client import HTTPException
+
+from orangecontrib.remote.commands import Abort, ExecutionFailed, Promise
+from orangecontrib.remote.proxy import connection_pool, decode_response, \
+    read_response, result_releaser
+from orangecontrib.remote.results_manager import ResultsManager, ExternalResult
+from orangecontrib.remote.serialization import dumps, request_headers
+
+
+class AgentResult(ExternalResult):
+    """Result that is kept on a worker agent."""
+    def __init__(self, agent, id, size):
+        self.agent = agent
+        self.id = id
+        self.size = size
+
+    def fetch(self):
+        return self.agent.fetch(self.id)
+
+    def release(self):
+        self.agent.release(self.id)
+
+
+class Agent:
+    """Coordinator side of a worker agent."""
+    logger = logging.getLogger("agents")
+    # Results up to this size are moved to the coordinator when they are
+    # computed; larger ones stay on the agent.
+    max_plain_size = 2 ** 16
+    # Longest time a request waits for results on the agent
+    poll_timeout = 5
+    # Largest number of ids in one wait request
+    max_wait_ids = 500
+    # Seconds between requests for results after a request failed
+    retry_interval = 1
+
+    def __init__(self, address, processes, on_completed, on_exit=None):
+        self.address = tuple(address)
+        self.processes = max(int(processes), 1)
+        self.on_completed = on_completed
+        self.on_exit = on_exit
+        self.alive = True
+        # agent's result id -> (coordinator's result id, command)
+        self.executing = {}
+        # agent's result id -> (coordinator's result id, AgentResult)
+        self.residents = {}
+        self.condition = threading.Condition()
+        self.watcher = threading.Thread(
+            name='Agent %s:%s results' % self.address, target=self.watch,
+            daemon=True)
+        self.watcher.start()
+
+    @property
+    def load(self):
+        return len(self.executing) / self.processes
+
+    def execute(self, id, command):
+        response, data = self.post(command)
+        if response.status != 200:
+            raise RuntimeError("Agent %s:%s rejected the command: %s" %
+                               (self.address + (response.reason,)))
+        agent_id = decode_response(response, data)
+        with self.condition:
+            self.executing[agent_id] = id, command
+            self.condition.notify()
+        return agent_id
+
+    def abort(self, id):
+        for agent_id, (executing_id, _) in list(self.executing.items()):
+            if executing_id == id:
+                try:
+                    self.post(Abort(id=agent_id))
+                except (OSError, HTTPException) as err:
+                    self.logger.warning("Abort of %s on agent %s:%s failed: %s",
+                                        id, *self.address, err)
+
+    def post(self, command):
+        # The agent keeps results until the coordinator deletes them.
+        try:
+            return connection_pool.request(
+                self.address, "POST", "/execute", dumps(command),
+                {"Content-Type": "application/octet-stream",
+                 "X-Orange-Keep": "1"})
+        except (OSError, HTTPException):
+            # Only this response may be lost, e.g. when the agent closed a
+            # kept-alive connection; the request is not sent again.
+            if not self.reachable():
+                self.exited()
+            raise
+
+    def reachable(self):
+        """Return whether the agent answers a request for status, which,
+        unlike commands, is sent again if a kept-alive connection fails."""
+        try:
+            response, _ = connection_pool.request(
+                self.address, "GET", "status/agent")
+        except (OSError, HTTPException):
+            return False
+        return response.status == 200
+
+    def fetch(self, id):
+        try:
+            response, value = connection_pool.request(
+                self.address, "GET", "object/" + id, headers=request_headers(),
+                read=read_response)
+        except (OSError, HTTPException):
+            raise KeyError(id)
+        if response.status != 200:
+            raise KeyError(id)
+        return value
+
+    def release(self, id):
+        self.residents.pop(id, None)
+        if self.alive:
+            result_releaser.start()
+            result_releaser.release(self.address, id)
+
+    def watch(self):
+        while self.alive:
+            with self.condition:
+                self.condition.wait_for(lambda: self.executing or not self.alive)
+                ids = list(self.executing)[:self.max_wait_ids]
+            if not self.alive:
+                break
+            try:
+                response, data = self.wait_any(ids, self.poll_timeout)
+                if response.status == 404 and len(ids) > 1:
+                    ids = [id for id in ids
+                           if self.wait_any([id], 0)[0].status == 404]
+            except (OSError, HTTPException) as err:
+                self.failed(err)
+                continue
+            if response.status == 404:
+                # Results unknown to the agent fail, others keep waiting.
+                for agent_id in ids:
+                    self.missing(agent_id)
+                continue
+            if response.status != 200:
+                self.failed(response.reason)
+                continue
+            for agent_id in decode_response(response, data):
+                self.completed(agent_id)
+
+    def failed(self, reason):
+        """Give up the agent if it does not answer after a request for
+        results failed. Otherwise wait a while before the next request."""
+        if not self.reachable():
+            self.logger.warning("Agent %s:%s is not reachable: %s",
+                                *self.address, reason)
+            self.exited()
+            return
+        self.logger.warning("Request to agent %s:%s failed: %s",
+                            *self.address, reason)
+        with self.condition:
+            self.condition.wait_for(lambda: not self.alive, self.retry_interval)
+
+    def wait_any(self, ids, timeout):
+        return connection_pool.request(
+            self.address, "GET", "wait_any/%s?timeout=%s" % (",".join(ids), timeout))
+
+    def missing(self, agent_id):
+        with self.condition:
+            if agent_id not in self.executing:
+                return
+            id, command = self.executing.pop(agent_id)
+        self.on_completed((id, ExecutionFailed(command, KeyError(
+            "Result %s is not on agent %s:%s" % ((agent_id,) + self.address))),
+            None))
+
+    def completed(self, agent_id):
+        with self.condition:
+            if agent_id not in self.executing:
+                return
+            id, command = self.executing.pop(agent_id)
+        try:
+            response, data = connection_pool.request(
+                self.address, "GET", "info/" + agent_id)
+            info = decode_response(response, data)
+            if info['failed'] or info['size'] <= self.max_plain_size:
+                result = self.fetch(agent_id)
+                self.release(agent_id)
+            else:
+                result = AgentResult(self, agent_id, info['size'])
+                self.residents[agent_id] = id, result
+        except Exception as err:
+            result = ExecutionFailed(command, err)
+        self.on_completed((id, result, None))
+
+    def exited(self):
+        with self.condition:
+            if not self.alive:
+                return
+            self.alive = False
+            executing = list(self.executing.values())
+            self.executing.clear()
+            residents = list(self.residents.values())
+            self.residents.clear()
+            self.condition.notify_all()
+        error = RuntimeError("Agent %s:%s exited" % self.address)
+        for id, command in executing:
+            self.on_completed((id, ExecutionFailed(command, error), None))
+        # The results that were kept on the agent are lost.
+        for id, result in residents:
+            ResultsManager.replace_result(id, result, ExecutionFailed(id, error))
+        if self.on_exit is not None:
+            self.on_exit(self)
+
+
+class AgentPool:
+    """Places commands on registered worker agents."""
+    logger = logging.getLogger("agents")
+
+    def __init__(self, on_completed=None):
+        self.on_completed = on_completed
+        self.agents = {}
+        # ids of commands whose inputs are being moved to their agent
+        self.transfers = set()
+        self.lock = threading.Lock()
+
+    def register(self, address, processes=1):
+        address = tuple(address)
+        with self.lock:
+            old = self.agents.get(address)
+            self.agents[address] = Agent(address, processes, self.on_completed,
+                                         self.remove)
+        self.logger.info("Registered agent %s:%s with %s processes",
+                         address[0], address[1], processes)
+        if old is not None:
+            # The agent was restarted and lost its results.
+            old.exited()
+
+    def remove(self, agent):
+        with self.lock:
+            if self.agents.get(agent.address) is agent:
+                del self.agents[agent.address]
+
+    def submit(self, id, command, abort_slot=None):
+        """Send the command to an agent. Results it uses must be ready."""
+        remote = {}
+        for promise in command.promises():
+            result = ResultsManager.get_result(promise.id, fetch=False)
+            if isinstance(result, AgentResult):
+                remote[promise.id] = result
+
+        agent = self.choose_agent(command, remote)
+
+        def resolve(promise):
+            result = remote.get(promise.id)
+            if result is not None and result.agent is agent:
+                return Promise(result.id)
+            return ResultsManager.get_result(promise.id)
+
+        if all(promise.id in remote and remote[promise.id].agent is agent
+               for promise in command.promises()):
+            command.resolve_promises(resolve)
+            agent.execute(id, command)
+            return
+        # Results are moved on another thread, so that a large transfer
+        # does not hold up dispatching of other commands.
+        with self.lock:
+            self.transfers.add(id)
+        threading.Thread(
+            name='Inputs of %s' % id, target=self.transfer,
+            args=(id, command, agent, resolve), daemon=True).start()
+
+    def transfer(self, id, command, agent, resolve):
+        try:
+            command.resolve_promises(resolve)
+            with self.lock:
+                if id not in self.transfers:
+                    raise RuntimeError("Aborted")
+            agent.execute(id, command)
+        except Exception as err:
+            self.logger.exception(err)
+            self.on_completed((id, ExecutionFailed(command, err), None))
+        with self.lock:
+            aborted = id not in self.transfers
+            self.transfers.discard(id)
+        if aborted:
+            agent.abort(id)
+
+    def choose_agent(self, command, remote):
+        with self.lock:
+            agents = [agent for agent in self.agents.values() if agent.alive]
+        if not agents:
+            raise RuntimeError("No worker agents are registered")
+        local = [result for result in remote.values() if result.agent in agents]
+        obj = getattr(command, 'object', None)
+        if isinstance(obj, Promise) and obj.id in remote and \
+                remote[obj.id].agent in agents:
+            return remote[obj.id].agent
+        if local:
+            return max(local, key=lambda result: result.size).agent
+        return min(agents, key=lambda agent: agent.load)
+
+    def abort(self, id):
+        with self.lock:
+            self.transfers.discard(id)
+            agents = list(self.agents.values())
+        for agent in agents:
+            agent.abort(id)
+
+    def get_stats(self):
+        with self.lock:
+            return [{'address': agent.address, 'processes': agent.processes,
+                     'executing': len(agent.executing)}
+                    for agent in self.agents.values()]
+
+    def terminate(self):
+        with self.lock:
+            agents = list(self.agents.values())
+        for agent in agents:
+            with agent.condition:
+                agent.alive = False
+                agent.condition.notify_all()
+
+
+def register_with(coordinator, address, processes):
+    """Register this server as a worker agent of the coordinator."""
+    response, data = connection_pool.request(
+        coordinator, "POST", "/agents",
+        json.dumps({'address': list(address), 'processes': processes}),
+        {"Content-Type": "application/json"})
+    if response.status != 200:
+        raise RuntimeError("Coordinator refused registration: %s" % response.reason)
@@ -0,0 +1,172 @@
+""" Dependency graph of queued and executed commands.
+
+Commands refer to results of other commands with promises. A command is
+ready as soon as all results it refers to are, so independent branches of
+the graph run in parallel on the execution pool.
+"""
+import collections
+import threading
+import time
+
+from orangecontrib.remote.results_manager import ResultsManager
+
+
+class Node:
+    def __init__(self, id, command, dependencies):
+        self.id = id
+        self.command = command
+        self.description = describe(command)
+        self.dependencies = dependencies
+        self.missing = set()
+        self.state = 'waiting'
+        self.queued = time.time()
+        self.started = self.finished = None
+        # descriptions and timings of stages of pipelines
+        self.stages = [{'command': describe(stage)}
+                       for stage in getattr(command, 'stages', ())]
+
+    def duration(self, now=None):
+        if self.started is None:
+            return 0.
+        return (self.finished or now or time.time()) - self.started
+
+
+def describe(command):
+    if hasattr(command, 'stages'):
+        return "Pipeline %s" % " | ".join(describe(stage) for stage in command.stages)
+    name = getattr(command, 'member', None) or getattr(command, 'method', None)
+    if hasattr(command, 'class_'):
+        name = "%s.%s" % (command.module, command.class_)
+    return "%s %s" % (type(command).__name__, name or '')
+
+
+class CommandGraph:
+    # Number of finished commands whose timings are kept
+    max_finished = 10000
+
+    def __init__(self):
+        self.nodes = collections.OrderedDict()
+        self.finished = collections.deque()
+        # id of a missing result -> ids of commands that wait for it, in
+        # the order they were queued
+        self.waiting = collections.defaultdict(dict)
+        self.lock = threading.Lock()
+
+    def add(self, id, command):
+        """Add a command. Return True if results it needs are ready."""
+        dependencies = list(dict.fromkeys(
+            promise.id for promise in command.promises()))
+        node = Node(id, command, dependencies)
+        with self.lock:
+            node.missing = {dependency for dependency in dependencies
+                            if not ResultsManager.has_result(dependency)}
+            for dependency in node.missing:
+                self.waiting[dependency][id] = True
+            if not node.missing:
+                node.state = 'ready'
+            self.nodes[id] = node
+        return not node.missing
+
+    def result_ready(self, id):
+        """Return (id, command) pairs of commands that became ready."""
+        ready = []
+        with self.lock:
+            for waiting_id in self.waiting.pop(id, ()):
+                node = self.nodes.get(waiting_id)
+                if node is None or node.state != 'waiting':
+                    continue
+                node.missing.discard(id)
+                if not node.missing:
+                    node.state = 'ready'
+                    ready.append((node.id, node.command))
+        return ready
+
+    def running(self, id):
+        with self.lock:
+            node = self.nodes.get(id)
+            if node is not None:
+                node.state = 'running'
+                node.command = None
+                node.started = time.time()
+
+    def done(self, id, started=None, finished=None, stages=None):
+        """Mark the command as done. Pipelines also report (started,
+        finished) of each stage."""
+        with self.lock:
+            node = self.nodes.get(id)
+            if node is None:
+                return
+            node.state = 'done'
+            for stage, (stage_started, stage_finished) in zip(node.stages, stages or ()):
+                stage.update(started=stage_started, finished=stage_finished,
+                             duration=stage_finished - stage_started)
+            node.command = None
+            node.finished = finished or time.time()
+            node.started = started or node.started or node.finished
+            self.finished.append(id)
+            while len(self.finished) > self.max_finished:
+                self.nodes.pop(self.finished.popleft(), None)
+
+    def cancel(self, id):
+        """Remove a command that waits for its inputs. Return the command,
+        or None if it is not waiting."""
+        with self.lock:
+            node = self.nodes.get(id)
+            if node is None or node.state != 'waiting':
+                return None
+            command = node.command
+            node.state = 'cancelled'
+            return command
+
+    def describe(self, id):
+        """Return the command with the commands it depends on, their
+        timings and the critical path leading to it."""
+        now = time.time()
+        with self.lock:
+            if id not in self.nodes:
+                raise KeyError(id)
+            nodes, stack = {}, [id]
+            while stack:
+                node = self.nodes.get(stack.pop())
+                if node is None or node.id in nodes:
+                    continue
+                nodes[node.id] = node
+                stack.extend(node.dependencies)
+
+            path_to = {}
+
+            def critical_path(node_id):
+                # longest path by duration that ends in node_id
+                if node_id not in path_to:
+                    node = nodes[node_id]
+                    paths = [critical_path(dependency)
+                             for dependency in node.dependencies
+                             if dependency in nodes]
+                    duration, path = max(paths, default=(0., []),
+                                         key=lambda p: p[0])
+                    path_to[node_id] = (duration + node.duration(now),
+                                        path + [node_id])
+                return path_to[node_id]
+
+            # Iterate in insertion order, which is topological, to keep the
+            # recursion shallow.
+            for node_id in self.nodes:
+                if node_id in nodes:
+                    critical_path(node_id)
+            duration, path = path_to[id]
+
+            return {
+                'nodes': {
+                    node.id: {
+                        'command': node.description,
+                        'state': node.state,
+                        'dependencies': [d for d in node.dependencies if d in nodes],
+                        'queued': node.queued,
+                        'started': node.started,
+                        'finished': node.finished,
+                        'duration': node.duration(now),
+                        'stages': [dict(stage) for stage in node.stages],
+                    } for node in nodes.values()},
+                'critical_path': path,
+                'critical_path_duration': duration,
+            }
@@ -2,78 +2,206 @@ import logging
 import multiprocessing
 import os
 import queue
-from orangecontrib.remote.commands import execute_command, Abort
-from orangecontrib.remote.results_manager import ResultsManager
+import signal
+import threading
+from orangecontrib.remote.abort import AbortFlags
+from orangecontrib.remote.agents import AgentPool
+from orangecontrib.remote.command_graph import CommandGraph
+from orangecontrib.remote.commands import Abort, ExecutionFailed, \
+    initialize_worker
+from orangecontrib.remote.memo import Memo
+from orangecontrib.remote.results_manager import ResultsManager, ExternalResult
+from orangecontrib.remote.scheduler import Scheduler, PRIORITIES
+from orangecontrib.remote.shared_data import SharedResult, execute_shared
 from orangecontrib.remote.state_manager import StateManager
+from orangecontrib.remote.worker_pool import WorkerPool
 
 
 class CommandProcessor:
     logger = logging.getLogger("worker")
-    aborted_commands_path = \
-        os.path.join(os.path.dirname(__file__), 'aborted_commands')
-    if not os.path.exists(aborted_commands_path):
-        os.mkdir(aborted_commands_path)
+    # Seconds an aborted command has to stop before its worker is killed
+    abort_timeout = 10
 
-    _execution_queue = queue.Queue()
+    # Commands whose inputs are ready, by priority and client
+    scheduler = Scheduler()
+    # result id -> ids of results its command needs
+    _pinned_results = {}
+    # Dependencies between commands; commands are queued for execution
+    # when results they need are ready.
+    graph = CommandGraph()
+    # Worker agents of a coordinator
+    agents = None
 
-    def __init__(self):
+    def __init__(self, affinity=False, processes=None, coordinator=False):
         self._is_running = True
         self.executing_commands = set()
+        # Keep results in the worker processes that computed them.
+        self.affinity = affinity
+        self.processes = processes
+        # Execute commands on registered worker agents instead of locally.
+        self.coordinator = coordinator
+        # result id -> AbortFlags slot of dispatched commands
+        self.abort_slots = {}
+        self.killed = set()
+        self.lock = threading.Lock()
 
     def run(self, poll_interval=1):
         self.logger.info("Worker started")
-        execution_pool = multiprocessing.Pool()
+        state_channel = multiprocessing.Queue()
+        state_thread = threading.Thread(
+            name='Worker states', target=StateManager.listen,
+            args=(state_channel,), daemon=True)
+        state_thread.start()
+        initargs = (AbortFlags.create(), state_channel)
+        if self.coordinator:
+            execution_pool = CommandProcessor.agents = AgentPool(self.on_completed)
+        elif self.affinity:
+            execution_pool = WorkerPool(self.processes, self.on_completed, initargs)
+        else:
+            execution_pool = multiprocessing.Pool(
+                self.processes, initializer=initialize_worker, initargs=initargs)
+        ResultsManager.listeners.append(self.release_waiting)
 
         while self._is_running:
             try:
-                result_id, command = self._execution_queue.get(block=True, timeout=poll_interval)
+                result_id, command = self.scheduler.get(block=True, timeout=poll_interval)
                 self.logger.info("Received command " + result_id)
 
                 if isinstance(command, Abort):
                     self.abort_command(command.id)
                 else:
-                    command.resolve_promises()
-                    self.logger.debug("Queueing %s for execution" % result_id)
-                    self.set_executing(result_id)
-                    execution_pool.apply_async(execute_command, [result_id, command], callback=self.on_completed)
+                    self.dispatch(execution_pool, result_id, command)
 
             except queue.Empty:
                 continue
 
+        ResultsManager.listeners.remove(self.release_waiting)
         self.logger.debug("Terminating execution pool")
         execution_pool.terminate()
-        self.logger.debug("Joining execution pool")
-        execution_pool.join()
+        if not self.affinity and not self.coordinator:
+            self.logger.debug("Joining execution pool")
+            execution_pool.join()
+        if self.coordinator:
+            CommandProcessor.agents = None
+        state_channel.put(None)
+        state_thread.join()
         self.logger.info("Worker is no more")
 
+    def dispatch(self, execution_pool, result_id, command):
+        self.logger.debug("Queueing %s for execution" % result_id)
+        slot = self.set_executing(result_id)
+        try:
+            if self.affinity or self.coordinator:
+                execution_pool.submit(result_id, command, slot)
+            else:
+                command.resolve_promises(SharedResult.share)
+                execution_pool.apply_async(execute_shared, [result_id, command, slot], callback=self.on_completed)
+        except Exception as err:
+            self.logger.exception(err)
+            self.on_completed((result_id, ExecutionFailed(command, err), None))
+            # the command did not reach a worker, which would end its records
+            StateManager.delete_state(result_id, force=True)
+
     def on_completed(self, result):
-        id, result = result
+        id, result, timing = result
+        if isinstance(result, SharedResult):
+            result.track()
+        with self.lock:
+            if id in self.killed:
+                # finished just before its worker was killed
+                self.killed.discard(id)
+                if isinstance(result, ExternalResult):
+                    result.release()
+                return
+            AbortFlags.release(self.abort_slots.pop(id, None))
+        self.complete(id, result, timing)
+
+    def complete(self, id, result, timing=None):
         self.logger.debug("Received result: " + id)
+        self.graph.done(id, *timing or ())
+        self.scheduler.done(id)
+        Memo.completed(id, result)
         ResultsManager.set_result(id, result)
-        StateManager.delete_state(id)
+        ResultsManager.unpin(self._pinned_results.pop(id, ()))
+        # Agents keep states and progress of their commands to themselves.
+        StateManager.delete_state(id, force=self.coordinator)
         self.set_done(id)
 
+    @classmethod
+    def release_waiting(cls, id):
+        for ready_id, command in cls.graph.result_ready(id):
+            cls.scheduler.put(ready_id, command)
+
     def set_executing(self, id):
+        """Mark the command as executing and return its abort slot."""
+        self.graph.running(id)
         self.executing_commands.add(id)
+        slot = self.abort_slots[id] = AbortFlags.acquire()
+        return slot
 
     def set_done(self, id):
-        self.executing_commands.remove(id)
-        abort_path = os.path.join(self.aborted_commands_path, id)
-        if os.path.exists(abort_path):
-            os.remove(abort_path)
+        self.executing_commands.discard(id)
 
     def abort_command(self, id):
-        with open(os.path.join(self.aborted_commands_path, id), 'w'):
-            pass
+        waiting = self.graph.cancel(id)
+        if waiting is None:
+            # Ready, but held back by the limit of commands in flight
+            waiting = self.scheduler.remove(id)
+        if waiting is not None:
+            self.on_completed((id, ExecutionFailed(waiting, RuntimeError("Aborted")), None))
+            StateManager.delete_state(id, force=True)
+            return
+        slot = self.abort_slots.get(id)
+        if slot is None:
+            return
+        if self.coordinator:
+            self.agents.abort(id)
+            return
+        AbortFlags.set(slot)
+        timer = threading.Timer(self.abort_timeout, self.kill, [id, slot])
+        timer.daemon = True
+        timer.start()
+
+    def kill(self, id, slot):
+        """Kill the worker process of an aborted command that is still
+        running, so its place in the pool is freed."""
+        with self.lock:
+            if self.abort_slots.get(id) != slot or not AbortFlags.pid(slot):
+                return
+            self.logger.warning("Killing worker of %s, which did not stop", id)
+            os.kill(AbortFlags.pid(slot), signal.SIGKILL)
+            if self.affinity:
+                # The worker pool fails its commands and replaces it.
+                return
+            AbortFlags.release(self.abort_slots.pop(id))
+            self.killed.add(id)
+        # multiprocessing.Pool replaces the process, but loses the task.
+        self.complete(id, ExecutionFailed(id, RuntimeError("Killed after abort")))
+        StateManager.delete_state(id, force=True)
 
     @classmethod
     def queue(cls, command):
-        cls._execution_queue.put(command)
+        result_id, command = command
+        memoized, value = Memo.lookup(result_id, command)
+        if memoized:
+            cls.graph.add(result_id, command)
+            cls.graph.done(result_id)
+            cls.scheduler.done(result_id)
+            ResultsManager.set_result(result_id, value)
+            return
+        required = [promise.id for promise in command.promises()]
+        if required:
+            ResultsManager.pin(required)
+            cls._pinned_results[result_id] = required
+        if isinstance(command, Abort):
+            cls.scheduler.put(result_id, command, PRIORITIES['high'])
+        elif cls.graph.add(result_id, command):
+            cls.scheduler.put(result_id, command)
 
     def shutdown(self):
         self.logger.info("Received a shutdown request")
         if self.executing_commands:
             self.logger.debug("Active tasks: " + str(self.executing_commands))
-            for command in self.executing_commands:
+            for command in list(self.executing_commands):
                 self.abort_command(command)
         self._is_running = False
@@ -1,7 +1,9 @@
 """ Commands that can be executed on the server. """
 import importlib
 import logging
+import time
 
+from orangecontrib.remote.abort import AbortFlags
 from orangecontrib.remote.results_manager import ResultsManager
 from orangecontrib.remote.state_manager import StateManager
 
@@ -33,8 +35,49 @@ class Command:
     def execute(self):
         raise NotImplementedError()
 
-    def resolve_promises(self):
-        pass
+    def resolve_promises(self, resolve=None, kind=None):
+        """Replace promises in object, args and kwargs with their results,
+        or with what resolve returns for them."""
+        resolve = resolve or Promise.get
+        kind = kind or Promise
+        for attr_name in ("object", "args", "kwargs"):
+            if hasattr(self, attr_name):
+                setattr(self, attr_name,
+                        replace_promises(getattr(self, attr_name), resolve, kind))
+
+    def promises(self, kind=None):
+        for attr_name in ("object", "args", "kwargs"):
+            yield from iter_promises(getattr(self, attr_name, None), kind or Promise)
+
+
+def iter_promises(value, kind=Promise):
+    if isinstance(value, kind):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from iter_promises(item, kind)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from iter_promises(item, kind)
+
+
+def replace_promises(value, resolve, kind=Promise):
+    """Return value with promises replaced. Containers without promises
+    are returned as they are, not copied."""
+    if isinstance(value, kind):
+        return resolve(value)
+    elif isinstance(value, (list, tuple)):
+        items = [replace_promises(item, resolve, kind) for item in value]
+        if all(new is old for new, old in zip(items, value)):
+            return value
+        return type(value)(items)
+    elif isinstance(value, dict):
+        items = {key: replace_promises(item, resolve, kind)
+                 for key, item in value.items()}
+        if all(items[key] is item for key, item in value.items()):
+            return value
+        return items
+    return value
 
 
 class Create(Command):
@@ -63,7 +106,6 @@ class Call(Command):
     kwargs = {}
 
     def execute(self):
-        self.resolve_promises("object", "args", "kwargs")
         return getattr(self.object, self.method)(*self.args, **self.kwargs)
 
     def __str__(self):
@@ -73,16 +115,6 @@ class Call(Command):
             repr(self.object), self.method, ", ".join(map(repr, args))
         )
 
-    def resolve_promises(self, *args):
-        for attr_name in ("object", "args"):
-            attr = getattr(self, attr_name)
-            if isinstance(attr, Promise):
-                setattr(self, attr_name, attr.get())
-            elif isinstance(attr, list):
-                for i, value in enumerate(attr):
-                    if isinstance(value, Promise):
-                        attr[i] = value.get()
-
 
 class Get(Command):
     object = ""
@@ -99,6 +131,66 @@ class Abort(Command):
     id = ""
 
 
+class Stage:
+    """Result of an earlier stage of a pipeline."""
+    def __init__(self, index):
+        self.index = index
+
+
+class Pipeline(Command):
+    """Execute commands one after another in the same worker.
+
+    Stages refer to results of earlier stages with Stage. Intermediate
+    results stay in the worker; the pipeline returns the result of the last
+    stage, or a list of results of stages listed in outputs.
+    """
+    stages = ()
+    outputs = None
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.timings = []
+        for i, stage in enumerate(self.stages):
+            if not isinstance(stage, Command) or isinstance(stage, (Pipeline, Abort)):
+                raise ValueError("Stage %d is not a command" % i)
+            for reference in stage.promises(Stage):
+                if not 0 <= reference.index < i:
+                    raise ValueError("Stage %d refers to stage %s" % (i, reference.index))
+        if not self.stages:
+            raise ValueError("Pipeline has no stages")
+        for output in self.outputs or ():
+            if not 0 <= output < len(self.stages):
+                raise ValueError("Unknown output stage %s" % output)
+
+    def execute(self):
+        values = []
+        self.timings = []
+        for i, stage in enumerate(self.stages):
+            if AbortFlags.is_set():
+                raise RuntimeError("Aborted before stage %d" % i)
+            stage.resolve_promises(lambda reference: values[reference.index], Stage)
+            started = time.time()
+            try:
+                values.append(stage.execute())
+            except Exception as err:
+                raise RuntimeError("Stage {} ({}) failed: {}".format(i, stage, err)) from err
+            self.timings.append((started, time.time()))
+        if self.outputs is None:
+            return values[-1]
+        return [values[output] for output in self.outputs]
+
+    def resolve_promises(self, resolve=None, kind=None):
+        for stage in self.stages:
+            stage.resolve_promises(resolve, kind)
+
+    def promises(self, kind=None):
+        for stage in self.stages:
+            yield from stage.promises(kind)
+
+    def __str__(self):
+        return " | ".join(map(str, self.stages))
+
+
 logger = logging.getLogger("worker")
 
 
@@ -117,6 +209,30 @@ def execute_command(id, command):
         return id, ExecutionFailed(command, err)
 
 
+def initialize_worker(abort_flags, state_channel):
+    """Connect a worker process to the shared abort flags and to the queue
+    that carries states to the server."""
+    AbortFlags.attach(*abort_flags)
+    StateManager.channel = state_channel
+
+
+def execute_timed(id, command, abort_slot=None):
+    """Execute the command and also return when it started and finished.
+    Commands aborted before they started are not executed."""
+    started = time.time()
+    AbortFlags.enter(abort_slot)
+    try:
+        if AbortFlags.is_set():
+            return id, ExecutionFailed(command, RuntimeError("Aborted")), None
+        id, value = execute_command(id, command)
+    finally:
+        AbortFlags.exit()
+        StateManager.end(id)
+    if isinstance(command, Pipeline):
+        return id, value, (started, time.time(), command.timings)
+    return id, value, (started, time.time())
+
+
 class ExecutionFailed:
     def __init__(self, command=None, error=None):
         if not command or not error:
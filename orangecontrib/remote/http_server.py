@@ -3,46 +3,364 @@ from http.server import BaseHTTPRequestHandler
 import io
 import json
 import logging
+import math
 import pickle
+import queue
+import selectors
 import shutil
+import socket
+import socketserver
+import threading
+import time
+import urllib.parse
 import uuid
+
+import numpy as np
+
 from orangecontrib.remote.command_processor import CommandProcessor
 from orangecontrib.remote.commands import Command, Create, Call, Get, Promise, \
-    Abort
-from orangecontrib.remote.results_manager import ResultsManager
+    Abort, Pipeline, Stage, ExecutionFailed
+from orangecontrib.remote.memo import Memo
+from orangecontrib.remote.object_store import ObjectStore
+from orangecontrib.remote.results_manager import ResultsManager, BLOB_PREFIX, \
+    ExternalResult, estimate_size
+from orangecontrib.remote.scheduler import Overloaded, PRIORITIES, NORMAL
+from orangecontrib.remote.serialization import STREAM_CONTENT_TYPE, \
+    COMMAND_CONTENT_TYPE, dump_stream, decode_command, deserialize_data, \
+    content_hash, dumps, negotiate
 from orangecontrib.remote.state_manager import StateManager
 
 
+READY = pickle.dumps('ready')
+NOT_READY = pickle.dumps('not ready')
+# Commands on worker agents report states and progress only to the agent
+ON_AGENTS = "States and progress of commands on worker agents are not available"
+
+
+class UnknownBlob(KeyError):
+    """A command refers to data the server does not have (anymore)."""
+
+
+def is_result_id(id):
+    """Return True if a client chosen id is a UUID in canonical form.
+
+    Ids end up in URLs and file names, and blobs are stored under ids
+    derived from their content, so other ids are not accepted."""
+    try:
+        return isinstance(id, str) and str(uuid.UUID(id)) == id
+    except ValueError:
+        return False
+
+
+def make_read_only(value):
+    """Protect arrays of an array or a table from changes."""
+    arrays = [value] if isinstance(value, np.ndarray) else \
+        [getattr(value, name, None) for name in ('X', 'Y', 'metas', 'W')]
+    for array in arrays:
+        if not isinstance(array, np.ndarray):
+            # scipy.sparse matrices keep their values in .data
+            array = getattr(array, 'data', None)
+        if isinstance(array, np.ndarray):
+            array.flags.writeable = False
+
+
+class OrangeHTTPServer(socketserver.TCPServer):
+    """TCP server that handles requests on a fixed pool of threads.
+
+    Requests that block (e.g. a long poll for a result that is not ready
+    yet) occupy one handler thread while the others keep serving. Idle
+    keep-alive connections do not hold a thread: they wait in a selector
+    until the client sends the next request.
+    """
+    allow_reuse_address = True
+    keeps_idle_connections = True
+    # Seconds an idle keep-alive connection is kept open
+    idle_timeout = 60
+
+    def __init__(self, server_address, RequestHandlerClass, max_threads=32):
+        super().__init__(server_address, RequestHandlerClass)
+        self._requests = queue.Queue()
+        self._parked = []
+        self._closed = False
+        self._idle_lock = threading.Lock()
+        self._wakeup, self._wakeup_write = socket.socketpair()
+        self._wakeup_write.setblocking(False)
+        self._idle_watcher = threading.Thread(
+            name='HTTP idle connections', target=self._watch_idle, daemon=True)
+        self._idle_watcher.start()
+        self._handlers = []
+        for i in range(max_threads):
+            handler = threading.Thread(
+                name='HTTP handler %d' % i,
+                target=self._handle_requests,
+                daemon=True
+            )
+            handler.start()
+            self._handlers.append(handler)
+
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+
+    def _handle_requests(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+
+            request, client_address = item
+            idle = False
+            try:
+                idle = self.finish_request(request, client_address).idle
+            except Exception:
+                self.handle_error(request, client_address)
+            if idle:
+                self.park(request, client_address)
+            else:
+                self.shutdown_request(request)
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def park(self, request, client_address):
+        """Wait for the next request on the connection without a thread."""
+        with self._idle_lock:
+            if not self._closed:
+                self._parked.append((request, client_address))
+                self._wake()
+                return
+        self.shutdown_request(request)
+
+    def _wake(self):
+        try:
+            self._wakeup_write.send(b"\0")
+        except BlockingIOError:
+            # the watcher has not read the earlier wake-ups yet
+            pass
+
+    def _watch_idle(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup, selectors.EVENT_READ)
+        while True:
+            events = selector.select(timeout=1)
+            now = time.monotonic()
+            with self._idle_lock:
+                if self._closed:
+                    break
+                parked, self._parked = self._parked, []
+            for key, _ in events:
+                if key.fileobj is self._wakeup:
+                    self._wakeup.recv(4096)
+                    continue
+                # the client sent the next request (or closed the connection)
+                selector.unregister(key.fileobj)
+                self._requests.put((key.fileobj, key.data[0]))
+            for request, client_address in parked:
+                selector.register(request, selectors.EVENT_READ,
+                                  (client_address, now))
+            for key in list(selector.get_map().values()):
+                if key.fileobj is not self._wakeup and \
+                        now - key.data[1] > self.idle_timeout:
+                    selector.unregister(key.fileobj)
+                    self.shutdown_request(key.fileobj)
+
+        for key in list(selector.get_map().values()):
+            if key.fileobj is not self._wakeup:
+                self.shutdown_request(key.fileobj)
+        selector.close()
+
+    def server_close(self):
+        super().server_close()
+        with self._idle_lock:
+            self._closed = True
+            parked, self._parked = self._parked, []
+            self._wake()
+        for request, _ in parked:
+            self.shutdown_request(request)
+        self._idle_watcher.join()
+        self._wakeup.close()
+        self._wakeup_write.close()
+        for _ in self._handlers:
+            self._requests.put(None)
+
+
+def to_json(o):
+    """Convert numpy values in progress records to JSON."""
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    return str(o)
+
+
+class ChunkedWriter:
+    """Write data to a file using HTTP chunked transfer encoding.
+
+    Small writes are collected into chunks of at least chunk_size bytes,
+    larger ones are sent as they are.
+    """
+    def __init__(self, file, chunk_size=2 ** 16):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        if len(self.buffer) + len(data) < self.chunk_size:
+            self.buffer += data
+            return
+        self.flush()
+        self.write_chunk(data)
+
+    def flush(self):
+        if self.buffer:
+            self.write_chunk(self.buffer)
+            self.buffer = bytearray()
+
+    def write_chunk(self, data):
+        self.file.write(b"%x\r\n" % len(data))
+        self.file.write(data)
+        self.file.write(b"\r\n")
+
+    def close(self):
+        self.flush()
+        self.file.write(b"0\r\n\r\n")
+
+
 class OrangeServer(BaseHTTPRequestHandler):
     logger = logging.getLogger("http")
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    # Close connections that stall in the middle of a request, and idle
+    # keep-alive connections of servers that do not park them.
+    timeout = 15
+    # Upper bound for a single blocking request: a long poll to /wait, a
+    # GET for a result that is not ready or a part of a /progress stream.
+    max_wait = 30
 
     def __init__(self, request, client_address, server):
+        # True if the connection waits for the next request
+        self.idle = False
         super(OrangeServer, self).__init__(request, client_address, server)
 
+    def handle(self):
+        """Handle requests on the connection. Once the client has not sent
+        the next one yet, return the idle connection to the server, which
+        waits for it without occupying a thread."""
+        parks = getattr(self.server, 'keeps_idle_connections', False)
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if parks and not self.request_pending():
+                self.idle = True
+                return
+            self.handle_one_request()
+
+    def request_pending(self):
+        """Return True if (a part of) the next request has arrived."""
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
     def do_GET(self):
         f = None
         try:
-            resource = self.path.strip("/")
+            url = urllib.parse.urlsplit(self.path)
+            query = urllib.parse.parse_qs(url.query)
+            resource = url.path.strip("/")
             result_type, resource_id = resource.split("/")
+            stream, protocol, codec = negotiate(self.headers)
 
             if result_type == 'object':
+                if ResultsManager.awaiting_result(resource_id) and \
+                        not ResultsManager.wait_all([resource_id], self.max_wait):
+                    return self.send_not_ready()
                 try:
-                    buf = pickle.dumps(ResultsManager.get_result(resource_id))
+                    result = ResultsManager.get_result(resource_id)
                 except KeyError as err:
                     self.logger.exception(err)
                     return self.send_error(404, "Resource {} not found".format(resource_id))
+                if stream:
+                    return self.send_stream(result, codec)
+                buf = dumps(result, protocol)
 
             elif result_type == 'state':
                 if ResultsManager.has_result(resource_id):
-                    buf = pickle.dumps(ResultsManager.get_result(resource_id))
+                    state = ResultsManager.get_result(resource_id)
+                elif CommandProcessor.agents is not None:
+                    return self.send_error(501, ON_AGENTS)
                 else:
-                    buf = pickle.dumps(StateManager.get_state(resource_id))
+                    state = StateManager.get_state(resource_id)
+                if stream:
+                    return self.send_stream(state, codec)
+                buf = dumps(state, protocol)
+
+            elif result_type == 'progress':
+                if CommandProcessor.agents is not None:
+                    return self.send_error(501, ON_AGENTS)
+                return self.send_events(resource_id)
 
             elif result_type == 'status':
                 if ResultsManager.has_result(resource_id):
-                    buf = pickle.dumps('ready')
+                    buf = READY
+                else:
+                    buf = NOT_READY
+
+            elif result_type == 'blobs':
+                buf = dumps([digest for digest in resource_id.split(",")
+                             if ResultsManager.has_result(BLOB_PREFIX + digest)],
+                            protocol)
+
+            elif result_type == 'contract':
+                return self.send_contract(resource_id)
+
+            elif result_type == 'graph':
+                try:
+                    buf = dumps(CommandProcessor.graph.describe(resource_id), protocol)
+                except KeyError:
+                    return self.send_error(404, "Resource {} not found".format(resource_id))
+
+            elif result_type == 'stats' and resource_id == 'store':
+                buf = dumps(ObjectStore.get_stats(), protocol)
+
+            elif result_type == 'stats' and resource_id == 'scheduler':
+                buf = dumps(CommandProcessor.scheduler.get_stats(), protocol)
+
+            elif result_type == 'stats' and resource_id == 'memo':
+                buf = dumps(Memo.get_stats(), protocol)
+
+            elif result_type == 'stats' and resource_id == 'agents':
+                if CommandProcessor.agents is None:
+                    return self.send_error(404, "Server is not a coordinator")
+                buf = dumps(CommandProcessor.agents.get_stats(), protocol)
+
+            elif result_type == 'info':
+                if not ResultsManager.has_result(resource_id):
+                    return self.send_error(404, "Resource {} not found".format(resource_id))
+                result = ResultsManager.get_result(resource_id, fetch=False)
+                buf = dumps({
+                    'failed': isinstance(result, ExecutionFailed),
+                    'size': result.size if isinstance(result, ExternalResult)
+                    else estimate_size(result)}, protocol)
+
+            elif result_type in ('wait', 'wait_any', 'wait_all'):
+                timeout = min(float(query.get('timeout', [self.max_wait])[0]),
+                              self.max_wait)
+                ids = resource_id.split(",")
+                try:
+                    if result_type == 'wait_any':
+                        ready = ResultsManager.wait_any(ids, timeout)
+                    else:
+                        ready = ResultsManager.wait_all(ids, timeout)
+                except KeyError as err:
+                    return self.send_error(404, "Resource {} not found".format(err))
+
+                if result_type == 'wait':
+                    buf = READY if ready else NOT_READY
                 else:
-                    buf = pickle.dumps('not ready')
+                    buf = dumps(ready, protocol)
 
             else:
                 return self.send_error(400, "Unknown resource type")
@@ -63,45 +381,289 @@ class OrangeServer(BaseHTTPRequestHandler):
                 f.close()
 
     def do_POST(self):
+        if self.path.strip("/") == "batch":
+            return self.do_batch()
+        if self.path.strip("/") == "agents":
+            return self.register_agent()
+
         result_id = str(uuid.uuid1())
         try:
             data = self.parse_post_data()
-            if isinstance(data, Command):
+            if isinstance(data, Abort):
+                # Aborts skip admission and have no result.
+                CommandProcessor.queue((result_id, data))
+            elif isinstance(data, Command):
+                client, priority = self.client_priority()
+                CommandProcessor.scheduler.admit([result_id], client, priority)
                 ResultsManager.register_result(result_id)
+                if self.headers.get("X-Orange-Keep"):
+                    # a coordinator refers to the result until it deletes it
+                    ResultsManager.hold(result_id)
                 CommandProcessor.queue((result_id, data))
             else:
                 ResultsManager.set_result(result_id, data)
+        except Overloaded as err:
+            return self.send_overloaded(err)
+        except UnknownBlob as err:
+            return self.send_error(409, "Unknown blob {}".format(err))
+        except Exception as err:
+            self.logger.exception(err)
+            return self.send_error(400, str(err))
+
+        self.send_data(result_id.encode('utf-8'), "text/html; charset=utf-8")
+
+    def register_agent(self):
+        if CommandProcessor.agents is None:
+            return self.send_error(404, "Server is not a coordinator")
+        try:
+            agent = json.loads(self.read_body().decode('utf-8'))
+            CommandProcessor.agents.register(agent['address'], agent['processes'])
         except Exception as err:
             self.logger.exception(err)
             return self.send_error(400, str(err))
+        self.send_data(b"registered", "text/html; charset=utf-8")
+
+    def do_batch(self):
+        try:
+            result_ids = self.queue_batch(*self.parse_batch(), *self.client_priority())
+        except Overloaded as err:
+            return self.send_overloaded(err)
+        except UnknownBlob as err:
+            return self.send_error(409, "Unknown blob {}".format(err))
+        except Exception as err:
+            self.logger.exception(err)
+            return self.send_error(400, str(err))
+
+        self.send_data(json.dumps(result_ids).encode('utf-8'), "application/json")
+
+    def do_DELETE(self):
+        try:
+            result_type, resource_ids = self.path.strip("/").split("/")
+        except ValueError:
+            return self.send_error(400, "Invalid resource")
+        if result_type != 'object':
+            return self.send_error(400, "Unknown resource type")
+
+        missing = []
+        for resource_id in resource_ids.split(","):
+            try:
+                ResultsManager.delete_result(resource_id)
+            except KeyError:
+                missing.append(resource_id)
+        if missing:
+            return self.send_error(404, "Resource {} not found".format(",".join(missing)))
+
+        self.send_response(204)
+        self.end_headers()
+
+    def client_priority(self):
+        """Return the client id and the priority of the request."""
+        priority = self.headers.get("X-Orange-Priority", "normal")
+        if priority not in PRIORITIES:
+            raise ValueError("Unknown priority '%s'" % priority)
+        return self.headers.get("X-Orange-Client"), PRIORITIES[priority]
+
+    def send_contract(self, modname):
+        """Send description of a module, or 304 if the client has the
+        current version of the contract."""
+        try:
+            contract = ResultsManager.get_result('contract')
+            etag = '"%s"' % contract.version
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            buf = dumps(contract.describe(modname), negotiate(self.headers)[1])
+        except (KeyError, ImportError) as err:
+            return self.send_error(404, str(err))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(buf)))
+        self.end_headers()
+        self.wfile.write(buf)
+
+    def send_overloaded(self, err):
+        self.send_response(err.status, str(err))
+        self.send_header("Retry-After", str(math.ceil(err.retry_after)))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_stream(self, obj, codec=None):
+        self.send_response(200)
+        self.send_header("Content-Type", STREAM_CONTENT_TYPE)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        writer = ChunkedWriter(self.wfile)
+        try:
+            dump_stream(obj, writer.write, codec)
+        except Exception as err:
+            # Headers are already sent, the client will see a truncated
+            # response.
+            self.logger.exception(err)
+            self.close_connection = True
+            return
+        writer.close()
+
+    def send_not_ready(self):
+        """Ask the client to repeat a GET for a result that is not ready."""
+        self.send_response(202, "Not ready")
+        self.send_header("Retry-After", "0")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_events(self, id):
+        """Stream progress records of a command as server-sent events
+        until it completes, or for at most max_wait seconds; the client
+        then reconnects with the id of the last event it received."""
+        if not ResultsManager.has_result(id) and \
+                not ResultsManager.awaiting_result(id):
+            return self.send_error(404, "Resource {} not found".format(id))
+        try:
+            after = int(self.headers.get("Last-Event-ID", 0))
+        except ValueError:
+            after = 0
 
-        encoded = result_id.encode('utf-8')
         self.send_response(200)
-        self.send_header("Content-Type", "text/html; charset=utf-8")
-        self.send_header("Content-Length", str(len(encoded)))
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        writer = ChunkedWriter(self.wfile)
+        deadline = time.monotonic() + self.max_wait
+        try:
+            while time.monotonic() < deadline:
+                records, finished = StateManager.get_progress(
+                    id, after, max(deadline - time.monotonic(), 0))
+                for after, record in records:
+                    writer.write(b"id: %d\ndata: %s\n\n" % (
+                        after, json.dumps(record, default=to_json).encode('utf-8')))
+                if finished or not records and ResultsManager.has_result(id):
+                    writer.write(b"event: done\ndata: {}\n\n")
+                    break
+                if not records:
+                    writer.write(b": keep-alive\n\n")
+                writer.flush()
+            writer.close()
+        except OSError:
+            # the client went away
+            self.close_connection = True
+
+    def send_data(self, data, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
 
         self.end_headers()
 
         f = io.BytesIO()
-        f.write(encoded)
+        f.write(data)
         f.seek(0)
         shutil.copyfileobj(f, self.wfile)
         f.close()
 
+    def parse_batch(self):
+        """Decode a list of [result_id, command] pairs.
+
+        Commands can refer to results of earlier commands in the same batch.
+        Returns the list together with the ids each command refers to that
+        are not known to the ResultsManager yet.
+        """
+        message, buffers = self.read_message()
+
+        references, unresolved = [], []
+
+        def object_hook(pairs):
+            if '__jsonclass__' in pairs:
+                constructor, param = pairs['__jsonclass__']
+                if constructor == "Promise" and \
+                        not ResultsManager.has_result(param) and \
+                        not ResultsManager.awaiting_result(param):
+                    unresolved.append(param)
+                    return Promise(param)
+
+            value = self.object_hook(pairs, buffers)
+            if isinstance(value, Pipeline):
+                # stages were decoded first, refer to their promises
+                stages = len(value.stages)
+                unresolved[:0] = [reference for stage in references[-stages:]
+                                  for reference in stage]
+                del references[-stages:]
+            if isinstance(value, Command):
+                references.append(unresolved[:])
+                del unresolved[:]
+            return value
+
+        batch = json.JSONDecoder(object_hook=object_hook).decode(message)['batch']
+        return batch, references
+
+    @staticmethod
+    def queue_batch(batch, references, client=None, priority=NORMAL):
+        if len(batch) != len(references):
+            raise ValueError("Batch can only contain commands")
+
+        result_ids = []
+        for (result_id, command), command_references in zip(batch, references):
+            result_id = result_id or str(uuid.uuid1())
+            if not is_result_id(result_id):
+                raise ValueError("Invalid result id '%s'" % result_id)
+            if result_id in result_ids or \
+                    ResultsManager.has_result(result_id) or \
+                    ResultsManager.awaiting_result(result_id):
+                raise ValueError("Duplicate result id '%s'" % result_id)
+            for reference in command_references:
+                if reference not in result_ids:
+                    raise ValueError("Unknown promise '%s'" % reference)
+            result_ids.append(result_id)
+
+        CommandProcessor.scheduler.admit(
+            [result_id for result_id, (_, command) in zip(result_ids, batch)
+             if not isinstance(command, Abort)], client, priority)
+        for result_id, (_, command) in zip(result_ids, batch):
+            if not isinstance(command, Abort):
+                ResultsManager.register_result(result_id)
+            CommandProcessor.queue((result_id, command))
+        return result_ids
+
     def parse_post_data(self):
-        content_len = int(self.headers['content-length'] or 0)
         content_type = self.headers.get_content_type()
-        data = self.rfile.read(content_len)
 
         if content_type == 'application/octet-stream':
-            return pickle.loads(data)
-        elif content_type == 'application/json':
-            return json.JSONDecoder(object_hook=self.object_hook).decode(data.decode('utf-8'))
+            return pickle.loads(self.read_body())
+        elif content_type in ('application/json', COMMAND_CONTENT_TYPE):
+            message, buffers = self.read_message()
+            return json.JSONDecoder(
+                object_hook=lambda pairs: self.object_hook(pairs, buffers)
+            ).decode(message)
         else:
-            return data
+            return bytes(self.read_body())
+
+    def read_message(self):
+        """Return the JSON message of the request and the buffers it refers to."""
+        data = self.read_body()
+        if self.headers.get_content_type() == COMMAND_CONTENT_TYPE:
+            return decode_command(data)
+        return data.decode('utf-8'), []
+
+    def read_body(self):
+        content_len = int(self.headers['content-length'] or 0)
+        data = bytearray(content_len)
+        view = memoryview(data)
+        position = 0
+        while position < content_len:
+            n = self.rfile.readinto(view[position:])
+            if not n:
+                raise ValueError("Request body is incomplete")
+            position += n
+        return data
 
     @staticmethod
-    def object_hook(pairs):
+    def object_hook(pairs, buffers=()):
         if 'create' in pairs:
             return Create(**pairs['create'])
 
@@ -114,19 +676,51 @@ class OrangeServer(BaseHTTPRequestHandler):
         if 'abort' in pairs:
             return Abort(**pairs['abort'])
 
+        if 'pipeline' in pairs:
+            return Pipeline(**pairs['pipeline'])
+
         if '__jsonclass__' in pairs:
             constructor, param = pairs['__jsonclass__']
             if constructor == "Promise":
-                try:
-                    if ResultsManager.has_result(param):
-                        return ResultsManager.get_result(param)
-                    elif ResultsManager.awaiting_result(param):
-                        return Promise(param)
-                except:
-                    raise ValueError("Unknown promise '%s'" % param)
+                # Resolved when the command is dispatched, so results kept
+                # in a worker process are not fetched just to be sent back
+                # and the command graph sees the dependency.
+                if ResultsManager.has_result(param) or \
+                        ResultsManager.awaiting_result(param):
+                    return Promise(param)
+                raise ValueError("Unknown promise '%s'" % param)
+            elif constructor == "Stage":
+                return Stage(int(param))
             elif constructor == "slice":
                 return slice(*param)
             elif constructor == "PyObject":
                 return pickle.loads(base64.b64decode(param))
+            elif constructor in ("PyObject5", "ndarray"):
+                return deserialize_data(constructor, param, buffers)[0]
+            elif constructor == "Blob":
+                return OrangeServer.load_blob(param, buffers)
 
         return pairs
+
+    @staticmethod
+    def load_blob(param, buffers):
+        """Return data referred to by its content hash.
+
+        Uploaded blobs are verified and stored in the ResultsManager, so
+        later commands can refer to them by hash only.
+        """
+        digest, *data = param
+        if not data:
+            try:
+                return ResultsManager.get_result(BLOB_PREFIX + digest)
+            except KeyError:
+                raise UnknownBlob(digest)
+
+        kind, reference = data
+        value, metadata, parts = deserialize_data(kind, reference, buffers)
+        if content_hash(kind, metadata, parts) != digest:
+            raise ValueError("Content does not match hash %s" % digest)
+        # Shared by all commands that refer to it.
+        make_read_only(value)
+        ResultsManager.set_result(BLOB_PREFIX + digest, value)
+        return value
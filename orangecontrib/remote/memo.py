@@ -0,0 +1,192 @@
+""" Results of deterministic commands, reused for identical commands.
+
+Memoization is opt-in: only commands whose class (for Create) or class and
+method (for Call and Get) match a pattern in Memo.allowed are memoized,
+e.g. "Orange.data.Table" or "Orange.classification.*". Results of calls
+are named by the call, so "Orange.classification.*" also allows fitting
+learners and calling the fitted models.
+
+Commands are identified by a hash of their content. Promises in a command
+contribute the hash of the command that computed their result, so a
+learner fitted on a table loaded the same way is recognized as the same
+model.
+
+Memoized results are shared between all commands that ask for them and
+must not be modified in place.
+"""
+import collections
+import fnmatch
+import hashlib
+import json
+import logging
+import threading
+
+from orangecontrib.remote.commands import Create, Call, Get, Promise, \
+    ExecutionFailed
+from orangecontrib.remote.results_manager import ExternalResult, estimate_size
+from orangecontrib.remote.serialization import serialize_data, content_hash
+
+PRIMITIVES = (type(None), bool, int, float, str)
+
+
+class NotMemoizable(Exception):
+    pass
+
+
+class Memo:
+    logger = logging.getLogger("memo")
+
+    # Patterns of memoized classes and methods. Empty disables memoization.
+    allowed = []
+    # Limit on the memory used by memoized results in bytes.
+    max_size = 2 ** 30
+    # Number of result ids whose hashes are remembered
+    max_keys = 100000
+
+    values = collections.OrderedDict()
+    sizes = {}
+    total_size = 0
+    # result id -> hash of the command that computes it and class name of
+    # the result, if known
+    keys = collections.OrderedDict()
+    # result id -> hash of a command that is executing
+    pending = {}
+    lock = threading.Lock()
+    stats = {'hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+
+    @classmethod
+    def lookup(cls, id, command):
+        """Return (True, value) if the result of the command is memoized.
+        Otherwise remember to memoize it and return (False, None)."""
+        if not cls.allowed:
+            return False, None
+        try:
+            key, class_name = cls.key(command)
+        except NotMemoizable:
+            return False, None
+
+        with cls.lock:
+            cls.keys[id] = key, class_name
+            while len(cls.keys) > cls.max_keys:
+                cls.keys.popitem(last=False)
+            if key in cls.values:
+                cls.values.move_to_end(key)
+                cls.stats['hits'] += 1
+                cls.logger.debug("Reusing memoized result for %s", id)
+                value = cls.values[key]
+                if isinstance(value, ExternalResult):
+                    value = value.duplicate()
+                return True, value
+            cls.stats['misses'] += 1
+            cls.pending[id] = key
+        return False, None
+
+    @classmethod
+    def completed(cls, id, value):
+        with cls.lock:
+            key = cls.pending.pop(id, None)
+        if key is None or isinstance(value, ExecutionFailed):
+            return
+        if isinstance(value, ExternalResult):
+            # e.g. a result in shared memory; keep a handle of our own
+            size = value.size
+            if size > cls.max_size:
+                return
+            value = value.duplicate()
+            if value is None:
+                return
+        else:
+            size = estimate_size(value)
+            if size > cls.max_size:
+                return
+        with cls.lock:
+            if key in cls.values:
+                cls.release(value)
+                return
+            cls.values[key] = value
+            cls.sizes[key] = size
+            cls.total_size += size
+            cls.stats['stored'] += 1
+            while cls.total_size > cls.max_size:
+                evicted, evicted_value = cls.values.popitem(last=False)
+                cls.total_size -= cls.sizes.pop(evicted)
+                cls.release(evicted_value)
+                cls.stats['evicted'] += 1
+
+    @staticmethod
+    def release(value):
+        if isinstance(value, ExternalResult):
+            value.release()
+
+    @classmethod
+    def key(cls, command):
+        """Return hash of the command and the class name of its result.
+        Raise NotMemoizable if the command is not allowed or depends on
+        results of commands that were not memoizable."""
+        if isinstance(command, Create):
+            class_name = "%s.%s" % (command.module, command.class_)
+            name, parts = class_name, []
+        elif isinstance(command, (Call, Get)):
+            parts = [cls.value_hash(command.object)]
+            name = "%s.%s" % (cls.class_name(command.object),
+                              getattr(command, 'method', None) or
+                              getattr(command, 'member', None))
+            class_name = name
+        else:
+            raise NotMemoizable()
+        if not any(fnmatch.fnmatchcase(name, pattern) for pattern in cls.allowed):
+            raise NotMemoizable()
+
+        parts.extend(cls.value_hash(getattr(command, attr, None))
+                     for attr in ('args', 'kwargs'))
+        return cls.digest([type(command).__name__, name] + parts), class_name
+
+    @classmethod
+    def class_name(cls, value):
+        if isinstance(value, Promise):
+            key = cls.keys.get(value.id)
+            if key is None or key[1] is None:
+                raise NotMemoizable()
+            return key[1]
+        return "%s.%s" % (type(value).__module__, type(value).__qualname__)
+
+    @classmethod
+    def value_hash(cls, value):
+        if isinstance(value, Promise):
+            key = cls.keys.get(value.id)
+            if key is None:
+                raise NotMemoizable()
+            return ['promise', key[0]]
+        if isinstance(value, PRIMITIVES):
+            return [type(value).__name__, value]
+        if isinstance(value, (list, tuple)):
+            return [type(value).__name__] + [cls.value_hash(item) for item in value]
+        if isinstance(value, dict):
+            return ['dict'] + sorted([str(key), cls.value_hash(item)]
+                                     for key, item in value.items())
+        try:
+            return ['data', content_hash(*serialize_data(value))]
+        except Exception:
+            raise NotMemoizable()
+
+    @staticmethod
+    def digest(parts):
+        return hashlib.blake2b(json.dumps(parts).encode('utf-8'),
+                               digest_size=20).hexdigest()
+
+    @classmethod
+    def get_stats(cls):
+        with cls.lock:
+            return dict(cls.stats, entries=len(cls.values), size=cls.total_size)
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            for value in cls.values.values():
+                cls.release(value)
+            cls.values.clear()
+            cls.sizes.clear()
+            cls.keys.clear()
+            cls.pending.clear()
+            cls.total_size = 0
+            cls.stats = dict.fromkeys(cls.stats, 0)
@@ -0,0 +1,141 @@
+import collections
+import logging
+import mmap
+import os
+import pickle
+import threading
+import time
+
+from orangecontrib.remote.serialization import pack, unpack
+
+
+class ObjectStore:
+    """Disk tier for results evicted from ResultsManager.
+
+    Objects are pickled with protocol 5. Numpy buffers (X, Y, metas of
+    tables, plain arrays) are written raw to a separate file and memory
+    mapped back on load, so reloading does not copy them.
+    """
+    logger = logging.getLogger("results")
+
+    storage_path = os.path.join(os.path.dirname(__file__), 'spilled_results')
+    if not os.path.exists(storage_path):
+        os.mkdir(storage_path)
+
+    enabled = False
+    # Limit on the disk space used by spilled results in bytes.
+    max_size = None
+    alignment = 64
+
+    objects = collections.OrderedDict()
+    total_size = 0
+    lock = threading.Lock()
+    stats = {'spilled': 0, 'hits': 0, 'misses': 0, 'load_time': 0.}
+
+    @classmethod
+    def save(cls, id, obj):
+        buffers = []
+        try:
+            data = pickle.dumps(pack(obj), protocol=5, buffer_callback=buffers.append)
+        except Exception as err:
+            cls.logger.debug("Result %s can not be spilled: %s", id, err)
+            return False
+
+        fn = os.path.join(cls.storage_path, id)
+        offsets = []
+        position = 0
+        with open(fn + '.buffers.new', 'wb') as f:
+            for buffer in buffers:
+                raw = buffer.raw()
+                padding = -position % cls.alignment
+                f.write(b'\0' * padding)
+                position += padding
+                offsets.append((position, raw.nbytes))
+                f.write(raw)
+                position += raw.nbytes
+        with open(fn + '.pickle.new', 'wb') as f:
+            pickle.dump((offsets, data), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(fn + '.buffers.new', fn + '.buffers')
+        os.replace(fn + '.pickle.new', fn + '.pickle')
+
+        size = position + len(data)
+        with cls.lock:
+            cls.total_size += size - cls.objects.pop(id, 0)
+            cls.objects[id] = size
+            cls.stats['spilled'] += 1
+            evicted = []
+            while cls.max_size is not None and cls.total_size > cls.max_size \
+                    and len(cls.objects) > 1:
+                evicted_id, evicted_size = cls.objects.popitem(last=False)
+                cls.total_size -= evicted_size
+                evicted.append(evicted_id)
+        for evicted_id in evicted:
+            cls._remove_files(evicted_id)
+        cls.logger.debug("Spilled result %s (%d bytes)", id, size)
+        return True
+
+    @classmethod
+    def load(cls, id):
+        with cls.lock:
+            if id not in cls.objects:
+                cls.stats['misses'] += 1
+                raise KeyError(id)
+            cls.objects.move_to_end(id)
+
+        start = time.perf_counter()
+        fn = os.path.join(cls.storage_path, id)
+        try:
+            with open(fn + '.pickle', 'rb') as f:
+                offsets, data = pickle.load(f)
+            buffers = []
+            if os.path.getsize(fn + '.buffers'):
+                with open(fn + '.buffers', 'rb') as f:
+                    # Copy on write keeps the arrays writable without
+                    # touching the file.
+                    view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+                buffers = [view[offset:offset + size] for offset, size in offsets]
+            elif offsets:
+                buffers = [bytearray() for _ in offsets]
+        except FileNotFoundError:
+            raise KeyError(id)
+        obj = unpack(pickle.loads(data, buffers=buffers))
+
+        elapsed = time.perf_counter() - start
+        with cls.lock:
+            cls.stats['hits'] += 1
+            cls.stats['load_time'] += elapsed
+        cls.logger.debug("Reloaded result %s in %.3f s", id, elapsed)
+        return obj
+
+    @classmethod
+    def contains(cls, id):
+        return id in cls.objects
+
+    @classmethod
+    def delete(cls, id):
+        with cls.lock:
+            if id not in cls.objects:
+                return
+            cls.total_size -= cls.objects.pop(id)
+        cls._remove_files(id)
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.objects.clear()
+            cls.total_size = 0
+        for fn in os.listdir(cls.storage_path):
+            os.remove(os.path.join(cls.storage_path, fn))
+
+    @classmethod
+    def get_stats(cls):
+        with cls.lock:
+            stats = dict(cls.stats, objects=len(cls.objects), size=cls.total_size)
+        return stats
+
+    @classmethod
+    def _remove_files(cls, id):
+        fn = os.path.join(cls.storage_path, id)
+        for ext in ('.pickle', '.buffers'):
+            if os.path.exists(fn + ext):
+                os.remove(fn + ext)
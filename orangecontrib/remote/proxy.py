@@ -1,22 +1,40 @@
+import asyncio
 import base64
-from http.client import HTTPConnection
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPException
 import inspect
+import io
 import json
 import pickle
+import select
+import threading
+import time
 import urllib.request
+import uuid
 import Orange
 
 import numpy as np
 
-from orangecontrib.remote.commands import ExecutionFailed
+from orangecontrib.remote.commands import ExecutionFailed, RemoteException
+from orangecontrib.remote.serialization import STREAM_CONTENT_TYPE, \
+    COMMAND_CONTENT_TYPE, load_stream, encode_command, serialize_data, \
+    data_reference, content_hash, nbytes, loads, request_headers
 
 
-def wrapped_member(member_name):
+def wrapped_member(member_name, cacheable=False):
     def function(self):
+        if cacheable:
+            cache = object.__getattribute__(self, '__dict__').setdefault('__cache__', {})
+            if member_name in cache:
+                return cache[member_name]
         __id__ = execute_on_server(self.__server__, "call/%s.%s" % (self.__id__[:8], '__getattribute__'),
                                    object=self, method='__getattribute__', args=[str(member_name)])
-        result = AnonymousProxy(__id__=__id__)
-        result.__server__ = self.server
+        result = AnonymousProxy(__id__=__id__, __owned__=True)
+        result.__server__ = self.__server__
+        if cacheable:
+            # Values of cacheable members do not change, keep a local copy.
+            result = cache[member_name] = result.get()
         return result
 
     return property(function)
@@ -26,35 +44,77 @@ def wrapped_function(function_name, synchronous=False):
     def function(self, *args, **kwargs):
         if function_name == "__init__":
             return
-        __id__ = execute_on_server(self.server, "call/%s.%s(%s%s)" % (self.__id__, str(function_name),
-                                                                      ",".join(map(str, args)), ""),
+        __id__ = execute_on_server(self.__server__, "call/%s.%s(%s%s)" % (self.__id__, str(function_name),
+                                                                          ",".join(map(str, args)), ""),
                                    object=self, method=str(function_name), args=args, kwargs=kwargs)
         if synchronous:
-            return fetch_from_server(self.server, 'object/' + __id__)
+            return fetch_from_server(self.__server__, 'object/' + __id__)
         else:
-            result = AnonymousProxy(__id__=__id__)
-            result.__server__ = self.server
+            result = AnonymousProxy(__id__=__id__, __owned__=True)
+            result.__server__ = self.__server__
             return result
 
     return function
 
 
 class ProxyEncoder(json.JSONEncoder):
+    """Encode commands as JSON.
+
+    If a list of buffers is given, arrays and tables are appended to it and
+    referred to by index, so they can be sent as raw binary data.
+    Otherwise they are embedded as base64 encoded pickles. Blobs, prepared
+    by BlobCache, map ids of arguments to their content hashes.
+    """
+    def __init__(self, *args, buffers=None, blobs=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buffers = buffers
+        self.blobs = blobs
+
     def default(self, o):
         if isinstance(o, slice):
             return {"__jsonclass__": ('slice', (o.start, o.stop, o.step))}
         if isinstance(o, Proxy):
             return {"__jsonclass__": ('Promise', o.__id__)}
+        if isinstance(o, StageResult):
+            return {"__jsonclass__": ('Stage', o.index)}
+        if self.buffers is not None and isinstance(o, (np.ndarray, Orange.data.Table)):
+            return self.encode_buffers(o)
         if isinstance(o, np.ndarray):
             return {"__jsonclass__": ('PyObject', base64.b64encode(pickle.dumps(o)).decode("ascii"))}
-        if isinstance(o, Orange.data.Table):
+        if isinstance(o, (Orange.data.Table, Orange.data.Domain, Orange.data.Variable)):
+            # Domains and variables are local copies of cacheable members.
             return {"__jsonclass__": ('PyObject', base64.b64encode(pickle.dumps(o)).decode("ascii"))}
         return json.JSONEncoder.default(self, o)
 
+    def encode_buffers(self, o):
+        blob = self.blobs.get(id(o)) if self.blobs is not None else None
+        if blob is None:
+            digest, on_server, (kind, metadata, parts) = None, False, serialize_data(o)
+        else:
+            digest, on_server, kind, metadata, parts = blob
+        if on_server:
+            return {"__jsonclass__": ('Blob', (digest,))}
+
+        first = len(self.buffers)
+        self.buffers.extend(parts)
+        reference = data_reference(kind, metadata, first, len(parts))
+        if digest is None:
+            return {"__jsonclass__": (kind, reference)}
+        return {"__jsonclass__": ('Blob', (digest, kind, reference))}
+
 
 class Proxy:
     __server__ = None
     __id__ = None
+    # Proxies that created their server object delete it when collected.
+    __owned__ = False
+    # Members whose values are fetched once and kept by the proxy
+    __cacheable__ = ()
+    # Number of items fetched at once when iterating
+    page_size = 1000
+    # Codecs in which values may be compressed, in order of preference,
+    # e.g. ('lz4', 'zlib'). Compression pays off on slow networks.
+    compression = ()
 
     results = {}
 
@@ -64,42 +124,110 @@ class Proxy:
             self.__id__ = kwargs["__id__"]
             if '__server__' in kwargs:
                 self.__server__ = kwargs['__server__']
+            self.__owned__ = kwargs.get('__owned__', False)
         else:
             self.__id__ = execute_on_server(
                 cls.__server__,
                 "create",
                 module=cls.__originalmodule__, class_=cls.__originalclass__,
                 args=args, kwargs=kwargs)
+            self.__owned__ = True
         return self
 
+    def __del__(self):
+        if self.__owned__ and self.__server__ is not None:
+            result_releaser.release(self.__server__, self.__id__)
+
     def get(self):
         return fetch_from_server(self.__server__, 'object/' + self.__id__)
 
     def get_state(self):
         return fetch_from_server(self.__server__, 'state/' + self.__id__)
 
+    def progress(self):
+        """Yield progress records of the command until it completes."""
+        return iter_progress(self.__server__, self.__id__)
+
     def abort(self):
         execute_on_server(self.__server__, "abort",
                           id=self.__id__)
 
+    def prefetch(self, *members):
+        """Fetch values of members in one round trip and keep them as
+        cached. Defaults to all cacheable members of the class."""
+        members = [str(member) for member in members or self.__cacheable__]
+        if not members:
+            return {}
+        with Batch():
+            getter = execute_on_server(self.__server__, "create", module="operator",
+                                       class_="attrgetter", args=members)
+            getter = AnonymousProxy(__id__=getter, __server__=self.__server__,
+                                    __owned__=True)
+            values = getter(self)
+        values = values.get()
+        if len(members) == 1:
+            values = (values,)
+        cache = object.__getattribute__(self, '__dict__').setdefault('__cache__', {})
+        cache.update(zip(members, values))
+        return dict(zip(members, values))
+
     def ready(self):
         return fetch_from_server(self.__server__, 'status/' + self.__id__) == 'ready'
 
+    def wait(self, timeout=None):
+        return bool(wait_all([self], timeout))
+
+    async def aget(self):
+        """Return the value without blocking the event loop."""
+        await self.await_ready()
+        return await async_fetch_from_server(self.__server__, 'object/' + self.__id__)
+
+    async def await_ready(self, timeout=None):
+        """Wait until the value is ready without blocking the event loop.
+        Return False if it is not ready after timeout seconds."""
+        batch = Batch.current()
+        if batch is not None:
+            await batch.aflush(self.__server__)
+        waiter = ReadyWaiter.for_server(self.__server__)
+        try:
+            return await asyncio.wait_for(waiter.wait(self.__id__), timeout)
+        except asyncio.TimeoutError:
+            return False
+
     def __getattr__(self, item):
         if item in {"__getnewargs__", "__getstate__", "__setstate__"}:
             raise AttributeError
         return wrapped_member(item).fget(self)
 
     def __iter__(self):
+        """Iterate over values, fetched in pages of page_size items. The
+        next page is downloaded while the current one is consumed."""
         # noinspection PyTypeChecker
-        for i in range(len(self)):
-            yield self[i]
+        length = len(self)
+        page_size = self.page_size
+
+        def fetch(start):
+            return self[start:start + page_size].get()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            page = executor.submit(fetch, 0) if length else None
+            for start in range(0, length, page_size):
+                values = page.result()
+                if start + page_size < length:
+                    page = executor.submit(fetch, start + page_size)
+                yield from values
 
 
 class AnonymousProxy(Proxy):
     def __getattribute__(self, item):
-        if item in {"__id__", "__server__", "get", "get_state", "abort",  "__class__"}:
+        if item in {"__id__", "__server__", "__owned__", "__cacheable__", "get", "get_state",
+                    "progress", "abort", "prefetch", "ready", "wait", "aget",
+                    "await_ready", "page_size",
+                    "__class__"}:
             return super().__getattribute__(item)
+        cache = object.__getattribute__(self, '__dict__').get('__cache__')
+        if cache and item in cache:
+            return cache[item]
         return wrapped_member(item).fget(self)
 
     __str__ = wrapped_function("__str__", True)
@@ -108,35 +236,797 @@ class AnonymousProxy(Proxy):
     __getitem__ = wrapped_function("__getitem__", False)
 
 
+# Requests that can be sent again if the response is lost
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+
+class ConnectionPool:
+    """Thread-safe pool of keep-alive connections to Orange servers."""
+    def __init__(self, max_idle=8):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def request(self, server, method, url, body=None, headers={}, read=None):
+        """Send a request and return the response with its body.
+
+        If given, read(response) is called to consume the body instead of
+        reading it into a byte string.
+        """
+        server = tuple(server)
+        while True:
+            connection, reused = self._acquire(server)
+            sent = False
+            try:
+                connection.request(method, url, body, headers)
+                sent = True
+                response = connection.getresponse()
+                data = response.read() if read is None else read(response)
+            except (HTTPException, ConnectionError):
+                connection.close()
+                # The server has closed an idle connection, try again,
+                # unless it could have executed the request.
+                if reused and (not sent or method in IDEMPOTENT_METHODS):
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(server, connection)
+            return response, data
+
+    def _acquire(self, server):
+        with self._lock:
+            idle = self._idle.get(server, [])
+            while idle:
+                connection = idle.pop()
+                if not is_dropped(connection):
+                    return connection, True
+                connection.close()
+        return HTTPConnection(*server), False
+
+    def _release(self, server, connection):
+        with self._lock:
+            idle = self._idle.setdefault(server, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+def is_dropped(connection):
+    """Return True if the server closed the idle connection; there is
+    nothing else to read from it."""
+    if connection.sock is None:
+        return True
+    try:
+        return bool(select.select([connection.sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+connection_pool = ConnectionPool()
+
+
+class AsyncResponse:
+    """Response read by AsyncConnectionPool."""
+    def __init__(self, status, reason, headers, version):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.will_close = version == "HTTP/1.0" or \
+            headers.get("connection", "").lower() == "close"
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+
+class AsyncConnectionPool:
+    """Pool of keep-alive connections to Orange servers for asyncio clients.
+
+    Connections belong to the event loop that opened them and are closed
+    when asyncio.run cancels the loop's tasks. Each connection occupies a
+    handler thread on the server, so at most max_connections requests to a
+    server are sent at the same time.
+    """
+    def __init__(self, max_connections=2):
+        self.max_connections = max_connections
+        self._idle = {}
+        self._limits = {}
+        self._closers = {}
+
+    async def request(self, server, method, url, body=None, headers={}):
+        """Send a request and return the response with its body."""
+        key = asyncio.get_running_loop(), tuple(server)
+        self._forget_closed_loops()
+        limit = self._limits.get(key)
+        if limit is None:
+            limit = self._limits[key] = asyncio.Semaphore(self.max_connections)
+            self._idle[key] = []
+            self._closers[key] = asyncio.ensure_future(self._close_when_cancelled(key))
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        request = self._encode_request(key[1], method, url, body, headers)
+
+        async with limit:
+            while True:
+                (reader, writer), reused = await self._acquire(key)
+                sent = False
+                try:
+                    writer.write(request)
+                    if body:
+                        writer.write(body)
+                    await writer.drain()
+                    sent = True
+                    response, data = await self._read_response(reader)
+                except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+                    writer.close()
+                    # The server has closed an idle connection, try again,
+                    # unless it could have executed the request.
+                    if reused and (not sent or method in IDEMPOTENT_METHODS):
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+
+                if response.will_close:
+                    writer.close()
+                else:
+                    self._release(key, (reader, writer))
+                return response, data
+
+    @staticmethod
+    def _encode_request(server, method, url, body, headers):
+        lines = ["%s /%s HTTP/1.1" % (method, url.lstrip("/")),
+                 "Host: %s:%s" % server,
+                 "Content-Length: %d" % len(body or b"")]
+        lines.extend("%s: %s" % header for header in headers.items()
+                     if header[0].lower() != "content-length")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+    @staticmethod
+    async def _read_response(reader):
+        status_line = (await reader.readline()).decode('latin-1')
+        if not status_line:
+            raise ConnectionError("Server closed the connection")
+        version, status, reason = (status_line.strip().split(" ", 2) + [""])[:3]
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        response = AsyncResponse(int(status), reason, headers, version)
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            data = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if not size:
+                    while (await reader.readline()).strip():
+                        pass
+                    break
+                data += await reader.readexactly(size)
+                await reader.readline()
+        elif "content-length" in headers:
+            data = await reader.readexactly(int(headers["content-length"]))
+        else:
+            data = await reader.read()
+            response.will_close = True
+        return response, bytes(data)
+
+    async def _acquire(self, key):
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return (reader, writer), True
+        return await asyncio.open_connection(*key[1]), False
+
+    def _release(self, key, connection):
+        idle = self._idle.get(key)
+        if idle is None:
+            # the loop is shutting down
+            connection[1].close()
+        else:
+            idle.append(connection)
+
+    async def _close_when_cancelled(self, key):
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            for reader, writer in self._idle.pop(key, ()):
+                writer.close()
+            self._limits.pop(key, None)
+            self._closers.pop(key, None)
+
+    def _forget_closed_loops(self):
+        for key in [key for key in self._limits if key[0].is_closed()]:
+            del self._limits[key]
+            self._idle.pop(key, None)
+            self._closers.pop(key, None)
+
+
+async_connection_pool = AsyncConnectionPool()
+
+
+class ResultReleaser:
+    """Delete server objects of garbage collected proxies.
+
+    Proxies only record their ids (it is not safe to make requests from
+    __del__), a background thread sends them to the server in bulk.
+    """
+    def __init__(self, poll_interval=1, max_ids=200):
+        self.poll_interval = poll_interval
+        self.max_ids = max_ids
+        self._released = collections.deque()
+        self._thread = None
+
+    def release(self, server, id):
+        self._released.append((tuple(server), id))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                name='Releasing results',
+                target=self.run,
+                daemon=True
+            )
+            self._thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            self.flush()
+
+    def flush(self):
+        servers = {}
+        unsent = []
+        while self._released:
+            server, id = self._released.popleft()
+            if (server, id) in Batch.unsent:
+                # The server does not know the id until the batch is sent.
+                unsent.append((server, id))
+            else:
+                servers.setdefault(server, []).append(id)
+        self._released.extend(unsent)
+
+        for server, ids in servers.items():
+            for i in range(0, len(ids), self.max_ids):
+                try:
+                    connection_pool.request(
+                        server, "DELETE", '/object/' + ','.join(ids[i:i + self.max_ids]))
+                except Exception:
+                    # Server is gone, so are the results.
+                    pass
+
+
+result_releaser = ResultReleaser()
+
+
+class BlobCache:
+    """Content hashes of large arguments that servers are known to have.
+
+    Arguments already on the server are sent as references to their hash
+    instead of their data.
+    """
+    def __init__(self, min_size=2 ** 16):
+        self.min_size = min_size
+        self.known = collections.defaultdict(set)
+
+    def prepare(self, server, params, query=True):
+        """Serialize arrays and tables in params and hash the large ones.
+
+        Unless query is False, the server is asked which of the hashes not
+        seen before it already has. Returns a dict for ProxyEncoder.
+        """
+        server = tuple(server)
+        blobs = {}
+        for o in iter_data(params):
+            if id(o) in blobs:
+                continue
+            kind, metadata, parts = serialize_data(o)
+            digest = None
+            if nbytes(parts) >= self.min_size:
+                digest = content_hash(kind, metadata, parts)
+            blobs[id(o)] = (digest, kind, metadata, parts)
+
+        known = self.known[server]
+        digests = {blob[0] for blob in blobs.values() if blob[0] is not None}
+        unknown = digests - known
+        if unknown and query:
+            response, data = connection_pool.request(
+                server, "GET", '/blobs/' + ','.join(sorted(unknown)))
+            if response.status == 200:
+                known.update(decode_response(response, data))
+
+        blobs = {i: (digest, digest in known, kind, metadata, parts)
+                 for i, (digest, kind, metadata, parts) in blobs.items()}
+        # Whatever is not on the server yet, will be after this request.
+        known.update(digests)
+        return blobs
+
+    def forget(self, server):
+        self.known.pop(tuple(server), None)
+
+
+blob_cache = BlobCache()
+
+
+def iter_data(value):
+    if isinstance(value, (np.ndarray, Orange.data.Table)):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from iter_data(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from iter_data(item)
+
+
+# Identifies this process to the server, which shares work fairly
+# between clients.
+CLIENT_ID = str(uuid.uuid4())
+# Number of times a command is resent when the server is overloaded
+MAX_RETRIES = 10
+
+
+class Priority:
+    """Send commands from this thread with the given priority ('high',
+    'normal' or 'low') inside the block."""
+    _local = threading.local()
+
+    def __init__(self, level):
+        if level not in ('high', 'normal', 'low'):
+            raise ValueError("Unknown priority '%s'" % level)
+        self.level = level
+        self.previous = None
+
+    @classmethod
+    def current(cls):
+        return getattr(cls._local, 'level', 'normal')
+
+    def __enter__(self):
+        self.previous = self.current()
+        self._local.level = self.level
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._local.level = self.previous
+
+
+class Batch:
+    """Queue commands sent from this thread and submit them in one request.
+
+    Proxies created inside the block get their ids immediately, so they can
+    be used as arguments of later calls. Queued commands are sent when the
+    block exits or when a result has to be fetched from the server.
+    """
+    _local = threading.local()
+    # (server, result id) of commands in batches of all threads that were
+    # not sent yet
+    unsent = set()
+
+    def __init__(self):
+        self.commands = {}
+        self.buffers = {}
+        # server -> futures of commands that aflush is sending
+        self.sending = {}
+
+    @classmethod
+    def current(cls):
+        return getattr(cls._local, 'batch', None)
+
+    def __enter__(self):
+        if self.current() is None:
+            self._local.batch = self
+        return self.current()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.current() is self:
+            del self._local.batch
+            self.flush()
+
+    def buffers_for(self, server):
+        return self.buffers.setdefault(tuple(server), [])
+
+    def add(self, server, message):
+        result_id = str(uuid.uuid4())
+        self.commands.setdefault(tuple(server), []).append((result_id, message))
+        self.unsent.add((tuple(server), result_id))
+        return result_id
+
+    def flush(self, server=None):
+        servers = list(self.commands) if server is None else [tuple(server)]
+        for server in servers:
+            self.send(server, *self.take(server))
+
+    async def aflush(self, server):
+        """Send queued commands from a thread of the executor, so the event
+        loop is not blocked. Also wait for commands that other coroutines
+        have started sending."""
+        server = tuple(server)
+        sending = self.sending.setdefault(server, set())
+        commands, buffers = self.take(server)
+        if commands:
+            future = asyncio.get_running_loop().run_in_executor(
+                None, self.send, server, commands, buffers)
+            sending.add(future)
+            future.add_done_callback(sending.discard)
+        await asyncio.gather(*map(asyncio.shield, list(sending)))
+
+    def take(self, server):
+        return self.commands.pop(server, None), self.buffers.pop(server, [])
+
+    def send(self, server, commands, buffers):
+        if not commands:
+            return
+        message = '{"batch": [%s]}' % ', '.join(
+            '[%s, %s]' % (json.dumps(result_id), command)
+            for result_id, command in commands)
+        try:
+            response, data = post_command(server, "/batch", message, buffers)
+        finally:
+            self.unsent.difference_update(
+                (server, result_id) for result_id, _ in commands)
+        if response.status == 409:
+            blob_cache.forget(server)
+        if response.status != 200:
+            raise RemoteException("Batch was rejected: %s" % response.reason)
+
+
+class StageResult:
+    """Result of a stage of a pipeline, for use in its later stages."""
+    def __init__(self, index):
+        self.index = index
+
+
+class Pipeline:
+    """Chain of commands that the server executes in one worker.
+
+    Intermediate results stay in the worker, so they are not sent back to
+    the server or stored between stages. Stages are added with create,
+    call and get, which return results that later stages can use as
+    objects or arguments.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.stages = []
+
+    def create(self, module, class_, *args, **kwargs):
+        return self.add("create", module=module, class_=class_,
+                        args=args, kwargs=kwargs)
+
+    def call(self, object, method, *args, **kwargs):
+        return self.add("call", object=object, method=method,
+                        args=args, kwargs=kwargs)
+
+    def get(self, object, member=""):
+        return self.add("get", object=object, member=member)
+
+    def add(self, kind, **params):
+        self.stages.append({kind: params})
+        return StageResult(len(self.stages) - 1)
+
+    def run(self, *outputs):
+        """Execute the pipeline. Return proxy of the result of the last
+        stage, or of the list of results of the given stages."""
+        params = {"stages": self.stages}
+        if outputs:
+            params["outputs"] = [output.index for output in outputs]
+        result = AnonymousProxy(__id__=execute_on_server(self.server, "pipeline", **params),
+                                __owned__=True)
+        result.__server__ = self.server
+        return result
+
+
+def decode_response(response, data):
+    content_type = response.getheader("Content-Type", "")
+    if content_type == "application/octet-stream":
+        return loads(data)
+    elif content_type == "application/json":
+        return json.loads(data.decode('utf-8'))
+    else:
+        return data.decode('utf-8')
+
+
+def read_response(response):
+    if response.getheader("Content-Type", "") == STREAM_CONTENT_TYPE:
+        result = load_stream(response)
+        response.read()
+        return result
+    return decode_response(response, response.read())
+
+
 def fetch_from_server(server, object_id):
+    batch = Batch.current()
+    if batch is not None:
+        batch.flush(server)
+
+    # The server answers 202 if the result is not ready after a while.
+    while True:
+        response, result = connection_pool.request(
+            server, "GET", object_id, headers=request_headers(Proxy.compression),
+            read=read_response)
+        if response.status != 202:
+            break
+    if isinstance(result, ExecutionFailed):
+        result.raise_()
+    else:
+        return result
+
+
+def iter_progress(server, object_id):
+    """Read server-sent progress events on a connection of its own.
+
+    The server ends a stream after a while; it is then requested again,
+    starting after the last event that was received.
+    """
+    batch = Batch.current()
+    if batch is not None:
+        batch.flush(server)
     connection = HTTPConnection(*server)
-    connection.request("GET", object_id)
-    response = connection.getresponse()
-    response_len = int(response.getheader("Content-Length", 0))
-    response_data = response.read(response_len)
-    if response.getheader("Content-Type", "") == "application/octet-stream":
-        result = pickle.loads(response_data)
+    headers = {"Accept": "text/event-stream"}
+    try:
+        while True:
+            connection.request("GET", '/progress/' + object_id, headers=headers)
+            response = connection.getresponse()
+            if response.status != 200:
+                raise RemoteException(response.read().decode('utf-8', 'replace'))
+
+            event, data = None, []
+            for line in response:
+                line = line.decode('utf-8').rstrip('\r\n')
+                if line.startswith('id:'):
+                    headers["Last-Event-ID"] = line[3:].strip()
+                elif line.startswith('event:'):
+                    event = line[6:].strip()
+                elif line.startswith('data:'):
+                    data.append(line[5:].strip())
+                elif not line and data:
+                    if event == 'done':
+                        return
+                    yield json.loads('\n'.join(data))
+                    event, data = None, []
+    finally:
+        connection.close()
+
+
+# Longest time a single long-poll request waits for results on the server.
+LONG_POLL_TIMEOUT = 30
+# Largest number of ids in one request, which keeps its URL within the
+# limit of the server.
+MAX_WAIT_IDS = 500
+
+
+def wait_any(proxies, timeout=None):
+    """Wait until at least one of the proxies is ready (or timeout seconds
+    pass) and return the proxies that are ready."""
+    servers = group_by_server(proxies)
+    if not servers:
+        return []
+    deadline = None if timeout is None else time.monotonic() + timeout
+    # Proxies from several servers can not share a long poll.
+    poll_timeout = LONG_POLL_TIMEOUT if len(servers) == 1 else 0.5
+    while True:
+        ready = []
+        for server, group in servers.items():
+            ready.extend(wait_on_server(server, 'wait_any', group,
+                                        deadline, poll_timeout, repeat=False))
+            if ready:
+                return ready
+        if deadline is not None and time.monotonic() >= deadline:
+            return ready
+
+
+def wait_all(proxies, timeout=None):
+    """Wait until all proxies are ready (or timeout seconds pass) and
+    return the proxies that are ready."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    ready = []
+    for server, group in group_by_server(proxies).items():
+        ready.extend(wait_on_server(server, 'wait_all', group,
+                                    deadline, LONG_POLL_TIMEOUT))
+    return ready
+
+
+def get_many(proxies):
+    """Return values of proxies. Values from the same server are fetched
+    in one response."""
+    proxies = list(proxies)
+    values = {}
+    for server, group in group_by_server(proxies).items():
+        result = AnonymousProxy(__id__=execute_on_server(
+            server, "create", module="builtins", class_="tuple", args=[group]),
+            __server__=server, __owned__=True)
+        values.update(zip((proxy.__id__ for proxy in group), result.get()))
+    return [values[proxy.__id__] for proxy in proxies]
+
+
+def group_by_server(proxies):
+    servers = {}
+    for proxy in proxies:
+        servers.setdefault(tuple(proxy.__server__), []).append(proxy)
+    return servers
+
+
+def wait_on_server(server, method, proxies, deadline, poll_timeout, repeat=True):
+    by_id = {proxy.__id__: proxy for proxy in proxies}
+    pending = list(by_id)
+    if method == 'wait_any' and len(pending) > MAX_WAIT_IDS:
+        # Chunks of ids can not share a long poll.
+        poll_timeout = min(poll_timeout, 0.5)
+    ready_ids = []
+    while True:
+        for i in range(0, len(pending), MAX_WAIT_IDS):
+            timeout = poll_timeout
+            if deadline is not None:
+                timeout = max(min(timeout, deadline - time.monotonic()), 0)
+            ready = fetch_from_server(server, '%s/%s?timeout=%s' % (
+                method, ','.join(pending[i:i + MAX_WAIT_IDS]), timeout))
+            if not isinstance(ready, list):
+                raise RemoteException("Waiting for results failed: %s" % ready)
+            ready_ids.extend(ready)
+            if method == 'wait_any' and ready_ids:
+                break
+
+        ready = set(ready_ids)
+        pending = [id for id in pending if id not in ready]
+        done = not pending if method == 'wait_all' else ready_ids
+        if done or not repeat or \
+                deadline is not None and time.monotonic() >= deadline:
+            return [by_id[id] for id in ready_ids]
+
+
+async def async_fetch_from_server(server, object_id):
+    while True:
+        response, data = await async_connection_pool.request(
+            server, "GET", object_id, headers=request_headers(Proxy.compression))
+        if response.status != 202:
+            break
+    if response.getheader("Content-Type", "") == STREAM_CONTENT_TYPE:
+        result = load_stream(io.BytesIO(data))
     else:
-        result = response_data.decode('utf-8')
+        result = decode_response(response, data)
     if isinstance(result, ExecutionFailed):
         result.raise_()
     else:
         return result
 
 
+class ReadyWaiter:
+    """Waits for results on a server for asyncio clients.
+
+    All proxies of a server that wait at the same time share one long
+    poll, so gathering many proxies does not need a request for each of
+    them. Proxies that start waiting during a poll join the next one.
+    """
+    # Longest time a poll waits for results on the server
+    poll_timeout = 1
+    # Largest number of ids in one poll
+    max_ids = 500
+
+    waiters = {}
+
+    def __init__(self, server):
+        self.server = server
+        # result id -> futures waiting for it
+        self.waiting = {}
+        self.task = None
+
+    @classmethod
+    def for_server(cls, server):
+        key = asyncio.get_running_loop(), tuple(server)
+        for closed in [key for key in cls.waiters if key[0].is_closed()]:
+            del cls.waiters[closed]
+        waiter = cls.waiters.get(key)
+        if waiter is None:
+            waiter = cls.waiters[key] = cls(key[1])
+        return waiter
+
+    def wait(self, id):
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(id, []).append(future)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.poll())
+        return future
+
+    async def poll(self):
+        while True:
+            # stop polling for results nobody waits for any more
+            for id, futures in list(self.waiting.items()):
+                if all(future.done() for future in futures):
+                    del self.waiting[id]
+            ids = list(self.waiting)[:self.max_ids]
+            if not ids:
+                return
+            try:
+                response, data = await self.request(ids, self.poll_timeout)
+                if response.status == 404 and len(ids) > 1:
+                    # Some of the results are unknown to the server. Look
+                    # for them, so that the others keep waiting.
+                    for id in ids:
+                        response, data = await self.request([id], 0)
+                        self.finish_polled([id], response, data)
+                else:
+                    self.finish_polled(ids, response, data)
+            except Exception as err:
+                self.finish(ids, err)
+
+    def request(self, ids, timeout):
+        return async_connection_pool.request(
+            self.server, "GET", 'wait_any/%s?timeout=%s' % (','.join(ids), timeout))
+
+    def finish_polled(self, ids, response, data):
+        ready = decode_response(response, data)
+        if isinstance(ready, list):
+            self.finish(ready)
+        else:
+            self.finish(ids, RemoteException("Waiting for results failed: %s" % ready))
+
+    def finish(self, ids, error=None):
+        for id in ids:
+            for future in self.waiting.pop(id, ()):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(True)
+                else:
+                    future.set_exception(error)
+
+
 def execute_on_server(server, uri, **params):
+    result_releaser.start()
     server_method = uri.split('/', 1)[0]
-    message = ProxyEncoder().encode({server_method: params})
-    connection = HTTPConnection(*server)
-    connection.request("POST", urllib.request.pathname2url(uri), message,
-                       {"Content-Type": "application/json"})
-    response = connection.getresponse()
-    response_len = int(response.getheader("Content-Length", 0))
-    response_data = response.read(response_len)
-    if response.getheader("Content-Type", "") == "application/octet-stream":
-        return pickle.loads(response_data)
+    batch = Batch.current()
+    buffers = [] if batch is None else batch.buffers_for(server)
+    blobs = blob_cache.prepare(server, params)
+    message = ProxyEncoder(buffers=buffers, blobs=blobs).encode({server_method: params})
+    if batch is not None:
+        return batch.add(server, message)
+
+    url = urllib.request.pathname2url(uri)
+    response, data = post_command(server, url, message, buffers)
+    if response.status == 409:
+        # The server dropped data we referred to by hash, send it again.
+        blob_cache.forget(server)
+        buffers = []
+        blobs = blob_cache.prepare(server, params, query=False)
+        message = ProxyEncoder(buffers=buffers, blobs=blobs).encode({server_method: params})
+        response, data = post_command(server, url, message, buffers)
+    return decode_response(response, data)
+
+
+def post_command(server, url, message, buffers):
+    """Send a command. Resend it while the server asks to retry later."""
+    headers = {"X-Orange-Client": CLIENT_ID,
+               "X-Orange-Priority": Priority.current()}
+    if not buffers:
+        body = message
+        headers["Content-Type"] = "application/json"
     else:
-        return response_data.decode('utf-8')
+        body, length = encode_command(message, buffers)
+        headers["Content-Type"] = COMMAND_CONTENT_TYPE
+        headers["Content-Length"] = str(length)
+
+    for retry in range(MAX_RETRIES + 1):
+        response, data = connection_pool.request(server, "POST", url, body, headers)
+        if response.status not in (429, 503) or retry == MAX_RETRIES:
+            return response, data
+        time.sleep(float(response.getheader("Retry-After") or 1))
 
 new_to_old = {}
 
@@ -1,32 +1,71 @@
+import hashlib
 import importlib
+import importlib.metadata
 import inspect
+import json
+import os
+import pickle
 import pkgutil
 import sys
+import threading
 import types
+from http.client import HTTP_PORT
 from orangecontrib.remote import wrapped_function, wrapped_member, Proxy
-from orangecontrib.remote.proxy import fetch_from_server
+from orangecontrib.remote.proxy import connection_pool, read_response
+from orangecontrib.remote.serialization import PROTOCOL_HEADER
+
+# Members whose values do not change once the object is created. Clients
+# fetch them by value on first access and keep them.
+CACHEABLE_MEMBERS = {
+    "Orange.data.table.Table": ["domain"],
+    "Orange.data.domain.Domain": ["attributes", "class_vars", "metas",
+                                  "variables", "class_var"],
+    "Orange.data.variable.Variable": ["name"],
+    "Orange.data.variable.DiscreteVariable": ["values"],
+}
+
+# Version of the format of module descriptions. Increase it when
+# ModuleDescription or ClassDescription change, so that clients do not
+# reuse descriptions they cached from an older server.
+CONTRACT_FORMAT = 1
+
+
+def package_version():
+    try:
+        return importlib.metadata.version("orange-remote")
+    except importlib.metadata.PackageNotFoundError:
+        return ""
 
 
 class ModuleDescription:
-    def __init__(self, module, known_classes):
+    def __init__(self, module, known_classes, submodules=(), cacheable=None):
+        self.name = module.__name__
         self.members = {}
+        self.submodules = list(submodules)
 
         for name, class_ in inspect.getmembers(module, inspect.isclass):
             if not class_.__module__.startswith("Orange"):
                 continue
 
-            self.members[name] = known_classes.setdefault(
-                class_, ClassDescription(class_))
+            if class_ not in known_classes:
+                known_classes[class_] = ClassDescription(class_, cacheable)
+            self.members[name] = known_classes[class_]
 
 
 class ClassDescription:
     _proxy = None
+    cacheable = ()
 
-    def __init__(self, class_):
+    def __init__(self, class_, cacheable=None):
         self.module = class_.__module__
         self.name = class_.__name__
         self.functions = []
         self.members = []
+        if cacheable is None:
+            cacheable = CACHEABLE_MEMBERS
+        self.cacheable = sorted({
+            member for base in class_.__mro__
+            for member in cacheable.get("%s.%s" % (base.__module__, base.__name__), ())})
 
         for n, f in inspect.getmembers(class_, inspect.isfunction):
             if n.startswith("__") and n not in ("__getitem__", "__call__",
@@ -49,6 +88,9 @@ class ClassDescription:
 
             for n in self.members:
                 members[n] = wrapped_member(n)
+            for n in self.cacheable:
+                members[n] = wrapped_member(n, cacheable=True)
+            members["__cacheable__"] = tuple(self.cacheable)
 
             new_name = '%s_%s' % (self.module.replace(".", "_"), self.name)
             self._proxy = type(new_name, (Proxy,), members)
@@ -57,110 +99,201 @@ class ClassDescription:
 
     def __getstate__(self):
         state = self.__dict__.copy()
-        state.pop('_proxy')
+        state.pop('_proxy', None)
         return state
 
 
 class RemoteModule:
-    def __init__(self, module, exclude=()):
-        self.excluded_modules = exclude
+    """Contract of a module and its submodules.
 
-        self.descriptions = self.create_descriptions(module)
-        self.modules = self.create_modules()
+    Submodules are imported and described when a client first asks for
+    them, so the server does not import the whole package at startup.
+    """
+    def __init__(self, module, exclude=(), cacheable=None):
+        self.root = module.__name__
+        self.excluded_modules = exclude
+        self.cacheable = CACHEABLE_MEMBERS if cacheable is None else cacheable
+        # Contracts with the same version are the same, so clients can
+        # reuse descriptions they cached earlier.
+        self.version = hashlib.blake2b(json.dumps(
+            [CONTRACT_FORMAT, package_version(), self.root,
+             str(getattr(module, '__version__', '')),
+             sorted(exclude), self.cacheable], sort_keys=True
+        ).encode('utf-8'), digest_size=16).hexdigest()
+
+        self.descriptions = {}
+        self.known_classes = {}
+        self.lock = threading.Lock()
 
     @classmethod
     def from_server(cls, address):
         """
         :param address: hostname:port
         :return:
-        :rtype: orangecontrib.remote.remote_module.RemoteModule
+        :rtype: orangecontrib.remote.remote_module.ProxyModules
         """
         address = address.split(':')
         if len(address) > 1:
             address[1] = int(address[1])
-
-        remote_module = fetch_from_server(address, 'object/contract')
-        remote_module.set_server(address)
-        return remote_module
-
-    def create_descriptions(self, module):
-        cache = {}
-        modules = {module.__name__: ModuleDescription(module, cache)}
-
-        for modname in self.list_submodules(module):
-            try:
-                submodule = importlib.import_module(modname)
-            except ImportError as err:
-                sys.stderr.write("Failed to load module %s: %s\n" %
-                                 (modname, err))
-                continue
-
-            modules[submodule.__name__] = ModuleDescription(submodule, cache)
-
-        return modules
+        return ProxyModules(tuple(address))
+
+    def describe(self, modname):
+        """Return ModuleDescription of the module, or raise ImportError."""
+        if not self.includes(modname):
+            raise ImportError("No module named %s" % modname)
+
+        with self.lock:
+            if modname not in self.descriptions:
+                try:
+                    module = importlib.import_module(modname)
+                except Exception as err:
+                    raise ImportError("Failed to load module %s: %s" %
+                                      (modname, err))
+                self.descriptions[modname] = ModuleDescription(
+                    module, self.known_classes, self.list_submodules(module),
+                    self.cacheable)
+            return self.descriptions[modname]
+
+    def includes(self, modname):
+        return (modname == self.root or modname.startswith(self.root + '.')) \
+            and not any(modname.startswith(excluded_module)
+                        for excluded_module in self.excluded_modules)
 
     def list_submodules(self, module):
+        if not hasattr(module, '__path__'):
+            return []
         prefix = module.__name__ + '.'
-        for importer, modname, ispkg in pkgutil.walk_packages(
-                path=module.__path__, prefix=prefix, onerror=lambda x: None):
-            if any(modname.startswith(excluded_module)
-                   for excluded_module in self.excluded_modules):
-                continue
-            yield modname
-
-    def create_modules(self, server=('localhost', 9465)):
-        proxies = self.descriptions
-        proxies_module = types.ModuleType('proxies')
-        sys.modules['proxies'] = proxies_module
-
-        roots = []
-        modules = {}
-        for modname in sorted(proxies, key=lambda x: len(x)):
-            for root in roots:
-                if modname.startswith(root):
-                    break
-            else:
-                root = modname
-                roots.append(root)
-                modules[root] = self.create_submodule(None, modname)
-
-            current_module = modules[root]
-            for submodule in modname[len(root) + 1:].split('.'):
-                if not submodule:
-                    break
-                if not hasattr(current_module, submodule):
-                    setattr(current_module, submodule,
-                            self.create_submodule(current_module, submodule))
-                current_module = getattr(current_module, submodule)
-            modules[modname] = current_module
-
-            for name, class_ in proxies[modname].members.items():
-                setattr(current_module, name, class_.create_proxy(server))
-
-        return modules
-
-    @staticmethod
-    def create_submodule(parent, name):
-        module = types.ModuleType(name)
-        if parent is not None:
-            setattr(parent, name, module)
-            name = '.'.join((parent.__name__, name))
-        module.__name__ = name
-        return module
-
-    def set_server(self, address):
-        self.modules = self.create_modules(address)
-
-    def __import__(self, name):
-        if name in self.modules:
-            return self.modules[name]
-        raise ImportError
+        return [name for importer, name, ispkg in pkgutil.iter_modules(module.__path__)
+                if self.includes(prefix + name)]
 
     def __getstate__(self):
         state = self.__dict__.copy()
-        state.pop('modules')
+        state.pop('lock')
         return state
 
     def __setstate__(self, state):
         self.__dict__.update(state)
-        self.modules = self.create_modules()
+        self.lock = threading.Lock()
+
+
+class ProxyModule(types.ModuleType):
+    """Module with proxies of remote classes. Submodules are loaded when
+    they are first accessed."""
+    def __getattr__(self, name):
+        if name in self.__dict__.get('__submodules__', ()):
+            return self.__dict__['__proxies__'].load(self.__name__ + '.' + name)
+        raise AttributeError("module %r has no attribute %r" % (self.__name__, name))
+
+
+class ProxyModules:
+    """Modules with proxies of classes on a server, created from module
+    descriptions fetched from the server on first import."""
+    # Module descriptions are cached here, by server and contract version.
+    # None disables the cache.
+    cache_path = os.path.join(os.path.expanduser('~'), '.cache',
+                              'orange-remote', 'contracts')
+
+    def __init__(self, server, root='Orange'):
+        self.server = server
+        self.root = root
+        # contract version confirmed by the server
+        self.version = None
+        self.modules = {}
+        # proxy classes by original module and name, shared between modules
+        # that import the same class
+        self.proxies = {}
+        self.lock = threading.RLock()
+        sys.modules.setdefault('proxies', types.ModuleType('proxies'))
+
+    def load(self, modname):
+        with self.lock:
+            if modname in self.modules:
+                return self.modules[modname]
+
+            parent = None
+            if '.' in modname:
+                parent = self.load(modname.rsplit('.', 1)[0])
+
+            description = self.describe(modname)
+            module = ProxyModule(modname)
+            module.__submodules__ = description.submodules
+            module.__proxies__ = self
+            for name, class_ in description.members.items():
+                key = class_.module, class_.name
+                if key not in self.proxies:
+                    self.proxies[key] = class_.create_proxy(self.server)
+                setattr(module, name, self.proxies[key])
+            if parent is not None:
+                setattr(parent, modname.rsplit('.', 1)[1], module)
+            self.modules[modname] = module
+            return module
+
+    def describe(self, modname):
+        """Return description of the module from the cache or the server.
+
+        The first request revalidates the cached contract version with the
+        server. Once it is confirmed, cached modules are used without
+        further requests.
+        """
+        if self.version is not None:
+            description = self.read_cache(self.version, modname)
+            if description is not None:
+                return description
+
+        headers = {PROTOCOL_HEADER: str(pickle.HIGHEST_PROTOCOL)}
+        known_version = self.version or self.read_cache(None, 'version')
+        if known_version is not None and \
+                self.read_cache(known_version, modname) is not None:
+            headers["If-None-Match"] = '"%s"' % known_version
+
+        response, description = connection_pool.request(
+            self.server, "GET", 'contract/' + modname, headers=headers,
+            read=read_response)
+        if response.status == 304:
+            self.version = known_version
+            return self.read_cache(known_version, modname)
+        if response.status != 200:
+            raise ImportError("No module named %s on server" % modname)
+
+        version = response.getheader("ETag", "").strip('"')
+        if version:
+            self.version = version
+            self.write_cache(version, modname, description)
+            if version != known_version:
+                self.write_cache(None, 'version', version)
+        return description
+
+    def cache_file(self, version, name):
+        if self.cache_path is None:
+            return None
+        # addresses without a port connect to the default HTTP port
+        host, port = (tuple(self.server) + (HTTP_PORT,))[:2]
+        return os.path.join(self.cache_path, '%s-%s' % (host, port),
+                            version or '', name)
+
+    def read_cache(self, version, name):
+        filename = self.cache_file(version, name)
+        if filename is None:
+            return None
+        try:
+            with open(filename, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+
+    def write_cache(self, version, name, value):
+        filename = self.cache_file(version, name)
+        if filename is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename + '.new', 'wb') as f:
+                pickle.dump(value, f, -1)
+            os.replace(filename + '.new', filename)
+        except OSError:
+            pass
+
+    def __import__(self, name):
+        if name != self.root and not name.startswith(self.root + '.'):
+            raise ImportError
+        return self.load(name)
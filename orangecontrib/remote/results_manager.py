@@ -1,21 +1,159 @@
+import collections
+import logging
+import pickle
+import sys
 import threading
+import time
+
+from orangecontrib.remote.object_store import ObjectStore
+
+# Uploaded data is stored under its content hash with this prefix.
+BLOB_PREFIX = 'blob-'
+
+
+def estimate_size(obj):
+    """Estimate memory used by obj in bytes.
+
+    Numpy arrays and objects holding them (like Orange tables) report the
+    size of their buffers, other objects the size of their pickle.
+    """
+    if isinstance(getattr(obj, 'nbytes', None), int):
+        return obj.nbytes
+    arrays = [getattr(obj, name, None) for name in ('X', 'Y', 'metas', 'W')]
+    if any(array is not None for array in arrays):
+        return sum(map(_nbytes, arrays))
+    try:
+        return len(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(obj)
+
+
+def _nbytes(array):
+    if hasattr(array, 'nbytes'):
+        return array.nbytes
+    # scipy.sparse matrices keep their values in .data
+    return getattr(getattr(array, 'data', None), 'nbytes', 0)
+
+
+class ExternalResult:
+    """Placeholder for a result that is kept outside the server process."""
+    size = 0
+
+    def fetch(self):
+        raise NotImplementedError()
+
+    def release(self):
+        pass
+
+    def duplicate(self):
+        """Return another handle to the same result, released on its own,
+        or None if the result can not be shared."""
+        return None
 
 
 class ResultsManager:
-    results = {}
+    logger = logging.getLogger("results")
+
+    results = collections.OrderedDict()
+    # results that are being written to the ObjectStore
+    spilling = {}
     events = {}
+    condition = threading.Condition()
+
+    # Limit on the estimated size of stored results in bytes and the number
+    # of seconds after which unused results are dropped. None disables the
+    # limit.
+    max_size = None
+    ttl = None
+
+    # Uploaded blobs are not deleted by clients, so they are bounded on
+    # their own: the least recently used ones are dropped above
+    # max_blob_size bytes and after blob_ttl seconds without use.
+    max_blob_size = 2 ** 30
+    blob_ttl = 3600
+    blobs = collections.OrderedDict()
+    blob_size = 0
+
+    sizes = {}
+    last_used = {}
+    total_size = 0
+    pinned = collections.Counter()
+    released = set()
+    # Results pinned until they are deleted
+    held = set()
+    # Functions called with the id of each result that is set
+    listeners = []
 
     @classmethod
     def set_result(cls, id, result):
-        cls.results[id] = result
-        if id in cls.events:
-            cls.events[id].set()
+        blob = id.startswith(BLOB_PREFIX)
+        if isinstance(result, ExternalResult):
+            size = result.size
+        elif cls.max_size is not None or blob:
+            size = estimate_size(result)
+        else:
+            size = 0
+        with cls.condition:
+            cls._remove(id, keep_event=True)
+            ObjectStore.delete(id)
+            cls.results[id] = result
+            cls.sizes[id] = size
+            cls.total_size += size
+            cls.last_used[id] = time.monotonic()
+            if blob:
+                cls.blobs[id] = size
+                cls.blob_size += size
+                cls._evict_blobs(keep=id)
+            if id in cls.events:
+                cls.events[id].set()
+            cls.condition.notify_all()
+
+            if id in cls.released and not cls.pinned[id]:
+                cls.released.discard(id)
+                cls._remove(id)
+            spilled = cls._evict(keep=id)
+        for listener in cls.listeners:
+            listener(id)
+        cls._spill(spilled)
 
     @classmethod
-    def get_result(cls, id):
+    def get_result(cls, id, fetch=True):
+        """Return the result, waiting until it is ready. Unless fetch is
+        False, external results are fetched from where they are kept."""
         if id in cls.events:
             cls.events[id].wait()
-        return cls.results[id]
+        with cls.condition:
+            if id in cls.results:
+                cls.results.move_to_end(id)
+                if id in cls.blobs:
+                    cls.blobs.move_to_end(id)
+                cls.last_used[id] = time.monotonic()
+                result = cls.results[id]
+            elif id in cls.spilling:
+                result = cls.spilling[id]
+            else:
+                return ObjectStore.load(id)
+        if fetch and isinstance(result, ExternalResult):
+            try:
+                return result.fetch()
+            except KeyError:
+                # released after it was moved to the ObjectStore
+                return ObjectStore.load(id)
+        return result
+
+    @classmethod
+    def replace_result(cls, id, old, new):
+        """Store the same result in another form, e.g. moved to shared
+        memory, or a failure if it was lost. Return False if the result
+        is no longer old."""
+        with cls.condition:
+            if cls.results.get(id) is not old:
+                return False
+            size = new.size if isinstance(new, ExternalResult) else 0
+            cls.results[id] = new
+            cls.total_size += size - cls.sizes[id]
+            cls.sizes[id] = size
+            return True
 
     @classmethod
     def register_result(cls, id):
@@ -23,8 +161,148 @@ class ResultsManager:
 
     @classmethod
     def has_result(cls, resource_id):
-        return resource_id in cls.results
+        return resource_id in cls.results or resource_id in cls.spilling or \
+            ObjectStore.contains(resource_id)
 
     @classmethod
     def awaiting_result(cls, resource_id):
         return resource_id in cls.events
+
+    @classmethod
+    def delete_result(cls, id):
+        """Drop a result. Results that are still pinned or not computed
+        yet are dropped as soon as they are released."""
+        with cls.condition:
+            if not cls.has_result(id) and not cls.awaiting_result(id):
+                raise KeyError(id)
+            if id in cls.held:
+                cls.held.discard(id)
+                cls.unpin([id])
+            if cls.pinned[id] or not cls.has_result(id) or id in cls.spilling:
+                cls.released.add(id)
+            else:
+                cls._discard(id)
+
+    @classmethod
+    def pin(cls, ids):
+        """Protect results from eviction while queued commands need them."""
+        with cls.condition:
+            cls.pinned.update(ids)
+
+    @classmethod
+    def hold(cls, id):
+        """Protect the result from eviction until it is deleted."""
+        with cls.condition:
+            cls.held.add(id)
+            cls.pinned[id] += 1
+
+    @classmethod
+    def unpin(cls, ids):
+        with cls.condition:
+            cls.pinned.subtract(ids)
+            for id in ids:
+                if cls.pinned[id] > 0:
+                    continue
+                del cls.pinned[id]
+                if id in cls.released and cls.has_result(id) and \
+                        id not in cls.spilling:
+                    cls.released.discard(id)
+                    cls._discard(id)
+
+    @classmethod
+    def _evict(cls, keep=None):
+        """Drop expired results and the least recently used ones while
+        over the size limit. Returns results that should be moved to the
+        ObjectStore."""
+        spilled = []
+        now = time.monotonic()
+        for id in list(cls.results):
+            expired = cls.ttl is not None and now - cls.last_used[id] > cls.ttl
+            too_large = cls.max_size is not None and cls.total_size > cls.max_size
+            if not expired and not too_large:
+                break
+            if cls.pinned[id] or id == keep:
+                continue
+            if too_large and not expired and ObjectStore.enabled:
+                cls.logger.debug("Spilling result %s", id)
+                cls.spilling[id] = cls.results[id]
+                spilled.append(id)
+                cls._remove(id, keep_event=True, release=False)
+            else:
+                cls.logger.debug("Evicting result %s", id)
+                cls._remove(id)
+        return spilled
+
+    @classmethod
+    def _evict_blobs(cls, keep=None):
+        now = time.monotonic()
+        for id in list(cls.blobs):
+            expired = cls.blob_ttl is not None and now - cls.last_used[id] > cls.blob_ttl
+            if not expired and cls.blob_size <= cls.max_blob_size:
+                break
+            if id != keep and not cls.pinned[id]:
+                cls.logger.debug("Dropping blob %s", id)
+                cls._discard(id)
+
+    @classmethod
+    def _spill(cls, ids):
+        for id in ids:
+            result = cls.spilling[id]
+            if isinstance(result, ExternalResult):
+                try:
+                    saved = ObjectStore.save(id, result.fetch())
+                except Exception as err:
+                    cls.logger.debug("Result %s can not be fetched: %s", id, err)
+                    saved = False
+            else:
+                saved = ObjectStore.save(id, result)
+            with cls.condition:
+                del cls.spilling[id]
+                if isinstance(result, ExternalResult):
+                    result.release()
+                if not saved:
+                    cls.events.pop(id, None)
+                elif id in cls.released and not cls.pinned[id]:
+                    cls.released.discard(id)
+                    cls._discard(id)
+
+    @classmethod
+    def _remove(cls, id, keep_event=False, release=True):
+        if id in cls.results:
+            result = cls.results.pop(id)
+            cls.total_size -= cls.sizes.pop(id)
+            del cls.last_used[id]
+            if id in cls.blobs:
+                cls.blob_size -= cls.blobs.pop(id)
+            if release and isinstance(result, ExternalResult):
+                result.release()
+        if not keep_event:
+            cls.events.pop(id, None)
+
+    @classmethod
+    def _discard(cls, id):
+        cls._remove(id)
+        ObjectStore.delete(id)
+
+    @classmethod
+    def wait_any(cls, ids, timeout=None):
+        """Wait until at least one of the results is ready and return
+        the ids of ready results."""
+        return cls._wait(any, ids, timeout)
+
+    @classmethod
+    def wait_all(cls, ids, timeout=None):
+        """Wait until all results are ready and return the ids of ready
+        results."""
+        return cls._wait(all, ids, timeout)
+
+    @classmethod
+    def _wait(cls, condition, ids, timeout):
+        for id in ids:
+            if not cls.has_result(id) and not cls.awaiting_result(id):
+                raise KeyError(id)
+
+        with cls.condition:
+            cls.condition.wait_for(
+                lambda: condition(map(cls.has_result, ids)), timeout)
+            return [id for id in ids if cls.has_result(id)]
@@ -0,0 +1,149 @@
+""" Order in which commands are executed.
+
+Commands are taken by priority, and round-robin between clients with the
+same priority, so a client with thousands of queued commands does not
+starve the others. Limits on queued and executing commands push back on
+clients instead of accepting unbounded work.
+"""
+import collections
+import queue
+import threading
+
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+NORMAL = PRIORITIES['normal']
+# Returned when no client has commands that can be executed
+NO_CLIENT = object()
+
+
+class Overloaded(Exception):
+    """Command was not accepted. Clients should retry after retry_after
+    seconds."""
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Scheduler:
+    def __init__(self):
+        # Limits on commands of one client that are waiting for execution
+        # and that are executing, and on all waiting commands. None
+        # disables the limit.
+        self.max_queued = None
+        self.max_in_flight = None
+        self.max_total = None
+        self.retry_after = 1
+
+        self.condition = threading.Condition()
+        # one queue of ready commands per client on each priority level
+        self.ready = [collections.OrderedDict() for _ in PRIORITIES]
+        # result id -> [client, priority, executing]
+        self.commands = {}
+        self.queued = collections.Counter()
+        self.in_flight = collections.Counter()
+        self.total = 0
+
+    def admit(self, ids, client=None, priority=NORMAL):
+        """Accept commands or raise Overloaded."""
+        with self.condition:
+            if self.max_total is not None and \
+                    self.total + len(ids) > self.max_total:
+                raise Overloaded("Server is busy", 503, self.retry_after)
+            if self.max_queued is not None and \
+                    self.queued[client] + len(ids) > self.max_queued:
+                raise Overloaded("Too many queued commands", 429, self.retry_after)
+            for id in ids:
+                self.commands[id] = [client, priority, False]
+            self.queued[client] += len(ids)
+            self.total += len(ids)
+
+    def put(self, id, command, priority=None):
+        """Queue an admitted command whose inputs are ready."""
+        with self.condition:
+            client, admitted_priority, _ = self.commands.get(id, (None, NORMAL, False))
+            if priority is None:
+                priority = admitted_priority
+            self.ready[priority].setdefault(client, collections.deque()) \
+                .append((id, command))
+            self.condition.notify()
+
+    def get(self, block=True, timeout=None):
+        """Return (id, command) of the next command to execute."""
+        with self.condition:
+            item = self._take()
+            if item is None and block:
+                self.condition.wait_for(
+                    lambda: self._has_ready(), timeout)
+                item = self._take()
+            if item is None:
+                raise queue.Empty()
+            return item
+
+    def remove(self, id):
+        """Take a queued command out of the ready queues and return it, or
+        None if it is not there."""
+        with self.condition:
+            for clients in self.ready:
+                for client, items in clients.items():
+                    for item in items:
+                        if item[0] == id:
+                            items.remove(item)
+                            if not items:
+                                del clients[client]
+                            return item[1]
+            return None
+
+    def done(self, id):
+        """Forget a command that completed or was cancelled."""
+        with self.condition:
+            if id not in self.commands:
+                return
+            client, _, executing = self.commands.pop(id)
+            if executing:
+                self._decrement(self.in_flight, client)
+            else:
+                self._decrement(self.queued, client)
+                self.total -= 1
+            self.condition.notify()
+
+    def get_stats(self):
+        with self.condition:
+            return {'queued': dict(self.queued),
+                    'in_flight': dict(self.in_flight),
+                    'total': self.total}
+
+    def _has_ready(self):
+        return any(self._next_client(clients) is not NO_CLIENT
+                   for clients in self.ready)
+
+    def _next_client(self, clients):
+        for client in clients:
+            if self.max_in_flight is None or client is None or \
+                    self.in_flight[client] < self.max_in_flight:
+                return client
+        return NO_CLIENT
+
+    def _take(self):
+        for clients in self.ready:
+            client = self._next_client(clients)
+            if client is NO_CLIENT:
+                continue
+            items = clients[client]
+            id, command = items.popleft()
+            if items:
+                clients.move_to_end(client)
+            else:
+                del clients[client]
+            if id in self.commands and not self.commands[id][2]:
+                self.commands[id][2] = True
+                self._decrement(self.queued, client)
+                self.total -= 1
+                self.in_flight[client] += 1
+            return id, command
+        return None
+
+    @staticmethod
+    def _decrement(counter, key):
+        counter[key] -= 1
+        if counter[key] <= 0:
+            del counter[key]
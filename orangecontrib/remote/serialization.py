@@ -0,0 +1,364 @@
+""" Binary serialization of results and commands.
+
+Objects are pickled with protocol 5 and their buffers are sent out of
+band, so large arrays are written straight from the memory of the object
+and read straight into the memory of the new one.
+
+Results are sent as a stream of frames, each a one byte type and an eight
+byte length followed by the payload: pickle data (P), out-of-band buffers
+(B) and the end of the stream (E). Commands are sent as a JSON frame (J)
+followed by the buffer frames its arrays refer to by index.
+
+Clients can accept compressed buffers by listing codecs in the
+X-Orange-Codecs header. A compressed buffer starts with a frame (S) whose
+length is the size of the buffer, followed by frames (Z) with its chunks,
+each a one byte codec id and the compressed chunk. Chunks that do not
+compress well are sent as they are.
+
+Responses that are not streams are pickled with the highest protocol that
+both sides support; the client announces its protocol in the
+X-Orange-Pickle-Protocol header.
+"""
+import collections
+import functools
+import hashlib
+import json
+import pickle
+import struct
+import zlib
+
+import numpy as np
+import Orange
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+STREAM_CONTENT_TYPE = "application/x-orange-stream"
+COMMAND_CONTENT_TYPE = "application/x-orange-command"
+
+FRAME_HEADER = struct.Struct('!cQ')
+PICKLE_FRAME, BUFFER_FRAME, END_FRAME, JSON_FRAME = b'P', b'B', b'E', b'J'
+COMPRESSED_BUFFER_FRAME, CHUNK_FRAME = b'S', b'Z'
+MAX_WRITE = 2 ** 24
+ALIGNMENT = 64
+
+PROTOCOL_HEADER = "X-Orange-Pickle-Protocol"
+CODECS_HEADER = "X-Orange-Codecs"
+
+# name -> (id, compress, decompress)
+CODECS = {'zlib': (b'z', functools.partial(zlib.compress, level=1), zlib.decompress)}
+if lz4 is not None:
+    CODECS['lz4'] = (b'4', lz4.frame.compress, lz4.frame.decompress)
+DECOMPRESSORS = {id: decompress for id, _, decompress in CODECS.values()}
+RAW_CHUNK = b'-'
+# Buffers are compressed in chunks of this size; smaller ones are not
+# compressed at all.
+CHUNK_SIZE = 2 ** 20
+MIN_COMPRESSED_SIZE = 2 ** 16
+# Chunks are compressed only if they shrink below this fraction
+MAX_COMPRESSION_RATIO = 0.9
+
+
+class TableBuffers:
+    """Arrays and metadata of a table.
+
+    Table.__setstate__ copies arrays that are views on other buffers, so
+    tables are pickled in this form and rebuilt with Table.from_numpy.
+    """
+    def __init__(self, table):
+        self.domain = table.domain
+        self.X = table.X
+        self.Y = table.Y
+        self.metas = table.metas
+        self.W = table.W
+        self.attributes = table.attributes
+        self.ids = table.ids
+        self.name = table.name
+
+    def to_table(self):
+        table = Orange.data.Table.from_numpy(
+            self.domain, self.X, self.Y, self.metas, self.W,
+            self.attributes, self.ids)
+        table.name = self.name
+        return table
+
+
+def pack(obj):
+    if type(obj) is Orange.data.Table:
+        return TableBuffers(obj)
+    return obj
+
+
+def unpack(obj):
+    if isinstance(obj, TableBuffers):
+        return obj.to_table()
+    return obj
+
+
+def dumps(obj, protocol=pickle.HIGHEST_PROTOCOL):
+    """Pickle a response that is not sent as a stream."""
+    return pickle.dumps(obj, protocol=min(protocol, pickle.HIGHEST_PROTOCOL))
+
+
+def loads(data):
+    return pickle.loads(data)
+
+
+def request_headers(codecs=()):
+    """Headers with which a client asks for results in the best format it
+    can read: streams, if it supports protocol 5, and compressed with one
+    of the given codecs."""
+    headers = {PROTOCOL_HEADER: str(pickle.HIGHEST_PROTOCOL)}
+    if pickle.HIGHEST_PROTOCOL >= 5:
+        headers["Accept"] = STREAM_CONTENT_TYPE
+        codecs = [codec for codec in codecs or () if codec in CODECS]
+        if codecs:
+            headers[CODECS_HEADER] = ", ".join(codecs)
+    return headers
+
+
+def negotiate(headers):
+    """Return whether to send a stream, the pickle protocol and the codec
+    (or None) for a request with the given headers. Clients that do not
+    announce their protocol get pickles of the default protocol."""
+    try:
+        protocol = int(headers.get(PROTOCOL_HEADER, pickle.DEFAULT_PROTOCOL))
+    except ValueError:
+        protocol = pickle.DEFAULT_PROTOCOL
+    protocol = min(protocol, pickle.HIGHEST_PROTOCOL)
+    stream = STREAM_CONTENT_TYPE in headers.get("Accept", "")
+    codec = None
+    if stream:
+        for name in headers.get(CODECS_HEADER, "").split(","):
+            if name.strip() in CODECS:
+                codec = name.strip()
+                break
+    return stream, protocol, codec
+
+
+def serialize_data(obj):
+    """Split an array or another object into a kind, JSON serializable
+    metadata and a list of buffers."""
+    if isinstance(obj, np.ndarray) and not obj.dtype.hasobject and obj.dtype.fields is None:
+        if not obj.flags.c_contiguous and not obj.flags.f_contiguous:
+            obj = np.ascontiguousarray(obj)
+        order = 'C' if obj.flags.c_contiguous else 'F'
+        return 'ndarray', [obj.dtype.str, list(obj.shape), order], [obj]
+
+    out_of_band = []
+    data = pickle.dumps(pack(obj), protocol=5, buffer_callback=out_of_band.append)
+    return 'PyObject5', [], [data] + out_of_band
+
+
+def data_reference(kind, metadata, first, count):
+    """Parameters of a serialized object whose buffers start at index first."""
+    if kind == 'ndarray':
+        return [first] + metadata
+    return [first, list(range(first + 1, first + count))]
+
+
+def deserialize_data(kind, reference, buffers):
+    """Return the object, its metadata and its buffers."""
+    if kind == 'ndarray':
+        index, dtype, shape, order = reference
+        array = np.frombuffer(buffers[index], dtype=dtype).reshape(shape, order=order)
+        return array, [dtype, shape, order], [buffers[index]]
+
+    first, indices = reference
+    parts = [buffers[first]] + [buffers[i] for i in indices]
+    return unpack(pickle.loads(parts[0], buffers=parts[1:])), [], parts
+
+
+def nbytes(parts):
+    return sum(pickle.PickleBuffer(part).raw().nbytes for part in parts)
+
+
+def content_hash(kind, metadata, parts):
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(json.dumps([kind, metadata]).encode('utf-8'))
+    for part in parts:
+        digest.update(pickle.PickleBuffer(part).raw())
+    return digest.hexdigest()
+
+
+def encode_command(message, buffers):
+    """Return parts of a request body and its length. Buffers are not
+    copied."""
+    message = message.encode('utf-8')
+    parts = [FRAME_HEADER.pack(JSON_FRAME, len(message)), message]
+    position = FRAME_HEADER.size + len(message)
+    for buffer in buffers:
+        raw = pickle.PickleBuffer(buffer).raw()
+        position += FRAME_HEADER.size
+        padding = -position % ALIGNMENT
+        parts.append(FRAME_HEADER.pack(BUFFER_FRAME, raw.nbytes) + b'\0' * padding)
+        parts.append(raw)
+        position += padding + raw.nbytes
+    return parts, position
+
+
+def decode_command(data):
+    """Return the JSON message and memoryviews of buffers in data."""
+    view = memoryview(data)
+    message, buffers = None, []
+    position = 0
+    while position < len(view):
+        kind, size = FRAME_HEADER.unpack_from(view, position)
+        position += FRAME_HEADER.size
+        if kind == JSON_FRAME:
+            message = bytes(view[position:position + size]).decode('utf-8')
+        elif kind == BUFFER_FRAME:
+            position += -position % ALIGNMENT
+            buffers.append(view[position:position + size])
+        else:
+            raise ValueError("Invalid frame type %r" % kind)
+        position += size
+    if message is None:
+        raise ValueError("Command is missing")
+    return message, buffers
+
+
+def dump_stream(obj, write, codec=None):
+    """Serialize obj by calling write with consecutive parts of the stream.
+    Large buffers are compressed with the codec, if given."""
+    class PickleFile:
+        @staticmethod
+        def write(data):
+            write(FRAME_HEADER.pack(PICKLE_FRAME, len(data)))
+            write(data)
+
+    def buffer_callback(buffer):
+        raw = buffer.raw()
+        if codec is not None and raw.nbytes >= MIN_COMPRESSED_SIZE:
+            write_compressed(raw, write, *CODECS[codec][:2])
+            return False
+        write(FRAME_HEADER.pack(BUFFER_FRAME, raw.nbytes))
+        for i in range(0, raw.nbytes, MAX_WRITE):
+            write(raw[i:i + MAX_WRITE])
+        return False
+
+    pickle.Pickler(PickleFile(), protocol=5,
+                   buffer_callback=buffer_callback).dump(pack(obj))
+    write(FRAME_HEADER.pack(END_FRAME, 0))
+
+
+def write_compressed(raw, write, id, compress):
+    write(FRAME_HEADER.pack(COMPRESSED_BUFFER_FRAME, raw.nbytes))
+    for i in range(0, raw.nbytes, CHUNK_SIZE):
+        chunk = raw[i:i + CHUNK_SIZE]
+        compressed = compress(chunk)
+        if len(compressed) > MAX_COMPRESSION_RATIO * chunk.nbytes:
+            id, compressed = RAW_CHUNK, chunk
+        write(FRAME_HEADER.pack(CHUNK_FRAME, 1 + len(compressed)) + id)
+        write(compressed)
+
+
+def load_stream(file):
+    """Deserialize an object from a file-like object with read and readinto."""
+    reader = StreamReader(file)
+    obj = pickle.Unpickler(reader, buffers=reader.buffers()).load()
+    while not reader.done:
+        reader.read_frame()
+    return unpack(obj)
+
+
+class StreamReader:
+    """File-like view on the pickle frames of a stream.
+
+    Out-of-band buffers are read into their own bytearrays whenever they
+    are reached, regardless of whether the unpickler asked for pickle data
+    or for the next buffer.
+    """
+    def __init__(self, file):
+        self.file = file
+        self.pickled = bytearray()
+        self.position = 0
+        self.received_buffers = collections.deque()
+        self.done = False
+
+    def read_frame(self):
+        kind, size = FRAME_HEADER.unpack(self.read_exactly(FRAME_HEADER.size))
+        if kind == PICKLE_FRAME:
+            if self.position:
+                del self.pickled[:self.position]
+                self.position = 0
+            self.pickled += self.read_exactly(size)
+        elif kind == BUFFER_FRAME:
+            buffer = bytearray(size)
+            self.readinto_exactly(memoryview(buffer))
+            self.received_buffers.append(buffer)
+        elif kind == COMPRESSED_BUFFER_FRAME:
+            self.received_buffers.append(self.read_compressed(size))
+        elif kind == END_FRAME:
+            self.done = True
+        else:
+            raise pickle.UnpicklingError("Invalid frame type %r" % kind)
+
+    def read_compressed(self, size):
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        position = 0
+        while position < size:
+            kind, length = FRAME_HEADER.unpack(self.read_exactly(FRAME_HEADER.size))
+            if kind != CHUNK_FRAME:
+                raise pickle.UnpicklingError("Invalid frame type %r" % kind)
+            chunk_size = min(CHUNK_SIZE, size - position)
+            id = self.read_exactly(1)
+            if id == RAW_CHUNK:
+                self.readinto_exactly(view[position:position + chunk_size])
+            elif id in DECOMPRESSORS:
+                chunk = DECOMPRESSORS[id](self.read_exactly(length - 1))
+                if len(chunk) != chunk_size:
+                    raise pickle.UnpicklingError("Invalid compressed chunk")
+                view[position:position + chunk_size] = chunk
+            else:
+                raise pickle.UnpicklingError("Unknown codec %r" % id)
+            position += chunk_size
+        return buffer
+
+    def read_exactly(self, size):
+        data = self.file.read(size)
+        while len(data) < size:
+            more = self.file.read(size - len(data))
+            if not more:
+                raise EOFError("Stream ended unexpectedly")
+            data += more
+        return data
+
+    def readinto_exactly(self, view):
+        position = 0
+        while position < len(view):
+            n = self.file.readinto(view[position:])
+            if not n:
+                raise EOFError("Stream ended unexpectedly")
+            position += n
+
+    def buffers(self):
+        while True:
+            while not self.received_buffers:
+                if self.done:
+                    return
+                self.read_frame()
+            yield self.received_buffers.popleft()
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.pickled) - self.position < size) \
+                and not self.done:
+            self.read_frame()
+        end = len(self.pickled) if size < 0 else self.position + size
+        data = bytes(self.pickled[self.position:end])
+        self.position += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readline(self):
+        while b'\n' not in self.pickled[self.position:] and not self.done:
+            self.read_frame()
+        end = self.pickled.find(b'\n', self.position) + 1 or len(self.pickled)
+        return self.read(end - self.position)
@@ -0,0 +1,148 @@
+""" Large results passed between the server and pool workers through shared
+memory.
+
+Buffers of large arrays, tables and models are written once to a shared
+memory segment and only a small SharedResult is pickled through the pool's
+pipes. Processes map the segment copy-on-write, so they get the data
+without copying it and changes they make stay private. The segment lives
+as long as the result's entry in the ResultsManager.
+"""
+import mmap
+import os
+import pickle
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+from orangecontrib.remote.commands import execute_timed
+from orangecontrib.remote.results_manager import ResultsManager, ExternalResult
+from orangecontrib.remote.serialization import serialize_data, \
+    deserialize_data, data_reference, nbytes, ALIGNMENT
+
+SHM_PATH = '/dev/shm'
+
+
+class SharedResult(ExternalResult):
+    # Smaller results are sent through pipes
+    min_size = 2 ** 20
+
+    # segment name -> number of handles in this process that use it; a
+    # segment without an entry has one
+    references = {}
+    lock = threading.Lock()
+
+    def __init__(self, name, size, kind, metadata, layout):
+        self.name = name
+        self.size = size
+        self.kind = kind
+        self.metadata = metadata
+        # (offset, size) of buffers in the segment
+        self.layout = layout
+
+    @classmethod
+    def create(cls, value):
+        """Write value to a new segment. Return None if it is too small."""
+        if isinstance(value, (ExternalResult, str, bytes)):
+            return None
+        try:
+            kind, metadata, parts = serialize_data(value)
+        except Exception:
+            return None
+        if nbytes(parts) < cls.min_size:
+            return None
+
+        parts = [pickle.PickleBuffer(part).raw() for part in parts]
+        layout, size = [], 0
+        for part in parts:
+            size = -(-size // ALIGNMENT) * ALIGNMENT
+            layout.append((size, part.nbytes))
+            size += part.nbytes
+        segment = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            for (offset, length), part in zip(layout, parts):
+                segment.buf[offset:offset + length] = part
+        finally:
+            segment.close()
+        return cls(segment.name, size, kind, metadata, layout)
+
+    def fetch(self):
+        buffer = attach(self.name, self.size)
+        buffers = [buffer[offset:offset + length] for offset, length in self.layout]
+        reference = data_reference(self.kind, self.metadata, 0, len(buffers))
+        return deserialize_data(self.kind, reference, buffers)[0]
+
+    def release(self):
+        with self.lock:
+            count = self.references.pop(self.name, 1) - 1
+            if count > 0:
+                self.references[self.name] = count
+                return
+        try:
+            segment = shared_memory.SharedMemory(self.name)
+        except FileNotFoundError:
+            return
+        segment.unlink()
+        segment.close()
+
+    def track(self):
+        """Unlink the segment if this process exits without releasing it."""
+        resource_tracker.register(tracker_name(self.name), "shared_memory")
+
+    def duplicate(self):
+        with self.lock:
+            self.references[self.name] = self.references.get(self.name, 1) + 1
+        return SharedResult(self.name, self.size, self.kind, self.metadata,
+                            self.layout)
+
+    @staticmethod
+    def share(promise):
+        """Resolve promise to a SharedResult if its result is large, so the
+        pool does not pickle it."""
+        result = ResultsManager.get_result(promise.id, fetch=False)
+        if isinstance(result, SharedResult):
+            return result
+        if isinstance(result, ExternalResult):
+            return ResultsManager.get_result(promise.id)
+        shared = SharedResult.create(result)
+        if shared is None:
+            return result
+        if not ResultsManager.replace_result(promise.id, result, shared):
+            shared.release()
+            return result
+        return shared
+
+
+def tracker_name(name):
+    return '/' + name.lstrip('/')
+
+
+def attach(name, size):
+    """Map the segment copy-on-write, or copy it where segments are not
+    files. Raise KeyError if the segment was released."""
+    try:
+        with open(os.path.join(SHM_PATH, name.lstrip('/')), 'rb') as f:
+            return memoryview(mmap.mmap(f.fileno(), size, access=mmap.ACCESS_COPY))
+    except FileNotFoundError:
+        raise KeyError(name)
+    except OSError:
+        try:
+            segment = shared_memory.SharedMemory(name)
+        except FileNotFoundError:
+            raise KeyError(name)
+        try:
+            return memoryview(bytearray(segment.buf[:size]))
+        finally:
+            segment.close()
+
+
+def execute_shared(id, command, abort_slot=None):
+    """Execute a command in a pool worker and return large results in
+    shared memory."""
+    command.resolve_promises(SharedResult.fetch, SharedResult)
+    id, value, timing = execute_timed(id, command, abort_slot)
+    shared = SharedResult.create(value)
+    if shared is None:
+        return id, value, timing
+    # The server owns the segment. The resource tracker of this worker
+    # would unlink it when the worker is killed.
+    resource_tracker.unregister(tracker_name(shared.name), "shared_memory")
+    return id, shared, timing
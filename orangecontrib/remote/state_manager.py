@@ -1,25 +1,73 @@
+import collections
+import logging
 import os
 import pickle
+import threading
+import time
+
+from orangecontrib.remote.serialization import dump_stream, load_stream
 
 
 class StateManager:
+    """States and progress of running commands.
+
+    Workers send states and progress records to the server through a
+    queue and the server keeps them in memory until the command completes.
+    States can also be saved to disk, at most every persist_interval
+    seconds.
+    """
+    logger = logging.getLogger("state")
     __id__ = None
 
     storage_path = os.path.join(os.path.dirname(__file__), 'saved_states')
-    if not os.path.exists(storage_path):
-        os.mkdir(storage_path)
+    # None keeps states in memory only
+    persist_interval = None
+    # Progress records of a command that are kept for late subscribers
+    max_records = 1000
+
+    # queue to the server, set in worker processes
+    channel = None
+
+    states = {}
+    records = {}
+    last_persisted = {}
+    # Commands are finished when they have completed and the worker has
+    # sent all their records, which can arrive in either order.
+    completed = set()
+    ended = set()
+    # ids of recently finished commands; their records are kept for late
+    # subscribers
+    finished = collections.OrderedDict()
+    max_finished = 1000
+    sequence = 0
+    condition = threading.Condition()
 
     @classmethod
     def get_state(cls, id):
+        with cls.condition:
+            if id in cls.states:
+                return cls.states[id]
+        if cls.persist_interval is None:
+            return None
         try:
             fn = os.path.join(cls.storage_path, id)
             with open(fn, 'rb') as f:
-                return pickle.load(f)
-        except (IOError, pickle.UnpicklingError):
+                return load_stream(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
             pass
 
     @classmethod
     def save_state(cls, state, id=None):
+        cls.publish(id, 'state', state)
+
+    @classmethod
+    def report_progress(cls, id=None, **values):
+        """Report progress, e.g. fraction done or current loss. Values
+        should be small: numbers, strings or small arrays."""
+        cls.publish(id, 'progress', values)
+
+    @classmethod
+    def publish(cls, id, kind, value):
         if id is None:
             id = cls.__id__
 
@@ -27,17 +75,103 @@ class StateManager:
             raise ValueError("save_state was called outside worker, "
                              "but no id was provided")
 
+        if cls.channel is not None:
+            # Pickled now: the queue pickles in a thread of its own, while
+            # the command may already be changing the state.
+            cls.channel.put(pickle.dumps((id, kind, value),
+                                         pickle.HIGHEST_PROTOCOL))
+        else:
+            cls.receive(id, kind, value)
+
+    @classmethod
+    def end(cls, id):
+        """Called in the worker after the command, when it will not send
+        any more records."""
+        cls.publish(id, 'end', None)
+
+    @classmethod
+    def receive(cls, id, kind, value):
+        with cls.condition:
+            if id in cls.finished:
+                return
+            if kind == 'end':
+                if id in cls.completed:
+                    cls._finish(id)
+                else:
+                    cls.ended.add(id)
+                return
+            if kind == 'state':
+                cls.states[id] = value
+            else:
+                cls.sequence += 1
+                record = dict(value, time=time.time())
+                cls.records.setdefault(
+                    id, collections.deque(maxlen=cls.max_records)
+                ).append((cls.sequence, record))
+            cls.condition.notify_all()
+
+        if kind == 'state' and cls.persist_interval is not None:
+            now = time.monotonic()
+            if now - cls.last_persisted.get(id, -cls.persist_interval) >= cls.persist_interval:
+                cls.last_persisted[id] = now
+                cls.persist(id, value)
+
+    @classmethod
+    def persist(cls, id, state):
+        if not os.path.exists(cls.storage_path):
+            os.mkdir(cls.storage_path)
         fn = os.path.join(cls.storage_path, id)
         tmpfn = fn + '.new'
         with open(tmpfn, 'wb') as f:
-            pickle.dump(state, f, -1)
+            dump_stream(state, f.write)
         os.replace(tmpfn, fn)
 
     @classmethod
-    def delete_state(cls, id):
-        saved_state = os.path.join(cls.storage_path, id)
-        if os.path.exists(saved_state):
-            os.remove(saved_state)
+    def get_progress(cls, id, after=0, timeout=None):
+        """Return progress records with sequence numbers above after, as
+        (sequence, record) pairs, and whether the command has completed.
+        Waits for new records if there are none."""
+        def new_records():
+            return [(seq, record) for seq, record in cls.records.get(id, ())
+                    if seq > after]
+
+        with cls.condition:
+            cls.condition.wait_for(
+                lambda: new_records() or id in cls.finished, timeout)
+            return new_records(), id in cls.finished
+
+    @classmethod
+    def delete_state(cls, id, force=False):
+        """Forget the state of a completed command. Unless force is True,
+        records that the worker has not sent yet are still expected."""
+        with cls.condition:
+            if force or id in cls.ended:
+                cls._finish(id)
+            else:
+                cls.completed.add(id)
+        if cls.last_persisted.pop(id, None) is not None:
+            saved_state = os.path.join(cls.storage_path, id)
+            if os.path.exists(saved_state):
+                os.remove(saved_state)
+
+    @classmethod
+    def _finish(cls, id):
+        cls.completed.discard(id)
+        cls.ended.discard(id)
+        cls.states.pop(id, None)
+        cls.finished[id] = True
+        while len(cls.finished) > cls.max_finished:
+            cls.records.pop(cls.finished.popitem(last=False)[0], None)
+        cls.condition.notify_all()
+
+    @classmethod
+    def listen(cls, channel):
+        """Receive states from workers until None is put in the channel."""
+        for message in iter(channel.get, None):
+            try:
+                cls.receive(*pickle.loads(message))
+            except Exception as err:
+                cls.logger.exception(err)
 
     @classmethod
     def set_id(cls, id):
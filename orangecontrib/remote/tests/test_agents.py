@@ -0,0 +1,188 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+import uuid
+from http.client import HTTPConnection
+
+import numpy as np
+
+from orangecontrib.remote.agents import AgentResult
+from orangecontrib.remote.command_processor import CommandProcessor
+from orangecontrib.remote.commands import Create, Call, Promise, ExecutionFailed
+from orangecontrib.remote.http_server import OrangeHTTPServer, OrangeServer
+from orangecontrib.remote.proxy import ConnectionPool, decode_response, \
+    connection_pool
+from orangecontrib.remote.results_manager import ResultsManager
+from orangecontrib.remote.state_manager import StateManager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))))
+
+
+class LostResponse(HTTPConnection):
+    """Kept-alive connection whose response never arrives."""
+    def __init__(self, address):
+        super().__init__(*address)
+        self.sock, self.peer = socket.socketpair()
+
+    def getresponse(self):
+        raise ConnectionResetError("Connection reset by peer")
+
+    def close(self):
+        super().close()
+        self.peer.close()
+
+
+class AgentTests(unittest.TestCase):
+    server = server_thread = worker = worker_thread = None
+    agents = []
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = OrangeHTTPServer(('localhost', 0), OrangeServer,
+                                      max_threads=8)
+        cls.server_thread = threading.Thread(
+            name='Orange server serving',
+            target=cls.server.serve_forever,
+            kwargs={'poll_interval': 0.01}
+        )
+        cls.server_thread.start()
+        cls.worker = CommandProcessor(coordinator=True)
+        cls.worker_thread = threading.Thread(
+            name='Processing thread',
+            target=cls.worker.run,
+            kwargs={'poll_interval': 0.01}
+        )
+        cls.worker_thread.start()
+
+        coordinator = "localhost:%s" % cls.server.server_address[1]
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        cls.agents = [
+            subprocess.Popen(
+                [sys.executable, "-m", "orangecontrib.remote", "-p", "0",
+                 "--host", "localhost", "-w", "1", "--agent-of", coordinator],
+                env=env, stdout=subprocess.DEVNULL)
+            for _ in range(2)]
+
+        pool = ConnectionPool()
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            response, data = pool.request(cls.server.server_address,
+                                          "GET", "stats/agents")
+            if response.status == 200 and len(decode_response(response, data)) == 2:
+                break
+            time.sleep(0.1)
+        pool.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        for agent in cls.agents:
+            agent.terminate()
+            agent.wait()
+        cls.server.shutdown()
+        cls.server_thread.join()
+        cls.worker.shutdown()
+        cls.worker_thread.join()
+        cls.server.server_close()
+
+    def execute(self, command):
+        result_id = str(uuid.uuid4())
+        ResultsManager.register_result(result_id)
+        CommandProcessor.queue((result_id, command))
+        return result_id
+
+    def test_agents_register(self):
+        self.assertEqual(len(CommandProcessor.agents.get_stats()), 2)
+
+    def test_commands_run_where_their_data_is(self):
+        ones = self.execute(Create(module="numpy", class_="ones", args=[10 ** 6]))
+        total = self.execute(Call(object=Promise(ones), method="sum"))
+
+        self.assertEqual(ResultsManager.get_result(total), 10 ** 6)
+        remote = ResultsManager.get_result(ones, fetch=False)
+        self.assertIsInstance(remote, AgentResult)
+        self.assertEqual(remote.size, 8 * 10 ** 6)
+        # calls on the array run on the agent that holds it
+        agent = CommandProcessor.agents.choose_agent(
+            Call(object=Promise(ones), method="max"), {ones: remote})
+        self.assertIs(agent, remote.agent)
+        np.testing.assert_equal(ResultsManager.get_result(ones), np.ones(10 ** 6))
+        ResultsManager.delete_result(ones)
+
+    def test_small_results_are_moved_to_coordinator(self):
+        small = self.execute(Create(module="numpy", class_="arange", args=[10]))
+        ResultsManager.get_result(small)
+        self.assertIsInstance(ResultsManager.get_result(small, fetch=False),
+                              np.ndarray)
+        # and are sent with commands that use them
+        total = self.execute(Create(module="numpy", class_="sum",
+                                    args=[Promise(small)]))
+        self.assertEqual(ResultsManager.get_result(total), 45)
+
+    def test_results_of_restarted_agents_fail(self):
+        ones = self.execute(Create(module="numpy", class_="ones", args=[10 ** 6]))
+        ResultsManager.get_result(ones, fetch=False)
+        agent = ResultsManager.get_result(ones, fetch=False).agent
+
+        # registering again means the agent lost its results
+        CommandProcessor.agents.register(agent.address, agent.processes)
+
+        self.assertIsInstance(ResultsManager.get_result(ones), ExecutionFailed)
+        ResultsManager.delete_result(ones)
+        self.assertEqual(len(CommandProcessor.agents.get_stats()), 2)
+
+    def test_lost_response_fails_only_its_command(self):
+        ones = self.execute(Create(module="numpy", class_="ones", args=[10 ** 6]))
+        agent = ResultsManager.get_result(ones, fetch=False).agent
+
+        connection_pool._release(agent.address, LostResponse(agent.address))
+        with self.assertRaises(ConnectionError):
+            agent.execute(str(uuid.uuid4()),
+                          Create(module="builtins", class_="int"))
+
+        self.assertTrue(agent.alive)
+        np.testing.assert_equal(ResultsManager.get_result(ones), np.ones(10 ** 6))
+        total = self.execute(Call(object=Promise(ones), method="sum"))
+        self.assertEqual(ResultsManager.get_result(total), 10 ** 6)
+        ResultsManager.delete_result(ones)
+
+    def test_unknown_results_do_not_stop_watching_agent(self):
+        slow = self.execute(Create(module="time", class_="sleep", args=[0.5]))
+        time.sleep(0.1)
+        agent = next(agent for agent in CommandProcessor.agents.agents.values()
+                     if agent.executing)
+        lost = str(uuid.uuid4())
+        ResultsManager.register_result(lost)
+        with agent.condition:
+            agent.executing['unknown'] = lost, Create(module="builtins",
+                                                      class_="int")
+            agent.condition.notify()
+
+        self.assertIsInstance(ResultsManager.get_result(lost), ExecutionFailed)
+        self.assertIsNone(ResultsManager.get_result(slow))
+        self.assertTrue(agent.alive)
+
+    def test_failures_are_reported(self):
+        failed = self.execute(Create(module="numpy", class_="ones", args=["a"]))
+        self.assertIsInstance(ResultsManager.get_result(failed), ExecutionFailed)
+
+    def test_states_of_commands_on_agents_are_not_kept(self):
+        slow = self.execute(Create(module="time", class_="sleep", args=[0.5]))
+        pool = ConnectionPool()
+        try:
+            for resource in ("progress/", "state/"):
+                response, _ = pool.request(self.server.server_address,
+                                           "GET", resource + slow)
+                self.assertEqual(response.status, 501)
+        finally:
+            pool.close()
+        self.assertIsNone(ResultsManager.get_result(slow))
+        self.assertNotIn(slow, StateManager.completed)
+
+
+if __name__ == '__main__':
+    unittest.main()
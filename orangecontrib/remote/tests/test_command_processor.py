@@ -0,0 +1,209 @@
+import threading
+import time
+import unittest
+import uuid
+
+from orangecontrib.remote.command_processor import CommandProcessor
+from orangecontrib.remote.commands import Abort, Create, Call, Promise, \
+    ExecutionFailed
+from orangecontrib.remote.memo import Memo
+from orangecontrib.remote.results_manager import ResultsManager, \
+    ExternalResult
+from orangecontrib.remote.state_manager import StateManager
+from orangecontrib import remote
+
+
+def wait_for_abort(timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if remote.aborted():
+            return "aborted"
+    return "not aborted"
+
+
+class UnavailableResult(ExternalResult):
+    def fetch(self):
+        raise RuntimeError("Result is not available")
+
+
+class CommandProcessorTests(unittest.TestCase):
+    worker = worker_thread = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.worker = CommandProcessor(processes=2)
+        cls.worker_thread = threading.Thread(
+            name='Processing thread',
+            target=cls.worker.run,
+            kwargs={'poll_interval': 0.01}
+        )
+        cls.worker_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.worker.shutdown()
+        cls.worker_thread.join()
+
+    def execute(self, command):
+        result_id = str(uuid.uuid4())
+        ResultsManager.register_result(result_id)
+        CommandProcessor.queue((result_id, command))
+        return result_id
+
+    def wait(self, result_id):
+        self.assertEqual(ResultsManager.wait_all([result_id], 10), [result_id])
+        return ResultsManager.get_result(result_id)
+
+    def test_waiting_commands_do_not_block_others(self):
+        input_id = str(uuid.uuid4())
+        ResultsManager.register_result(input_id)
+        waiting = self.execute(Call(object=Promise(input_id), method="__len__"))
+
+        independent = self.execute(Create(module="builtins", class_="str",
+                                          args=["abc"]))
+
+        self.assertEqual(self.wait(independent), "abc")
+        self.assertFalse(ResultsManager.has_result(waiting))
+
+        ResultsManager.set_result(input_id, [1, 2])
+        self.assertEqual(self.wait(waiting), 2)
+
+    def test_resolves_promises_in_kwargs_and_containers(self):
+        first = self.execute(Create(module="builtins", class_="list",
+                                    args=[[1, 2]]))
+        second = self.execute(Create(module="builtins", class_="int",
+                                     args=["3"]))
+
+        result = self.execute(Create(
+            module="builtins", class_="dict",
+            kwargs={"a": [Promise(first), {"b": Promise(second)}]}))
+
+        self.assertEqual(self.wait(result), {"a": [[1, 2], {"b": 3}]})
+
+    def test_forgets_commands_that_fail_at_dispatch(self):
+        input_id = str(uuid.uuid4())
+        ResultsManager.register_result(input_id)
+        ResultsManager.set_result(input_id, UnavailableResult())
+        failed = self.execute(Call(object=Promise(input_id), method="__len__"))
+
+        self.assertIsInstance(self.wait(failed), ExecutionFailed)
+        self.assertNotIn(failed, StateManager.completed)
+        ResultsManager.delete_result(input_id)
+
+    def test_aborts_waiting_commands(self):
+        input_id = str(uuid.uuid4())
+        ResultsManager.register_result(input_id)
+        waiting = self.execute(Call(object=Promise(input_id), method="__len__"))
+
+        CommandProcessor.queue((str(uuid.uuid4()), Abort(id=waiting)))
+
+        self.assertIsInstance(self.wait(waiting), ExecutionFailed)
+        ResultsManager.set_result(input_id, [])
+
+    def test_runs_independent_commands_in_parallel(self):
+        first = self.execute(Create(module="time", class_="sleep", args=[0.5]))
+        second = self.execute(Create(module="time", class_="sleep", args=[0.5]))
+        joined = self.execute(Create(module="builtins", class_="tuple",
+                                     args=[[Promise(first), Promise(second)]]))
+
+        self.wait(joined)
+
+        graph = CommandProcessor.graph.describe(joined)
+        self.assertEqual(set(graph['nodes']), {first, second, joined})
+        self.assertEqual(graph['nodes'][joined]['dependencies'], [first, second])
+        self.assertIn(graph['critical_path'], ([first, joined], [second, joined]))
+        self.assertGreaterEqual(graph['critical_path_duration'], 0.5)
+        # the two sleeps overlap
+        first, second = graph['nodes'][first], graph['nodes'][second]
+        self.assertLess(first['started'], second['finished'])
+        self.assertLess(second['started'], first['finished'])
+
+    def abort(self, result_id):
+        CommandProcessor.queue((str(uuid.uuid4()), Abort(id=result_id)))
+
+    def test_running_commands_see_abort(self):
+        running = self.execute(Create(module=__name__, class_="wait_for_abort"))
+        time.sleep(0.2)
+
+        self.abort(running)
+
+        self.assertEqual(self.wait(running), "aborted")
+
+    def test_kills_workers_that_do_not_stop(self):
+        CommandProcessor.abort_timeout = 0.2
+        try:
+            running = self.execute(Create(module="time", class_="sleep", args=[30]))
+            time.sleep(0.2)
+            self.abort(running)
+
+            self.assertIsInstance(self.wait(running), ExecutionFailed)
+        finally:
+            CommandProcessor.abort_timeout = 10
+        # the pool has replaced the worker
+        later = self.execute(Create(module="builtins", class_="int", args=["1"]))
+        self.assertEqual(self.wait(later), 1)
+
+
+    def test_repeated_fit_reuses_memoized_model(self):
+        Memo.allowed = ["Orange.data.Table", "Orange.classification.*"]
+        try:
+            def fit():
+                data = self.execute(Create(module="Orange.data", class_="Table",
+                                           args=["iris"]))
+                learner = self.execute(Create(module="Orange.classification",
+                                              class_="MajorityLearner"))
+                return self.execute(Call(object=Promise(learner), method="__call__",
+                                         args=[Promise(data)]))
+
+            model = self.wait(fit())
+            hits = Memo.get_stats()['hits']
+            again = fit()
+            self.assertTrue(ResultsManager.has_result(again))
+            self.assertIs(self.wait(again), model)
+            self.assertEqual(Memo.get_stats()['hits'], hits + 3)
+        finally:
+            Memo.allowed = []
+            Memo.clear()
+
+    def test_memoized_results_outlive_deleted_originals(self):
+        Memo.allowed = ["numpy.ones"]
+        try:
+            first = self.execute(Create(module="numpy", class_="ones",
+                                        args=[10 ** 6]))
+            self.wait(first)
+            hits = Memo.get_stats()['hits']
+            ResultsManager.delete_result(first)
+
+            again = self.execute(Create(module="numpy", class_="ones",
+                                        args=[10 ** 6]))
+            self.assertEqual(self.wait(again).sum(), 10 ** 6)
+            self.assertEqual(Memo.get_stats()['hits'], hits + 1)
+        finally:
+            Memo.allowed = []
+            Memo.clear()
+
+    def test_does_not_reuse_evicted_results(self):
+        Memo.allowed = ["builtins.bytes"]
+        Memo.max_size = 1500
+        try:
+            first = self.execute(Create(module="builtins", class_="bytes",
+                                        args=[1000]))
+            self.wait(first)
+            self.wait(self.execute(Create(module="builtins", class_="bytes",
+                                          args=[1001])))
+            stats = Memo.get_stats()
+            self.assertEqual(stats['evicted'], 1)
+
+            again = self.execute(Create(module="builtins", class_="bytes",
+                                        args=[1000]))
+            self.assertEqual(self.wait(again), bytes(1000))
+            self.assertEqual(Memo.get_stats()['hits'], stats['hits'])
+            self.assertEqual(Memo.get_stats()['misses'], stats['misses'] + 1)
+        finally:
+            Memo.allowed = []
+            Memo.max_size = 2 ** 30
+            Memo.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
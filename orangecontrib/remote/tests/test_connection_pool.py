@@ -0,0 +1,99 @@
+from http.client import RemoteDisconnected
+import socket
+from socketserver import ThreadingTCPServer
+import threading
+import unittest
+
+from orangecontrib.remote.http_server import OrangeServer
+from orangecontrib.remote.proxy import ConnectionPool, decode_response
+from orangecontrib.remote.results_manager import ResultsManager
+
+
+class LostResponse:
+    """Idle connection that sends requests but loses the responses."""
+    def __init__(self):
+        self.sock, self.peer = socket.socketpair()
+        self.requests = []
+
+    def request(self, method, url, body=None, headers={}):
+        self.requests.append(method)
+
+    def getresponse(self):
+        raise RemoteDisconnected("Remote end closed connection")
+
+    def close(self):
+        self.sock.close()
+        self.peer.close()
+
+
+class ConnectionPoolTests(unittest.TestCase):
+    server = server_thread = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingTCPServer(('localhost', 0), OrangeServer)
+        cls.server.daemon_threads = True
+        cls.server_thread = threading.Thread(
+            name='Orange server serving',
+            target=cls.server.serve_forever,
+            kwargs={'poll_interval': 0.01}
+        )
+        cls.server_thread.start()
+        ResultsManager.set_result('pooled', 'value')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server_thread.join()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.close()
+
+    def get(self, url):
+        return decode_response(*self.pool.request(
+            self.server.server_address, "GET", url))
+
+    def test_reuses_connections(self):
+        self.assertEqual(self.get('object/pooled'), 'value')
+        connection, = self.pool._idle[self.server.server_address]
+
+        self.assertEqual(self.get('object/pooled'), 'value')
+
+        self.assertEqual(self.pool._idle[self.server.server_address],
+                         [connection])
+
+    def test_reconnects_when_idle_connection_is_closed(self):
+        self.get('object/pooled')
+        connection, = self.pool._idle[self.server.server_address]
+        connection.sock.shutdown(socket.SHUT_RDWR)
+
+        self.assertEqual(self.get('object/pooled'), 'value')
+
+    def test_does_not_resend_posts_that_were_sent(self):
+        lost = LostResponse()
+        self.pool._idle[self.server.server_address] = [lost]
+
+        with self.assertRaises(RemoteDisconnected):
+            self.pool.request(self.server.server_address, "POST", "/execute", b"")
+        self.assertEqual(lost.requests, ["POST"])
+
+        lost = LostResponse()
+        self.pool._idle[self.server.server_address] = [lost]
+        self.assertEqual(self.get('object/pooled'), 'value')
+        self.assertEqual(lost.requests, ["GET"])
+
+    def test_does_not_reuse_connections_closed_by_server(self):
+        lost = LostResponse()
+        lost.peer.close()
+        self.pool._idle[self.server.server_address] = [lost]
+
+        self.assertEqual(self.get('object/pooled'), 'value')
+        self.assertEqual(lost.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
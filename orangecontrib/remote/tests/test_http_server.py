@@ -0,0 +1,672 @@
+import asyncio
+from http.client import HTTPConnection
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+
+import numpy as np
+import Orange
+
+from orangecontrib.remote import aborted, remote_module
+from orangecontrib.remote.command_processor import CommandProcessor
+from orangecontrib.remote.http_server import OrangeHTTPServer, OrangeServer
+from orangecontrib.remote.proxy import ConnectionPool, decode_response, \
+    read_response, execute_on_server, fetch_from_server, post_command, BlobCache, \
+    blob_cache, AnonymousProxy, get_many, Pipeline, Proxy, RemoteException, Batch, \
+    wait_any, ResultReleaser, wait_all
+from orangecontrib.remote.remote_module import RemoteModule, ProxyModules, \
+    ClassDescription
+from orangecontrib.remote.results_manager import ResultsManager, BLOB_PREFIX
+from orangecontrib.remote.serialization import STREAM_CONTENT_TYPE, request_headers, \
+    serialize_data, content_hash, data_reference
+from orangecontrib.remote.state_manager import StateManager
+
+
+def report_steps(n):
+    for i in range(n):
+        StateManager.report_progress(step=i, loss=np.float64(1 / (i + 1)))
+    return n
+
+
+def report_slowly(n):
+    for i in range(n):
+        StateManager.report_progress(step=i)
+        time.sleep(0.3)
+    return n
+
+
+def wait_for_abort(timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if aborted():
+            return "aborted"
+    return "not aborted"
+
+
+class OrangeHTTPServerTests(unittest.TestCase):
+    server = server_thread = worker = worker_thread = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = OrangeHTTPServer(('localhost', 0), OrangeServer,
+                                      max_threads=4)
+        cls.server_thread = threading.Thread(
+            name='Orange server serving',
+            target=cls.server.serve_forever,
+            kwargs={'poll_interval': 0.01}
+        )
+        cls.server_thread.start()
+        cls.worker = CommandProcessor()
+        cls.worker_thread = threading.Thread(
+            name='Processing thread',
+            target=cls.worker.run,
+            kwargs={'poll_interval': 0.01}
+        )
+        cls.worker_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server_thread.join()
+        cls.worker.shutdown()
+        cls.worker_thread.join()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.close()
+
+    def request(self, method, url, body=None, headers={}):
+        return decode_response(*self.pool.request(
+            self.server.server_address, method, url, body, headers))
+
+    def test_blocking_get_does_not_stall_other_requests(self):
+        ResultsManager.register_result('blocking')
+        blocked = threading.Thread(
+            target=ConnectionPool().request,
+            args=(self.server.server_address, "GET", 'object/blocking'))
+        blocked.start()
+
+        self.assertEqual(self.request("GET", 'status/blocking'), 'not ready')
+
+        ResultsManager.set_result('blocking', 'done')
+        blocked.join()
+        self.assertEqual(self.request("GET", 'status/blocking'), 'ready')
+
+    def test_idle_connections_do_not_hold_handler_threads(self):
+        server = self.server.server_address
+        idle = [HTTPConnection(*server) for _ in range(8)]
+        for connection in idle:
+            connection.request("GET", '/status/blocking')
+            connection.getresponse().read()
+
+        # with a thread per idle connection this would wait for them to
+        # time out
+        connection = HTTPConnection(*server, timeout=5)
+        connection.request("GET", '/status/blocking')
+        self.assertEqual(connection.getresponse().status, 200)
+        for connection in idle + [connection]:
+            connection.close()
+
+    def test_blocking_requests_are_bounded(self):
+        server = self.server.server_address
+        ResultsManager.register_result('bounded')
+        OrangeServer.max_wait = 0.2
+        try:
+            connection = HTTPConnection(*server, timeout=5)
+            connection.request("GET", '/object/bounded')
+            self.assertEqual(connection.getresponse().status, 202)
+            connection.close()
+            threading.Timer(0.5, ResultsManager.set_result,
+                            ['bounded', 'done']).start()
+            self.assertEqual(fetch_from_server(server, 'object/bounded'), 'done')
+
+            result_id = execute_on_server(server, "create", module=__name__,
+                                          class_="report_slowly", args=[3])
+            records = list(AnonymousProxy(__id__=result_id,
+                                          __server__=server).progress())
+            self.assertEqual([r['step'] for r in records], [0, 1, 2])
+        finally:
+            OrangeServer.max_wait = 30
+
+    def test_streams_objects_to_clients_that_accept_streams(self):
+        ResultsManager.set_result('streamed', np.arange(100000.))
+
+        response, result = self.pool.request(
+            self.server.server_address, "GET", 'object/streamed',
+            headers={"Accept": STREAM_CONTENT_TYPE}, read=read_response)
+
+        self.assertEqual(response.getheader("Transfer-Encoding"), "chunked")
+        np.testing.assert_equal(result, np.arange(100000.))
+        # the connection can be reused after a streamed response
+        self.assertEqual(self.request("GET", 'status/streamed'), 'ready')
+
+    def test_compresses_streams_for_clients_that_ask(self):
+        array = np.zeros(10 ** 6)
+        ResultsManager.set_result('compressed', array)
+        try:
+            Proxy.compression = ('zlib',)
+            response, result = self.pool.request(
+                self.server.server_address, "GET", 'object/compressed',
+                headers=request_headers(Proxy.compression))
+            self.assertLess(len(result), array.nbytes / 100)
+            np.testing.assert_equal(fetch_from_server(
+                self.server.server_address, 'object/compressed'), array)
+        finally:
+            Proxy.compression = ()
+
+    def test_pickles_with_default_protocol_for_old_clients(self):
+        ResultsManager.set_result('old_client', np.arange(10))
+
+        response, data = self.pool.request(
+            self.server.server_address, "GET", 'object/old_client')
+        self.assertEqual(data[1], pickle.DEFAULT_PROTOCOL)
+        np.testing.assert_equal(pickle.loads(data), np.arange(10))
+
+    def test_uploads_arrays_and_tables_as_binary_data(self):
+        array = np.arange(20.).reshape(4, 5)
+        table = Orange.data.Table('iris')
+
+        result_id = execute_on_server(
+            self.server.server_address, "create",
+            module="builtins", class_="tuple",
+            args=[[array, array.T, array[:, ::2], np.array(["a", None]), table]])
+
+        uploaded = fetch_from_server(self.server.server_address, 'object/' + result_id)
+        np.testing.assert_equal(uploaded[0], array)
+        np.testing.assert_equal(uploaded[1], array.T)
+        np.testing.assert_equal(uploaded[2], array[:, ::2])
+        np.testing.assert_equal(uploaded[3], np.array(["a", None]))
+        np.testing.assert_equal(uploaded[4].X, table.X)
+        self.assertEqual(uploaded[4].domain, table.domain)
+
+    def test_sends_known_data_by_hash(self):
+        array = np.random.random(10000)
+        server = self.server.server_address
+        execute_on_server(server, "create", module="builtins", class_="list",
+                          args=[array])
+
+        (digest, on_server, *_), = BlobCache().prepare(server, {"args": [array]}).values()
+        self.assertTrue(on_server)
+        self.assertTrue(ResultsManager.has_result(BLOB_PREFIX + digest))
+
+        result_id = execute_on_server(server, "create", module="builtins",
+                                      class_="list", args=[array])
+        np.testing.assert_equal(fetch_from_server(server, 'object/' + result_id), array)
+
+    def test_resends_data_dropped_by_server(self):
+        array = np.random.random(10000)
+        server = self.server.server_address
+        execute_on_server(server, "create", module="builtins", class_="list",
+                          args=[array])
+        (digest, *_), = blob_cache.prepare(server, {"args": [array]}).values()
+        ResultsManager.delete_result(BLOB_PREFIX + digest)
+
+        result_id = execute_on_server(server, "create", module="builtins",
+                                      class_="list", args=[array])
+
+        np.testing.assert_equal(fetch_from_server(server, 'object/' + result_id), array)
+
+    def test_uploaded_tables_are_read_only(self):
+        table = Orange.data.Table.from_numpy(None, np.random.random((1000, 10)))
+        kind, metadata, parts = serialize_data(table)
+        digest = content_hash(kind, metadata, parts)
+
+        blob = OrangeServer.load_blob(
+            [digest, kind, data_reference(kind, metadata, 0, len(parts))], parts)
+
+        self.assertFalse(blob.X.flags.writeable)
+        ResultsManager.delete_result(BLOB_PREFIX + digest)
+
+    def test_rejects_data_that_does_not_match_hash(self):
+        message = {"create": {"module": "builtins", "class_": "list", "args": [
+            {"__jsonclass__": ["Blob", ["0" * 40, "ndarray", [0, "<f8", [10], "C"]]]}]}}
+        response, data = post_command(
+            self.server.server_address, "/create", json.dumps(message), [np.arange(10.)])
+
+        self.assertEqual(response.status, 400)
+        self.assertFalse(ResultsManager.has_result(BLOB_PREFIX + "0" * 40))
+
+    def post_batch(self, batch):
+        return self.pool.request(
+            self.server.server_address, "POST", "/batch",
+            json.dumps({"batch": batch}), {"Content-Type": "application/json"})
+
+    def test_batch_can_refer_to_earlier_results(self):
+        list_id, len_id = str(uuid.uuid4()), str(uuid.uuid4())
+        response, data = self.post_batch([
+            [list_id, {"create": {"module": "builtins", "class_": "list",
+                                  "args": [[1, 2, 3]]}}],
+            [len_id, {"call": {"object": {"__jsonclass__": ["Promise", list_id]},
+                               "method": "__len__", "args": []}}],
+        ])
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(decode_response(response, data), [list_id, len_id])
+        self.assertEqual(self.request("GET", 'object/' + len_id), 3)
+
+    def test_batch_assigns_missing_ids(self):
+        response, data = self.post_batch([
+            [None, {"create": {"module": "builtins", "class_": "str",
+                               "args": ["abc"]}}],
+        ])
+
+        result_id, = decode_response(response, data)
+        self.assertEqual(self.request("GET", 'object/' + result_id), "abc")
+
+    def test_batch_rejects_ids_that_are_not_uuids(self):
+        for result_id in [BLOB_PREFIX + "0" * 32, "../../etc", "a,b",
+                          str(uuid.uuid4()).upper()]:
+            response, _ = self.post_batch([
+                [result_id, {"create": {"module": "numpy", "class_": "zeros",
+                                        "args": [3]}}],
+            ])
+            self.assertEqual(response.status, 400)
+            self.assertFalse(ResultsManager.awaiting_result(result_id))
+            self.assertFalse(ResultsManager.has_result(result_id))
+
+    def test_batch_rejects_references_to_later_commands(self):
+        list_id, len_id = str(uuid.uuid4()), str(uuid.uuid4())
+        response, data = self.post_batch([
+            [len_id, {"call": {"object": {"__jsonclass__": ["Promise", list_id]},
+                               "method": "__len__", "args": []}}],
+            [list_id, {"create": {"module": "builtins", "class_": "list"}}],
+        ])
+
+        self.assertEqual(response.status, 400)
+        self.assertFalse(ResultsManager.awaiting_result(len_id))
+
+    def test_describes_command_graph(self):
+        server = self.server.server_address
+        list_id = execute_on_server(server, "create", module="builtins",
+                                    class_="list", args=[[1, 2]])
+        len_id = execute_on_server(server, "call", object=AnonymousProxy(__id__=list_id),
+                                   method="__len__", args=[])
+        self.assertEqual(self.request("GET", 'wait/%s?timeout=5' % len_id), 'ready')
+
+        graph = self.request("GET", 'graph/' + len_id)
+
+        self.assertEqual(graph['critical_path'], [list_id, len_id])
+        self.assertEqual(graph['nodes'][len_id]['command'], 'Call __len__')
+        self.assertEqual(graph['nodes'][len_id]['state'], 'done')
+
+    def test_rejects_commands_over_queue_limit(self):
+        CommandProcessor.scheduler.max_queued = 0
+        try:
+            response, data = self.pool.request(
+                self.server.server_address, "POST", "/create",
+                json.dumps({"create": {"module": "builtins", "class_": "list"}}),
+                {"Content-Type": "application/json", "X-Orange-Client": "limited"})
+        finally:
+            CommandProcessor.scheduler.max_queued = None
+
+        self.assertEqual(response.status, 429)
+        self.assertEqual(response.getheader("Retry-After"), "1")
+
+    def test_streams_progress_until_command_completes(self):
+        server = self.server.server_address
+        result_id = execute_on_server(server, "create", module=__name__,
+                                      class_="report_steps", args=[3])
+
+        records = list(AnonymousProxy(__id__=result_id, __server__=server).progress())
+
+        self.assertEqual([r['step'] for r in records], [0, 1, 2])
+        self.assertEqual(records[2]['loss'], 1 / 3)
+        self.assertEqual(fetch_from_server(server, 'object/' + result_id), 3)
+
+    def test_describes_modules_on_first_import(self):
+        contract = RemoteModule(Orange, exclude=["Orange.widgets"])
+        ResultsManager.set_result('contract', contract)
+        modules = ProxyModules(self.server.server_address)
+        modules.cache_path = None
+
+        data = modules.__import__('Orange.data')
+        self.assertEqual(data.Table.__originalclass__, 'Table')
+        self.assertIs(modules.__import__('Orange').data, data)
+        self.assertEqual(sorted(contract.descriptions), ['Orange', 'Orange.data'])
+        # submodules are loaded when accessed
+        self.assertTrue(hasattr(modules.modules['Orange'], 'classification'))
+        self.assertIn('Orange.classification', contract.descriptions)
+        with self.assertRaises(ImportError):
+            modules.__import__('Orange.widgets')
+        with self.assertRaises(ImportError):
+            modules.__import__('numpy')
+
+    def test_reuses_cached_contract_of_the_same_version(self):
+        ResultsManager.set_result('contract', RemoteModule(Orange))
+        server = self.server.server_address
+        with tempfile.TemporaryDirectory() as cache_path:
+            modules = ProxyModules(server)
+            modules.cache_path = cache_path
+            modules.__import__('Orange.data')
+
+            modules = ProxyModules(server)
+            modules.cache_path = cache_path
+            modules.__import__('Orange')
+            self.assertIsNotNone(modules.version)
+            # once the version is confirmed, cached modules need no requests
+            ResultsManager.delete_result('contract')
+            self.assertEqual(modules.__import__('Orange.data').Table.__originalclass__,
+                             'Table')
+
+            ResultsManager.set_result('contract', RemoteModule(Orange, exclude=["Orange.data"]))
+            modules = ProxyModules(server)
+            modules.cache_path = cache_path
+            modules.__import__('Orange')
+            with self.assertRaises(ImportError):
+                modules.__import__('Orange.data')
+
+    def test_caches_contracts_of_servers_without_port(self):
+        modules = RemoteModule.from_server('localhost')
+        modules.cache_path = 'cache'
+        self.assertEqual(modules.cache_file('1', 'Orange'),
+                         os.path.join('cache', 'localhost-80', '1', 'Orange'))
+        modules = RemoteModule.from_server('localhost:9465')
+        modules.cache_path = 'cache'
+        self.assertEqual(modules.cache_file('1', 'Orange'),
+                         os.path.join('cache', 'localhost-9465', '1', 'Orange'))
+
+    def test_contract_version_depends_on_description_format(self):
+        version = RemoteModule(Orange).version
+        self.assertEqual(RemoteModule(Orange).version, version)
+        remote_module.CONTRACT_FORMAT += 1
+        try:
+            self.assertNotEqual(RemoteModule(Orange).version, version)
+        finally:
+            remote_module.CONTRACT_FORMAT -= 1
+
+    def test_keeps_values_of_cacheable_members(self):
+        server = self.server.server_address
+        Table = ClassDescription(Orange.data.Table).create_proxy(server)
+        table = Table('iris')
+
+        domain = table.domain
+        self.assertIsInstance(domain, Orange.data.Domain)
+        self.assertIs(table.domain, domain)
+        self.assertEqual(domain.attributes[0].name, 'sepal length')
+
+        # local copies can be passed back to the server
+        result_id = execute_on_server(server, "create", module="builtins",
+                                      class_="list", args=[[domain]])
+        self.assertEqual(fetch_from_server(server, 'object/' + result_id), [domain])
+
+    def test_prefetches_members_in_one_round_trip(self):
+        server = self.server.server_address
+        Table = ClassDescription(Orange.data.Table).create_proxy(server)
+        table = Table('iris')
+
+        self.assertEqual(list(table.prefetch()), ['domain'])
+        self.assertIsInstance(table.domain, Orange.data.Domain)
+
+        domain = AnonymousProxy(__id__=execute_on_server(
+            server, "call", object=table, method='__getattribute__', args=['domain']),
+            __server__=server)
+        values = domain.prefetch('attributes', 'class_var')
+        self.assertEqual(len(values['attributes']), 4)
+        self.assertIs(domain.class_var, values['class_var'])
+
+    def test_iterates_in_pages(self):
+        Table = ClassDescription(Orange.data.Table).create_proxy(self.server.server_address)
+        table = Table('iris')
+        table.page_size = 40
+
+        rows = list(table)
+
+        self.assertEqual(len(rows), 150)
+        np.testing.assert_equal(np.array([row.x for row in rows]),
+                                Orange.data.Table('iris').X)
+
+    def test_gets_many_values_at_once(self):
+        server = self.server.server_address
+        proxies = [AnonymousProxy(__id__=execute_on_server(
+            server, "create", module="builtins", class_="str", args=[i]),
+            __server__=server) for i in range(5)]
+
+        self.assertEqual(get_many(proxies[::-1]), ['4', '3', '2', '1', '0'])
+
+    def test_gathers_values_asynchronously(self):
+        server = self.server.server_address
+        proxies = [AnonymousProxy(__id__=execute_on_server(
+            server, "create", module="builtins", class_="str", args=[i]),
+            __server__=server) for i in range(20)]
+        array = AnonymousProxy(__id__=execute_on_server(
+            server, "create", module="numpy", class_="arange", args=[100000]),
+            __server__=server)
+
+        async def gather():
+            return await asyncio.gather(array.aget(),
+                                        *(proxy.aget() for proxy in proxies))
+
+        values = asyncio.run(gather())
+        np.testing.assert_equal(values[0], np.arange(100000))
+        self.assertEqual(values[1:], [str(i) for i in range(20)])
+
+    def test_awaits_results(self):
+        ResultsManager.register_result('awaited')
+        proxy = AnonymousProxy(__id__='awaited',
+                               __server__=self.server.server_address)
+        failed = AnonymousProxy(__id__=execute_on_server(
+            self.server.server_address, "call", object=[], method="pop"),
+            __server__=self.server.server_address)
+
+        async def wait():
+            self.assertFalse(await proxy.await_ready(0.05))
+            threading.Timer(0.1, ResultsManager.set_result,
+                            ['awaited', 'done']).start()
+            self.assertTrue(await proxy.await_ready(5))
+            self.assertEqual(await proxy.aget(), 'done')
+            with self.assertRaisesRegex(Exception, "pop from empty list"):
+                await failed.aget()
+
+        asyncio.run(wait())
+
+    def test_awaiting_does_not_block_loop_while_batch_is_sent(self):
+        server = self.server.server_address
+        scheduler = CommandProcessor.scheduler
+        # The batch is refused until the limit is lifted, by the event loop
+        # or, if the loop is blocked, by a timer.
+        scheduler.max_total = 0
+        lifted_by = []
+
+        def lift(by):
+            if scheduler.max_total is not None:
+                lifted_by.append(by)
+                scheduler.max_total = None
+
+        timer = threading.Timer(5, lift, ['timer'])
+        timer.start()
+
+        async def wait(proxy):
+            async def lift_later():
+                await asyncio.sleep(0.1)
+                lift('loop')
+
+            return await asyncio.gather(proxy.aget(), lift_later())
+
+        try:
+            with Batch():
+                proxy = AnonymousProxy(__id__=execute_on_server(
+                    server, "create", module="builtins", class_="int", args=["7"]),
+                    __server__=server)
+                self.assertEqual(asyncio.run(wait(proxy))[0], 7)
+        finally:
+            timer.cancel()
+            scheduler.max_total = None
+        self.assertEqual(lifted_by, ['loop'])
+
+    def test_unknown_results_do_not_fail_other_waiters(self):
+        ResultsManager.register_result('awaited-later')
+        server = self.server.server_address
+        proxy = AnonymousProxy(__id__='awaited-later', __server__=server)
+        unknown = AnonymousProxy(__id__='unknown', __server__=server)
+
+        async def wait():
+            threading.Timer(0.2, ResultsManager.set_result,
+                            ['awaited-later', 'done']).start()
+            return await asyncio.gather(proxy.await_ready(5),
+                                        unknown.await_ready(5),
+                                        return_exceptions=True)
+
+        ready, missing = asyncio.run(wait())
+        self.assertIs(ready, True)
+        self.assertIsInstance(missing, RemoteException)
+
+    def test_runs_pipeline_in_one_job(self):
+        server = self.server.server_address
+        pipeline = Pipeline(server)
+        data = pipeline.create("Orange.data", "Table", "iris")
+        learner = pipeline.create("Orange.classification", "MajorityLearner")
+        model = pipeline.call(learner, "__call__", data)
+        predictions = pipeline.call(model, "__call__", data)
+
+        result = pipeline.run(predictions, learner)
+        values, learner = result.get()
+
+        self.assertEqual(len(values), 150)
+        self.assertIsInstance(learner, Orange.classification.MajorityLearner)
+        graph = self.request("GET", 'graph/' + result.__id__)
+        stages = graph['nodes'][result.__id__]['stages']
+        self.assertEqual([stage['command'] for stage in stages],
+                         ['Create Orange.data.Table', 'Create Orange.classification.MajorityLearner',
+                          'Call __call__', 'Call __call__'])
+        self.assertTrue(all(stage['duration'] >= 0 for stage in stages))
+
+    def test_reports_failed_pipeline_stage(self):
+        pipeline = Pipeline(self.server.server_address)
+        pipeline.call(pipeline.create("builtins", "list"), "pop")
+
+        with self.assertRaisesRegex(Exception, "Stage 1"):
+            pipeline.run().get()
+
+    def test_batch_pipeline_can_refer_to_earlier_results(self):
+        list_id, pipeline_id = str(uuid.uuid4()), str(uuid.uuid4())
+        response, data = self.post_batch([
+            [list_id, {"create": {"module": "builtins", "class_": "list",
+                                  "args": [[3, 1, 2]]}}],
+            [pipeline_id, {"pipeline": {"stages": [
+                {"create": {"module": "builtins", "class_": "sorted",
+                            "args": [{"__jsonclass__": ["Promise", list_id]}]}},
+                {"call": {"object": {"__jsonclass__": ["Stage", 0]},
+                          "method": "__getitem__", "args": [0]}}]}}],
+        ])
+
+        self.assertEqual(decode_response(response, data), [list_id, pipeline_id])
+        self.assertEqual(self.request("GET", 'object/' + pipeline_id), 1)
+
+    def test_aborts_do_not_take_places_of_commands_in_flight(self):
+        server = self.server.server_address
+        scheduler = CommandProcessor.scheduler
+        scheduler.max_in_flight = 1
+        try:
+            running = AnonymousProxy(__id__=execute_on_server(
+                server, "create", module=__name__, class_="wait_for_abort"),
+                __server__=server)
+            time.sleep(0.3)
+            running.abort()
+            self.assertEqual(running.get(), "aborted")
+
+            later = AnonymousProxy(__id__=execute_on_server(
+                server, "create", module="builtins", class_="int", args=["1"]),
+                __server__=server)
+            self.assertTrue(later.wait(10))
+            self.assertEqual(scheduler.get_stats()['in_flight'], {})
+        finally:
+            scheduler.max_in_flight = None
+
+    def test_aborts_commands_held_back_by_limit_of_commands_in_flight(self):
+        server = self.server.server_address
+        scheduler = CommandProcessor.scheduler
+        scheduler.max_in_flight = 1
+        try:
+            running = AnonymousProxy(__id__=execute_on_server(
+                server, "create", module=__name__, class_="wait_for_abort"),
+                __server__=server)
+            held = AnonymousProxy(__id__=execute_on_server(
+                server, "create", module="builtins", class_="int", args=["1"]),
+                __server__=server)
+            time.sleep(0.3)
+            held.abort()
+            with self.assertRaisesRegex(Exception, "Aborted"):
+                held.get()
+            self.assertEqual(scheduler.get_stats()['queued'], {})
+            self.assertEqual(scheduler.get_stats()['total'], 0)
+
+            running.abort()
+            self.assertEqual(running.get(), "aborted")
+            self.assertEqual(scheduler.get_stats()['in_flight'], {})
+        finally:
+            scheduler.max_in_flight = None
+
+    def test_wait_returns_when_result_is_set(self):
+        ResultsManager.register_result('waited')
+        threading.Timer(0.1, ResultsManager.set_result,
+                        ['waited', 'done']).start()
+
+        self.assertEqual(self.request("GET", 'wait/waited?timeout=5'), 'ready')
+
+    def test_wait_times_out(self):
+        ResultsManager.register_result('never')
+
+        self.assertEqual(self.request("GET", 'wait/never?timeout=0.01'),
+                         'not ready')
+
+    def test_wait_any_returns_ready_ids(self):
+        ResultsManager.register_result('first')
+        ResultsManager.register_result('second')
+        ResultsManager.set_result('second', 'done')
+
+        self.assertEqual(
+            self.request("GET", 'wait_any/first,second?timeout=5'), ['second'])
+        self.assertEqual(
+            self.request("GET", 'wait_all/first,second?timeout=0.01'), ['second'])
+
+    def test_waiting_for_no_proxies_returns_at_once(self):
+        ready = []
+        waiter = threading.Thread(target=lambda: ready.append(wait_any([])),
+                                  daemon=True)
+        waiter.start()
+        waiter.join(5)
+        self.assertEqual(ready, [[]])
+
+    def test_waits_for_more_ids_than_fit_in_a_request(self):
+        server = self.server.server_address
+        ids = [str(uuid.uuid4()) for _ in range(2000)]
+        for id in ids:
+            ResultsManager.register_result(id)
+        proxies = [AnonymousProxy(__id__=id, __server__=server) for id in ids]
+        try:
+            ResultsManager.set_result(ids[-1], 'last')
+            self.assertEqual([proxy.__id__ for proxy in wait_any(proxies, 10)],
+                             [ids[-1]])
+
+            for id in ids[:-1]:
+                ResultsManager.set_result(id, id)
+            ready = wait_all(proxies, 10)
+            self.assertEqual(sorted(proxy.__id__ for proxy in ready), sorted(ids))
+        finally:
+            for id in ids:
+                ResultsManager.delete_result(id)
+
+    def test_releases_results_of_batches_after_they_are_sent(self):
+        server = self.server.server_address
+        releaser = ResultReleaser()
+        with Batch():
+            result_id = execute_on_server(
+                server, "create", module="builtins", class_="int", args=["3"])
+            releaser.release(server, result_id)
+            releaser.flush()
+        self.assertEqual(ResultsManager.wait_all([result_id], 5), [result_id])
+
+        releaser.flush()
+        self.assertFalse(ResultsManager.has_result(result_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
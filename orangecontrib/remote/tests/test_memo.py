@@ -0,0 +1,70 @@
+import unittest
+
+import numpy as np
+
+from orangecontrib.remote.commands import Create, Call, Promise, ExecutionFailed
+from orangecontrib.remote.memo import Memo
+
+
+class MemoTests(unittest.TestCase):
+    def setUp(self):
+        Memo.clear()
+        Memo.allowed = ["builtins.list", "builtins.list.*"]
+
+    def tearDown(self):
+        Memo.clear()
+        Memo.allowed = []
+
+    def create(self, *args):
+        return Create(module="builtins", class_="list", args=args)
+
+    def test_reuses_results_of_identical_commands(self):
+        self.assertEqual(Memo.lookup('a', self.create([1, 2])), (False, None))
+        Memo.completed('a', [1, 2])
+
+        self.assertEqual(Memo.lookup('b', self.create([1, 2])), (True, [1, 2]))
+        self.assertEqual(Memo.lookup('c', self.create([1, 3])), (False, None))
+        self.assertEqual(Memo.get_stats()['hits'], 1)
+
+    def test_hashes_array_content(self):
+        Memo.lookup('a', self.create(np.arange(10)))
+        Memo.completed('a', 'result')
+
+        self.assertTrue(Memo.lookup('b', self.create(np.arange(10)))[0])
+        self.assertFalse(Memo.lookup('c', self.create(np.arange(1, 11)))[0])
+
+    def test_promises_refer_to_commands_of_their_results(self):
+        Memo.lookup('a', self.create([1, 2]))
+        Memo.lookup('b', Call(object=Promise('a'), method='copy'))
+        Memo.completed('b', [1, 2])
+        Memo.lookup('c', self.create([1, 2]))
+
+        self.assertTrue(Memo.lookup('d', Call(object=Promise('c'), method='copy'))[0])
+        self.assertFalse(Memo.lookup('e', Call(object=Promise('unknown'), method='copy'))[0])
+
+    def test_only_allowed_commands_are_memoized(self):
+        command = Create(module="builtins", class_="dict")
+        Memo.lookup('a', command)
+        Memo.completed('a', {})
+
+        self.assertFalse(Memo.lookup('b', command)[0])
+
+    def test_failures_are_not_memoized(self):
+        Memo.lookup('a', self.create([1]))
+        Memo.completed('a', ExecutionFailed())
+
+        self.assertFalse(Memo.lookup('b', self.create([1]))[0])
+
+    def test_evicts_least_recently_used(self):
+        Memo.max_size, max_size = 2000, Memo.max_size
+        try:
+            for i in range(3):
+                Memo.lookup(i, self.create([i]))
+                Memo.completed(i, np.zeros(100))
+            stats = Memo.get_stats()
+        finally:
+            Memo.max_size = max_size
+
+        self.assertEqual(stats['evicted'], 1)
+        self.assertFalse(Memo.lookup('x', self.create([0]))[0])
+        self.assertTrue(Memo.lookup('y', self.create([2]))[0])
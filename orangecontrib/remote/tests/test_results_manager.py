@@ -0,0 +1,127 @@
+import unittest
+
+import numpy as np
+import Orange
+
+from orangecontrib.remote.object_store import ObjectStore
+from orangecontrib.remote.results_manager import ResultsManager, estimate_size, \
+    BLOB_PREFIX
+
+
+class ResultsManagerTests(unittest.TestCase):
+    def setUp(self):
+        self.ids = []
+
+    def tearDown(self):
+        ResultsManager.max_size = None
+        ResultsManager.ttl = None
+        ResultsManager.max_blob_size = 2 ** 30
+        ObjectStore.enabled = False
+        ResultsManager.unpin([id for id in self.ids if ResultsManager.pinned[id]])
+        for id in self.ids:
+            ResultsManager.released.discard(id)
+            ResultsManager._discard(id)
+
+    def set_result(self, id, result):
+        self.ids.append(id)
+        ResultsManager.set_result(id, result)
+
+    def test_estimates_size_of_arrays(self):
+        self.assertEqual(estimate_size(np.zeros(100)), 800)
+
+    def test_evicts_least_recently_used_results(self):
+        ResultsManager.max_size = ResultsManager.total_size + 3000
+        self.set_result('lru1', np.zeros(100))
+        self.set_result('lru2', np.zeros(100))
+        ResultsManager.get_result('lru1')
+
+        self.set_result('lru3', np.zeros(200))
+
+        self.assertTrue(ResultsManager.has_result('lru1'))
+        self.assertFalse(ResultsManager.has_result('lru2'))
+        self.assertTrue(ResultsManager.has_result('lru3'))
+
+    def test_does_not_evict_pinned_results(self):
+        ResultsManager.max_size = ResultsManager.total_size + 1000
+        self.set_result('pinned', np.zeros(100))
+        ResultsManager.pin(['pinned'])
+
+        self.set_result('large', np.zeros(100))
+
+        self.assertTrue(ResultsManager.has_result('pinned'))
+
+    def test_evicts_expired_results(self):
+        ResultsManager.ttl = 0
+        self.set_result('expired', 1)
+
+        self.set_result('new', 2)
+
+        self.assertFalse(ResultsManager.has_result('expired'))
+        self.assertTrue(ResultsManager.has_result('new'))
+
+    def test_bounds_blobs_on_their_own(self):
+        ResultsManager.max_blob_size = 2000
+        self.set_result(BLOB_PREFIX + 'a', np.zeros(100))
+        self.set_result(BLOB_PREFIX + 'b', np.zeros(100))
+        self.set_result('not a blob', np.zeros(1000))
+        ResultsManager.get_result(BLOB_PREFIX + 'a')
+
+        self.set_result(BLOB_PREFIX + 'c', np.zeros(100))
+
+        self.assertTrue(ResultsManager.has_result(BLOB_PREFIX + 'a'))
+        self.assertFalse(ResultsManager.has_result(BLOB_PREFIX + 'b'))
+        self.assertTrue(ResultsManager.has_result(BLOB_PREFIX + 'c'))
+        self.assertTrue(ResultsManager.has_result('not a blob'))
+
+    def test_delete_waits_for_unpin(self):
+        self.set_result('deleted', 1)
+        ResultsManager.pin(['deleted'])
+
+        ResultsManager.delete_result('deleted')
+        self.assertTrue(ResultsManager.has_result('deleted'))
+
+        ResultsManager.unpin(['deleted'])
+        self.assertFalse(ResultsManager.has_result('deleted'))
+
+    def test_held_results_stay_until_deleted(self):
+        ResultsManager.ttl = 0
+        ResultsManager.register_result('held')
+        ResultsManager.hold('held')
+        self.set_result('held', 1)
+
+        self.set_result('new', 2)
+        self.assertTrue(ResultsManager.has_result('held'))
+
+        ResultsManager.delete_result('held')
+        self.assertFalse(ResultsManager.has_result('held'))
+        self.assertFalse(ResultsManager.pinned['held'])
+
+    def test_delete_raises_key_error_for_unknown_results(self):
+        self.assertRaises(KeyError, ResultsManager.delete_result, 'unknown')
+
+    def test_spills_evicted_results_to_disk(self):
+        ObjectStore.enabled = True
+        ResultsManager.max_size = ResultsManager.total_size + 1000
+        self.set_result('spilled', np.arange(100.))
+
+        self.set_result('large', np.zeros(100))
+
+        self.assertNotIn('spilled', ResultsManager.results)
+        self.assertTrue(ResultsManager.has_result('spilled'))
+        np.testing.assert_equal(ResultsManager.get_result('spilled'), np.arange(100.))
+
+    def test_object_store_maps_table_buffers(self):
+        table = Orange.data.Table('iris')
+        ObjectStore.save('table', table)
+        try:
+            loaded = ObjectStore.load('table')
+        finally:
+            ObjectStore.delete('table')
+
+        np.testing.assert_equal(loaded.X, table.X)
+        self.assertEqual(loaded.domain, table.domain)
+        self.assertFalse(loaded.X.flags.owndata)
+
+
+if __name__ == '__main__':
+    unittest.main()
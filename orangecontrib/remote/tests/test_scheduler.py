@@ -0,0 +1,64 @@
+import queue
+import unittest
+
+from orangecontrib.remote.scheduler import Scheduler, Overloaded, PRIORITIES
+
+
+class SchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler()
+
+    def submit(self, id, client=None, priority='normal'):
+        self.scheduler.admit([id], client, PRIORITIES[priority])
+        self.scheduler.put(id, None)
+
+    def take(self, n):
+        return [self.scheduler.get(block=False)[0] for _ in range(n)]
+
+    def test_takes_commands_by_priority(self):
+        self.submit('low', priority='low')
+        self.submit('normal')
+        self.submit('high', priority='high')
+
+        self.assertEqual(self.take(3), ['high', 'normal', 'low'])
+
+    def test_shares_work_between_clients(self):
+        for i in range(3):
+            self.submit('a%d' % i, 'a')
+        self.submit('b0', 'b')
+        self.submit('b1', 'b')
+
+        self.assertEqual(self.take(5), ['a0', 'b0', 'a1', 'b1', 'a2'])
+
+    def test_limits_commands_in_flight(self):
+        self.scheduler.max_in_flight = 1
+        self.submit('a0', 'a')
+        self.submit('a1', 'a')
+
+        self.assertEqual(self.take(1), ['a0'])
+        self.assertRaises(queue.Empty, self.scheduler.get, block=False)
+
+        self.scheduler.done('a0')
+        self.assertEqual(self.take(1), ['a1'])
+
+    def test_rejects_commands_over_limits(self):
+        self.scheduler.max_queued = 1
+        self.scheduler.max_total = 2
+        self.submit('a0', 'a')
+
+        with self.assertRaises(Overloaded) as cm:
+            self.submit('a1', 'a')
+        self.assertEqual(cm.exception.status, 429)
+
+        self.submit('b0', 'b')
+        with self.assertRaises(Overloaded) as cm:
+            self.submit('c0', 'c')
+        self.assertEqual(cm.exception.status, 503)
+
+        # Executing commands do not count as queued.
+        self.take(1)
+        self.submit('a1', 'a')
+
+
+if __name__ == '__main__':
+    unittest.main()
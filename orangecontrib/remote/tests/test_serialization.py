@@ -0,0 +1,77 @@
+import io
+import pickle
+import unittest
+
+import numpy as np
+import Orange
+
+from orangecontrib.remote.serialization import dump_stream, load_stream, \
+    negotiate, request_headers, STREAM_CONTENT_TYPE, CODECS_HEADER, PROTOCOL_HEADER
+
+
+class StreamSerializationTests(unittest.TestCase):
+    def round_trip(self, obj, codec=None):
+        f = io.BytesIO()
+        dump_stream(obj, f.write, codec)
+        f.seek(0)
+        return load_stream(f)
+
+    def test_round_trips_arrays(self):
+        array = np.arange(1000.).reshape(10, 100)
+
+        loaded = self.round_trip(array)
+
+        np.testing.assert_equal(loaded, array)
+        self.assertTrue(loaded.flags.writeable)
+
+    def test_round_trips_non_contiguous_arrays(self):
+        array = np.arange(1000.).reshape(10, 100)[:, ::3]
+
+        np.testing.assert_equal(self.round_trip(array), array)
+
+    def test_round_trips_tables(self):
+        table = Orange.data.Table('iris')
+
+        loaded = self.round_trip(table)
+
+        np.testing.assert_equal(loaded.X, table.X)
+        self.assertEqual(loaded.domain, table.domain)
+
+    def test_round_trips_plain_objects(self):
+        obj = {"a": [1, 2, "3"], "b": b"x" * 100000}
+
+        self.assertEqual(self.round_trip(obj), obj)
+
+
+    def test_compresses_large_buffers(self):
+        table = Orange.data.Table.from_numpy(
+            None, np.repeat(np.arange(300000.).reshape(-1, 3), 4, axis=0))
+        noise = np.random.random(300000)
+
+        f = io.BytesIO()
+        dump_stream([table, noise], f.write, 'zlib')
+        self.assertLess(len(f.getvalue()), table.X.nbytes / 2 + noise.nbytes * 1.01)
+
+        loaded_table, loaded_noise = self.round_trip([table, noise], 'zlib')
+        np.testing.assert_equal(loaded_table.X, table.X)
+        np.testing.assert_equal(loaded_noise, noise)
+        self.assertTrue(loaded_noise.flags.writeable)
+
+
+class NegotiationTests(unittest.TestCase):
+    def test_clients_ask_for_streams_and_codecs(self):
+        headers = request_headers(['snappy', 'zlib'])
+
+        self.assertEqual(negotiate(headers), (True, pickle.HIGHEST_PROTOCOL, 'zlib'))
+        self.assertEqual(headers[CODECS_HEADER], 'zlib')
+
+    def test_old_clients_get_default_protocol(self):
+        self.assertEqual(negotiate({}), (False, pickle.DEFAULT_PROTOCOL, None))
+        self.assertEqual(negotiate({PROTOCOL_HEADER: "99"}),
+                         (False, pickle.HIGHEST_PROTOCOL, None))
+        self.assertEqual(negotiate({"Accept": STREAM_CONTENT_TYPE,
+                                    CODECS_HEADER: "unknown"})[2], None)
+
+
+if __name__ == '__main__':
+    unittest.main()
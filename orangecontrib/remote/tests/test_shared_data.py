@@ -0,0 +1,159 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+import uuid
+from multiprocessing import shared_memory
+
+import numpy as np
+import Orange
+
+from orangecontrib.remote.command_processor import CommandProcessor
+from orangecontrib.remote.commands import Abort, Create, Call, Promise
+from orangecontrib.remote.memo import Memo
+from orangecontrib.remote.results_manager import ResultsManager
+from orangecontrib.remote.shared_data import SharedResult
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))))
+
+
+def read_after_killing_worker():
+    """Compute a shared result, kill the worker that computed it and
+    return the sum of the result."""
+    worker = CommandProcessor(processes=1)
+    worker_thread = threading.Thread(target=worker.run,
+                                     kwargs={'poll_interval': 0.01})
+    worker_thread.start()
+    ones, running = str(uuid.uuid4()), str(uuid.uuid4())
+    try:
+        ResultsManager.register_result(ones)
+        CommandProcessor.queue((ones, Create(module="numpy", class_="ones",
+                                             args=[10 ** 6])))
+        ResultsManager.get_result(ones, fetch=False)
+        CommandProcessor.abort_timeout = 0.2
+        ResultsManager.register_result(running)
+        CommandProcessor.queue((running, Create(module="time", class_="sleep",
+                                                args=[30])))
+        time.sleep(0.2)
+        CommandProcessor.queue((str(uuid.uuid4()), Abort(id=running)))
+        ResultsManager.wait_all([running], 10)
+        time.sleep(0.5)
+        return ResultsManager.get_result(ones).sum()
+    finally:
+        ResultsManager.delete_result(ones)
+        worker.shutdown()
+        worker_thread.join()
+
+
+class SharedResultTests(unittest.TestCase):
+    def test_small_values_are_not_shared(self):
+        self.assertIsNone(SharedResult.create(np.arange(10)))
+        self.assertIsNone(SharedResult.create("a" * 2 ** 21))
+
+    def test_fetches_copy_on_write_views(self):
+        array = np.random.random((1000, 300))
+        shared = SharedResult.create(array.T)
+        try:
+            first, second = shared.fetch(), shared.fetch()
+            np.testing.assert_equal(first, array.T)
+            first[0, 0] = -1
+            self.assertEqual(second[0, 0], array[0, 0])
+        finally:
+            shared.release()
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(shared.name)
+        with self.assertRaises(KeyError):
+            shared.fetch()
+
+    def test_shares_tables(self):
+        table = Orange.data.Table.from_numpy(None, np.random.random((5000, 50)))
+        shared = SharedResult.create(table)
+        try:
+            np.testing.assert_equal(shared.fetch().X, table.X)
+        finally:
+            shared.release()
+
+
+class SharedDataProcessingTests(unittest.TestCase):
+    worker = worker_thread = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.worker = CommandProcessor(processes=2)
+        cls.worker_thread = threading.Thread(
+            name='Processing thread',
+            target=cls.worker.run,
+            kwargs={'poll_interval': 0.01}
+        )
+        cls.worker_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.worker.shutdown()
+        cls.worker_thread.join()
+
+    def execute(self, command):
+        result_id = str(uuid.uuid4())
+        ResultsManager.register_result(result_id)
+        CommandProcessor.queue((result_id, command))
+        return result_id
+
+    def test_large_results_stay_in_shared_memory(self):
+        ones = self.execute(Create(module="numpy", class_="ones", args=[10 ** 6]))
+        total = self.execute(Call(object=Promise(ones), method="sum"))
+
+        self.assertEqual(ResultsManager.get_result(total), 10 ** 6)
+        shared = ResultsManager.get_result(ones, fetch=False)
+        self.assertIsInstance(shared, SharedResult)
+
+        ResultsManager.delete_result(ones)
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(shared.name)
+
+    def test_large_uploaded_data_is_shared_once(self):
+        data_id = str(uuid.uuid4())
+        ResultsManager.set_result(data_id, np.arange(10 ** 6))
+        first = self.execute(Call(object=Promise(data_id), method="max"))
+        self.assertEqual(ResultsManager.get_result(first), 10 ** 6 - 1)
+        shared = ResultsManager.get_result(data_id, fetch=False)
+
+        second = self.execute(Call(object=Promise(data_id), method="min"))
+        self.assertEqual(ResultsManager.get_result(second), 0)
+        self.assertIs(ResultsManager.get_result(data_id, fetch=False), shared)
+        ResultsManager.delete_result(data_id)
+
+    def test_large_results_are_memoized(self):
+        Memo.clear()
+        Memo.allowed = ["numpy.ones"]
+        try:
+            first = self.execute(Create(module="numpy", class_="ones", args=[500000]))
+            np.testing.assert_equal(ResultsManager.get_result(first), np.ones(500000))
+            second = self.execute(Create(module="numpy", class_="ones", args=[500000]))
+            np.testing.assert_equal(ResultsManager.get_result(second), np.ones(500000))
+            self.assertEqual(Memo.get_stats()['hits'], 1)
+
+            shared = ResultsManager.get_result(first, fetch=False)
+            self.assertIsInstance(shared, SharedResult)
+            ResultsManager.delete_result(first)
+            np.testing.assert_equal(ResultsManager.get_result(second), np.ones(500000))
+            ResultsManager.delete_result(second)
+            Memo.clear()
+            with self.assertRaises(FileNotFoundError):
+                shared_memory.SharedMemory(shared.name)
+        finally:
+            Memo.clear()
+            Memo.allowed = []
+
+    def test_results_outlive_killed_workers(self):
+        # in a new process, whose workers have their own resource trackers
+        script = ("from orangecontrib.remote.tests.test_shared_data import *; "
+                  "print(read_after_killing_worker())")
+        process = subprocess.run(
+            [sys.executable, "-c", script], env=dict(os.environ, PYTHONPATH=ROOT),
+            capture_output=True, text=True, timeout=60)
+
+        self.assertEqual(process.stdout.strip(), "1000000.0", process.stderr)
+        self.assertNotIn("leaked", process.stderr)
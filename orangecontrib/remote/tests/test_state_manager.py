@@ -0,0 +1,28 @@
+import queue
+import threading
+import unittest
+
+from orangecontrib.remote.state_manager import StateManager
+
+
+class StateManagerTests(unittest.TestCase):
+    def test_states_are_sent_as_they_were_saved(self):
+        channel = queue.Queue()
+        listener = threading.Thread(target=StateManager.listen, args=(channel,))
+        listener.start()
+        StateManager.channel = channel
+        try:
+            state = {'epoch': 1}
+            StateManager.save_state(state, id='saved-state')
+            state['epoch'] = 2
+        finally:
+            StateManager.channel = None
+            channel.put(None)
+            listener.join()
+
+        self.assertEqual(StateManager.get_state('saved-state'), {'epoch': 1})
+        StateManager.delete_state('saved-state', force=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import threading
+import time
+import unittest
+import uuid
+
+from orangecontrib.remote.command_processor import CommandProcessor
+from orangecontrib.remote.commands import Abort, Create, Call, Promise, \
+    ExecutionFailed
+from orangecontrib.remote.http_server import OrangeHTTPServer, OrangeServer
+from orangecontrib.remote.proxy import AnonymousProxy, execute_on_server, \
+    fetch_from_server
+from orangecontrib.remote.results_manager import ResultsManager
+from orangecontrib.remote.worker_pool import Resident
+
+
+def hold(obj, seconds):
+    time.sleep(seconds)
+    return obj
+
+
+class BlockedResident(Resident):
+    """Result whose transfer from its worker waits until it is unblocked."""
+    def __init__(self, value):
+        super().__init__(None, None, 0)
+        self.value = value
+        self.unblocked = threading.Event()
+
+    def fetch(self):
+        self.unblocked.wait(10)
+        return self.value
+
+    def release(self):
+        pass
+
+
+class WorkerPoolTests(unittest.TestCase):
+    server = server_thread = worker = worker_thread = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = OrangeHTTPServer(('localhost', 0), OrangeServer,
+                                      max_threads=4)
+        cls.server_thread = threading.Thread(
+            name='Orange server serving',
+            target=cls.server.serve_forever,
+            kwargs={'poll_interval': 0.01}
+        )
+        cls.server_thread.start()
+        cls.worker = CommandProcessor(affinity=True, processes=2)
+        cls.worker_thread = threading.Thread(
+            name='Processing thread',
+            target=cls.worker.run,
+            kwargs={'poll_interval': 0.01}
+        )
+        cls.worker_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server_thread.join()
+        cls.worker.shutdown()
+        cls.worker_thread.join()
+        cls.server.server_close()
+
+    def execute(self, command):
+        result_id = str(uuid.uuid4())
+        ResultsManager.register_result(result_id)
+        CommandProcessor.queue((result_id, command))
+        return result_id
+
+    def test_results_stay_in_worker(self):
+        list_id = self.execute(Create(module="builtins", class_="list",
+                                      args=[[1, 2, 3]]))
+        # Calls on a resident object see the same object, not a copy.
+        self.execute(Call(object=Promise(list_id), method="append", args=[4]))
+        len_id = self.execute(Call(object=Promise(list_id), method="__len__"))
+
+        self.assertEqual(ResultsManager.get_result(len_id), 4)
+        self.assertIsInstance(
+            ResultsManager.get_result(list_id, fetch=False), Resident)
+        self.assertEqual(ResultsManager.get_result(list_id), [1, 2, 3, 4])
+
+    def test_commands_over_http_use_resident_results(self):
+        server = self.server.server_address
+        items = AnonymousProxy(__id__=execute_on_server(
+            server, "create", module="builtins", class_="list", args=[[1, 2, 3]]),
+            __server__=server)
+        items.wait()
+
+        # promises of ready results are not fetched while parsing requests
+        execute_on_server(server, "call", object=items, method="append", args=[4])
+        len_id = execute_on_server(server, "call", object=items, method="__len__")
+
+        self.assertEqual(fetch_from_server(server, 'object/' + len_id), 4)
+        self.assertIsInstance(
+            ResultsManager.get_result(items.__id__, fetch=False), Resident)
+
+    def test_moves_results_between_workers(self):
+        first = self.execute(Create(module="builtins", class_="list",
+                                    args=[[1, 2]]))
+        ResultsManager.get_result(first)
+        second = self.execute(Create(module="builtins", class_="list",
+                                     args=[[3]]))
+        ResultsManager.get_result(second)
+
+        joined = self.execute(Call(object=Promise(first), method="__add__",
+                                   args=[Promise(second)]))
+
+        self.assertEqual(ResultsManager.get_result(joined), [1, 2, 3])
+
+    def test_moving_results_does_not_hold_up_other_commands(self):
+        first = self.execute(Create(module="builtins", class_="list",
+                                    args=[[1, 2]]))
+        ResultsManager.get_result(first, fetch=False)
+        moved = str(uuid.uuid4())
+        blocked = BlockedResident([3])
+        ResultsManager.register_result(moved)
+        ResultsManager.set_result(moved, blocked)
+
+        joined = self.execute(Call(object=Promise(first), method="__add__",
+                                   args=[Promise(moved)]))
+        other = self.execute(Create(module="builtins", class_="int", args=["1"]))
+
+        self.assertEqual(ResultsManager.get_result(other), 1)
+        self.assertFalse(ResultsManager.has_result(joined))
+        blocked.unblocked.set()
+        self.assertEqual(ResultsManager.get_result(joined), [1, 2, 3])
+        ResultsManager.delete_result(moved)
+
+    def test_aborts_commands_while_their_inputs_are_moved(self):
+        first = self.execute(Create(module="builtins", class_="list",
+                                    args=[[1, 2]]))
+        ResultsManager.get_result(first, fetch=False)
+        moved = str(uuid.uuid4())
+        blocked = BlockedResident([3])
+        ResultsManager.register_result(moved)
+        ResultsManager.set_result(moved, blocked)
+
+        joined = self.execute(Call(object=Promise(first), method="__add__",
+                                   args=[Promise(moved)]))
+        time.sleep(0.2)
+        CommandProcessor.queue((str(uuid.uuid4()), Abort(id=joined)))
+        time.sleep(0.2)
+        blocked.unblocked.set()
+
+        self.assertIsInstance(ResultsManager.get_result(joined), ExecutionFailed)
+        ResultsManager.delete_result(moved)
+
+    def test_deleted_results_are_released(self):
+        list_id = self.execute(Create(module="builtins", class_="list"))
+        resident = ResultsManager.get_result(list_id, fetch=False)
+
+        ResultsManager.delete_result(list_id)
+
+        self.assertRaises(KeyError, resident.fetch)
+
+    def test_results_of_killed_worker_fail(self):
+        list_id = self.execute(Create(module="builtins", class_="list"))
+        ResultsManager.get_result(list_id, fetch=False)
+        CommandProcessor.abort_timeout = 0.2
+        try:
+            # runs on the worker that has the list
+            running = self.execute(Create(module=__name__, class_="hold",
+                                          args=[Promise(list_id), 30]))
+            time.sleep(0.2)
+            CommandProcessor.queue((str(uuid.uuid4()), Abort(id=running)))
+
+            self.assertEqual(ResultsManager.wait_all([running], 10), [running])
+        finally:
+            CommandProcessor.abort_timeout = 10
+        self.assertIsInstance(ResultsManager.get_result(running), ExecutionFailed)
+        for _ in range(100):
+            if not isinstance(ResultsManager.get_result(list_id, fetch=False),
+                              Resident):
+                break
+            time.sleep(0.05)
+        self.assertIsInstance(ResultsManager.get_result(list_id), ExecutionFailed)
+
+
+if __name__ == '__main__':
+    unittest.main()
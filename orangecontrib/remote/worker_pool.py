@@ -0,0 +1,271 @@
+""" Worker processes that keep the results of the commands they execute.
+
+Results stay in the process that computed them and the server only keeps
+a placeholder. Commands that use a result are sent to the process that
+has it, so calling a method of a large model or table does not pickle it
+across the process boundary. Results are moved only when they are needed
+elsewhere: when a client downloads them, when a command on another worker
+uses them or when they are spilled to disk.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+
+from orangecontrib.remote.commands import execute_timed, ExecutionFailed, \
+    Promise, initialize_worker
+from orangecontrib.remote.results_manager import ResultsManager, \
+    ExternalResult, estimate_size
+from orangecontrib.remote.state_manager import StateManager
+
+# Results of these types are cheaper to send back than to keep track of.
+PLAIN_TYPES = (type(None), bool, int, float, complex, str, ExecutionFailed)
+
+
+class Resident(ExternalResult):
+    """Result that is kept in a worker process."""
+    def __init__(self, worker, id, size):
+        self.worker = worker
+        self.id = id
+        self.size = size
+
+    def fetch(self):
+        return self.worker.fetch(self.id)
+
+    def release(self):
+        self.worker.release(self.id)
+
+
+class Worker:
+    """Server side of a worker process."""
+    logger = logging.getLogger("worker")
+
+    def __init__(self, on_completed, on_exit=None, initargs=()):
+        self.on_completed = on_completed
+        self.on_exit = on_exit
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=worker_main, args=(child_connection, initargs), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+        self.send_lock = threading.Lock()
+        self.alive = True
+        self.executing = {}
+        self.residents = {}
+        self.requests = {}
+        self.request_ids = itertools.count()
+        self.reader = threading.Thread(
+            name='Worker %d replies' % self.process.pid,
+            target=self.read_replies, daemon=True)
+        self.reader.start()
+
+    def execute(self, id, command, abort_slot=None):
+        self.executing[id] = command
+        try:
+            self.send(('execute', id, command, abort_slot))
+        except OSError:
+            self.executing.pop(id, None)
+            self.alive = False
+            raise
+
+    def fetch(self, id):
+        request_id = next(self.request_ids)
+        reply = self.requests[request_id] = [threading.Event(), False, None]
+        try:
+            self.send(('fetch', request_id, id))
+        except OSError:
+            raise KeyError(id)
+        reply[0].wait()
+        _, found, value = reply
+        if not found:
+            raise KeyError(id)
+        return value
+
+    def release(self, id):
+        self.residents.pop(id, None)
+        try:
+            self.send(('release', id))
+        except OSError:
+            pass
+
+    def send(self, message):
+        with self.send_lock:
+            self.connection.send(message)
+
+    def read_replies(self):
+        while True:
+            try:
+                message = self.connection.recv()
+            except (EOFError, OSError):
+                self.alive = False
+                break
+            kind = message[0]
+            if kind == 'done':
+                _, id, value, timing = message
+                self.executing.pop(id, None)
+                self.on_completed((id, value, timing))
+            elif kind == 'resident':
+                _, id, size, timing = message
+                self.executing.pop(id, None)
+                resident = self.residents[id] = Resident(self, id, size)
+                self.on_completed((id, resident, timing))
+            elif kind == 'value':
+                _, request_id, found, value = message
+                reply = self.requests.pop(request_id)
+                reply[1:] = found, value
+                reply[0].set()
+
+        # The process is gone, so are all of its results.
+        for id, command in list(self.executing.items()):
+            self.on_completed((id, ExecutionFailed(
+                command, RuntimeError("Worker process exited")), None))
+            StateManager.delete_state(id, force=True)
+        self.executing.clear()
+        for id, resident in list(self.residents.items()):
+            ResultsManager.replace_result(id, resident, ExecutionFailed(
+                id, RuntimeError("Worker process with the result exited")))
+        self.residents.clear()
+        for reply in list(self.requests.values()):
+            reply[0].set()
+        if self.on_exit is not None:
+            self.on_exit(self)
+
+    def terminate(self):
+        self.process.terminate()
+        self.process.join()
+        self.connection.close()
+
+
+def worker_main(connection, initargs):
+    if initargs:
+        initialize_worker(*initargs)
+    objects = {}
+    commands = queue.Queue()
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            connection.send(message)
+
+    def execute():
+        while True:
+            id, command, abort_slot = commands.get()
+            try:
+                command.resolve_promises(lambda promise: objects[promise.id])
+            except KeyError as err:
+                StateManager.end(id)
+                send(('done', id, ExecutionFailed(
+                    command, KeyError("Result %s is not available" % err)), None))
+                continue
+            id, value, timing = execute_timed(id, command, abort_slot)
+            if isinstance(value, PLAIN_TYPES):
+                send(('done', id, value, timing))
+            else:
+                objects[id] = value
+                send(('resident', id, estimate_size(value), timing))
+
+    threading.Thread(target=execute, daemon=True).start()
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            break
+        kind = message[0]
+        if kind == 'execute':
+            commands.put(message[1:])
+        elif kind == 'fetch':
+            _, request_id, id = message
+            try:
+                send(('value', request_id, id in objects, objects.get(id)))
+            except Exception as err:
+                logging.getLogger("worker").exception(err)
+                send(('value', request_id, False, None))
+        elif kind == 'release':
+            objects.pop(message[1], None)
+
+
+class WorkerPool:
+    """Routes commands to the worker that has the results they use."""
+    logger = logging.getLogger("worker")
+
+    def __init__(self, processes=None, on_completed=None, initargs=()):
+        processes = processes or os.cpu_count() or 1
+        self.on_completed = on_completed
+        self.initargs = initargs
+        self.workers = [Worker(on_completed, self.replace, initargs)
+                        for _ in range(processes)]
+        self.terminating = False
+        self.lock = threading.Lock()
+
+    def replace(self, worker):
+        """Start a new process in place of one that exited."""
+        with self.lock:
+            if self.terminating or worker not in self.workers:
+                return
+            self.logger.info("Replacing worker process %d", worker.process.pid)
+            self.workers[self.workers.index(worker)] = \
+                Worker(self.on_completed, self.replace, self.initargs)
+
+    def submit(self, id, command, abort_slot=None):
+        """Send the command to a worker. Results it uses must be ready."""
+        residents = {}
+        for promise in command.promises():
+            result = ResultsManager.get_result(promise.id, fetch=False)
+            if isinstance(result, Resident):
+                residents[promise.id] = result
+
+        worker = self.choose_worker(command, residents)
+
+        def resolve(promise):
+            resident = residents.get(promise.id)
+            if resident is not None and resident.worker is worker:
+                return promise
+            return ResultsManager.get_result(promise.id)
+
+        if all(resident.worker is worker for resident in residents.values()):
+            command.resolve_promises(resolve)
+            self.execute(id, command, worker, abort_slot)
+            return
+        # Results are moved on another thread, so that a large transfer
+        # does not hold up dispatching of other commands.
+        threading.Thread(
+            name='Inputs of %s' % id, target=self.transfer,
+            args=(id, command, worker, resolve, abort_slot), daemon=True).start()
+
+    def transfer(self, id, command, worker, resolve, abort_slot):
+        try:
+            command.resolve_promises(resolve)
+            # commands aborted meanwhile are not executed by the worker
+            self.execute(id, command, worker, abort_slot)
+        except Exception as err:
+            self.logger.exception(err)
+            self.on_completed((id, ExecutionFailed(command, err), None))
+            StateManager.delete_state(id, force=True)
+
+    def execute(self, id, command, worker, abort_slot):
+        try:
+            worker.execute(id, command, abort_slot)
+        except OSError:
+            if any(True for _ in command.promises()):
+                raise RuntimeError("Worker with results of the command exited")
+            # The worker exited before it was replaced.
+            self.replace(worker)
+            self.choose_worker(command, {}).execute(id, command, abort_slot)
+
+    def choose_worker(self, command, residents):
+        obj = getattr(command, 'object', None)
+        if isinstance(obj, Promise) and obj.id in residents:
+            return residents[obj.id].worker
+        if residents:
+            return max(residents.values(), key=lambda r: r.size).worker
+        alive = [worker for worker in self.workers if worker.alive] or self.workers
+        return min(alive, key=lambda worker: len(worker.executing))
+
+    def terminate(self):
+        with self.lock:
+            self.terminating = True
+        for worker in self.workers:
+            worker.terminate()
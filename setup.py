@@ -54,6 +54,8 @@ INSTALL_REQUIRES = (
 )
 
 EXTRAS_REQUIRE = {
+    # Faster compression of results
+    'lz4': ('lz4',),
     'GUI': (
     # Dependencies which are problematic to install automatically
     #'PyQt', # No setup.py